@@ -1,25 +1,83 @@
-import os
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query, Response
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 import uvicorn
 from src.auth import AuthManager 
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from src.stt import STT
+from datetime import timedelta
+from src.tokens import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
+from src.stt import get_stt_backend
 from src.llm import LLM
 from src.tts import TTS
-from src.conversation import ConversationManager
-from src.config import USE_SUPABASE
+from src.embeddings import get_embedding_service
+from src.tts_cache import get_tts_cache
+from src.session import VoiceSession
+from src.session_registry import get_session_registry
+from src.connections import ConnectionManager
+from src.audio import AudioCodec
+from src.background import get_background_worker
+from src.memory_store import get_memory_store
+from src.warmup import Warmup
+from src.write_behind import get_write_behind
+from src.db import open_supabase, close_supabase
+from src import metrics
+from src.config import USE_SUPABASE, TTS_PREWARM_PHRASES, WEB_WORKERS, SESSION_REGISTRY, INPUT_SAMPLE_RATE
+from contextlib import asynccontextmanager
 import asyncio
-
-# Environment variables
-SECRET_KEY = os.environ.get("SUPABASE_JWT_SECRET") 
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-app = FastAPI()
+import uuid
+
+# Token settings live in src.tokens so tools can mint tokens without the app.
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One database client and connection pool for the whole process.
+    if USE_SUPABASE:
+        await open_supabase()
+    # Load shared models once per process instead of once per WebSocket session,
+    # in the background so the server is up at once; /ready reports when they are.
+    embedding_service = get_embedding_service()
+    if USE_SUPABASE:
+        # Fails here, not on the first session, if the store doesn't fit the deployment.
+        get_memory_store()
+    stt_backend = get_stt_backend()
+    models = {"stt": stt_backend.start}
+    if USE_SUPABASE:
+        models["embeddings"] = embedding_service.start
+    warmup.start(models)
+    await LLM.open_session()
+    tts_cache = get_tts_cache()
+    await tts_cache.open()
+    # Pre-warming needs edge-tts round trips, so it must not hold up startup.
+    prewarm = asyncio.create_task(tts_cache.prewarm(TTS(cache=tts_cache), TTS_PREWARM_PHRASES))
+    background_worker = get_background_worker()
+    await background_worker.start()
+    if USE_SUPABASE:
+        await get_write_behind().start()
+        metrics.track_queue("write_behind", lambda: get_write_behind().depth)
+        metrics.track_queue("embeddings", lambda: embedding_service.depth)
+    metrics.track_queue("background", lambda: background_worker.depth)
+    # Broadcasts from any worker reach this worker's connections through the registry.
+    session_registry = get_session_registry()
+    await session_registry.start(manager.deliver)
+    yield
+    await warmup.stop()
+    prewarm.cancel()
+    # Drain post-turn work first; it still needs the LLM session, embeddings
+    # and the session registry it saves state to.
+    await background_worker.stop()
+    if USE_SUPABASE:
+        await get_write_behind().stop()
+    await session_registry.stop()
+    await LLM.close_session()
+    await stt_backend.stop()
+    await embedding_service.stop()
+    await close_supabase()
+
+app = FastAPI(lifespan=lifespan)
+
+warmup = Warmup()
 
 auth_manager = AuthManager()
 
@@ -33,18 +91,7 @@ class User(BaseModel):
     email: str
     password: str
 
-# Token creation
-def create_access_token(data: dict, expires_delta: timedelta | None = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def _user_from_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -57,44 +104,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    # This is a simplified user object. In a real app, you'd fetch the user from the DB.
-    # For this agent, the email is sufficient to identify the user for conversation history.
-    user_id = auth_manager.get_user_id_from_email(email) # You'll need to implement this in auth.py
+
+    # Tokens from /token carry the user id; older ones fall back to a cached lookup.
+    user_id = payload.get("uid") or await auth_manager.resolve_user_id(email)
     if user_id is None:
         raise credentials_exception
     return {"email": email, "user_id": user_id}
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await _user_from_token(token)
+
 async def get_current_user_ws(token: str = Query(...)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user_id = auth_manager.get_user_id_from_email(email)
-    if user_id is None:
-        raise credentials_exception
-    return {"email": email, "user_id": user_id}
+    return await _user_from_token(token)
 
 @app.post("/signup")
 async def signup(user: User):
     try:
-        auth_manager.sign_up(email=user.email, password=user.password)
+        await auth_manager.sign_up(email=user.email, password=user.password)
         return {"message": "User created successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = auth_manager.sign_in(email=form_data.username, password=form_data.password)
+    user = await auth_manager.sign_in(email=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -102,92 +135,99 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    auth_manager.remember_user_id(user.user.email, user.user.id)
+    # The user id rides in the token so authenticating requests needs no lookup.
     access_token = create_access_token(
-        data={"sub": user.user.email}, expires_delta=access_token_expires
+        data={"sub": user.user.email, "uid": user.user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
 manager = ConnectionManager()
 
+async def _owns_session(session_id: str, user_id: str) -> bool:
+    """
+    Whether `user_id` may take over `session_id`: it is new, or it is theirs
+    on this or any other worker, open or only saved for resumption.
+    """
+    open_connection = manager.get(session_id)
+    if open_connection is not None:
+        return open_connection.user_id == user_id
+    try:
+        owner = await get_session_registry().owner(session_id)
+    except Exception as e:
+        metrics.upstream_error("session_registry")
+        print(f"❌ Error looking up session {session_id}: {e}")
+        return False
+    return owner is None or owner == user_id
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, current_user: dict = Depends(get_current_user_ws)):
+async def websocket_endpoint(websocket: WebSocket, current_user: dict = Depends(get_current_user_ws),
+                             ingest: str = Query("clip"), session: str | None = Query(None),
+                             input_format: str = Query("pcm16", alias="input"),
+                             input_rate: int = Query(INPUT_SAMPLE_RATE), output: str = Query("mp3")):
+    """
+    Voice conversation over a WebSocket.
+
+    With `ingest=clip` (the default) each binary message is one complete utterance.
+    With `ingest=stream` the client sends small 16-bit PCM frames continuously and
+    the server cuts utterances itself with VAD, transcribing only the speech.
+    The session is full duplex: user speech interrupts the answer being spoken.
+    The first message names the session; reconnecting with `session=<id>`, to
+    any worker, resumes its conversation context.
+
+    Audio formats are negotiated per connection: `input` is "pcm16" (16-bit
+    mono PCM at `input_rate`), "webm-opus", "ogg-opus", "mp4-aac" or "auto"
+    (whatever container ffmpeg detects, e.g. a browser's default recording
+    format), and `output` is "mp3" or "opus" (Ogg). The second message
+    confirms them.
+    """
+    try:
+        codec = AudioCodec(input_format, input_rate, output)
+    except ValueError as e:
+        # 1003: the client sent (or asked for) data the server can't accept.
+        await websocket.close(code=1003, reason=str(e))
+        return
     user_id = current_user["user_id"]
-    await manager.connect(websocket)
-    
-    # Initialize components for this user's session
-    stt = STT()
-    llm = LLM()
-    tts = TTS()
-    conversation = ConversationManager(user_id=user_id) if USE_SUPABASE else None
-
+    if session and not await _owns_session(session, user_id):
+        session = None  # Someone else's session; start a new one.
+    session_id = session or uuid.uuid4().hex
     try:
-        while True:
-            audio_bytes = await websocket.receive_bytes()
-            user_text = stt.transcribe_audio_stream(audio_bytes)
-
-            if not user_text:
-                await manager.send_personal_message("🤔 Sorry, I didn't catch that.", websocket)
-                continue
-            
-            await manager.send_personal_message(f"🎤 You said: {user_text}", websocket)
-
-
-            # 2. Get Conversation History & User Profile
-            history, profile_facts = [], []
-            if conversation:
-                history, profile_facts = await asyncio.gather(
-                    conversation.get_context_for_llm(user_text),
-                    conversation.get_user_profile()
-                )
-
-            # 3. Generate AI Response
-            await manager.send_personal_message("🤖 Thinking...", websocket)
-            ai_response = await llm.generate_response(user_text, history, profile_facts)
-            await manager.send_personal_message(f"💬 AI: {ai_response}", websocket)
-
-            # 4. Speak the Response (send audio back to client)
-            audio_path = await tts.speak(ai_response)
-            if audio_path and os.path.exists(audio_path):
-                 with open(audio_path, "rb") as f:
-                    await websocket.send_bytes(f.read())
-            else:
-                await manager.send_personal_message("️Could not generate audio response.", websocket)
-
-
-            # 5. Update history and learn new facts
-            if conversation:
-                await conversation.add_message("user", user_text)
-                await conversation.add_message("model", ai_response)
-
-                new_facts = await llm.extract_facts(f"User: {user_text}\nAI: {ai_response}")
-                if new_facts:
-                    await conversation.update_user_profile(new_facts)
+        connection = await manager.connect(websocket, session_id, user_id)
+    except Exception:
+        return  # Logged and closed by the manager.
+    voice_session = VoiceSession(connection, user_id, session_id, ingest=ingest, codec=codec)
 
+    try:
+        await voice_session.run()
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print(f"Client {user_id} disconnected")
     except Exception as e:
         print(f"An error occurred: {e}")
-        await manager.send_personal_message(f"An error occurred: {str(e)}", websocket)
-        manager.disconnect(websocket)
+        # The writer may be gone with the socket, so this goes out directly.
+        try:
+            await websocket.send_text(f"An error occurred: {str(e)}")
+        except Exception:
+            pass
+    finally:
+        await manager.disconnect(connection)
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every model is warmed up, 503 until then."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape target: stage latency histograms, gauges and error counters."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    if WEB_WORKERS > 1:
+        if SESSION_REGISTRY == "memory":
+            print("⚠️  SESSION_REGISTRY=memory with several workers: broadcasts and resumption stay per worker.")
+        # Each worker is its own process with its own event loop, models and pools;
+        # a WebSocket stays on the worker that accepted it.
+        uvicorn.run("api:app", host="0.0.0.0", port=8000, workers=WEB_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Client side of a benchmarked voice turn: sends one utterance over `/ws` and
+times the protocol messages that come back.
+"""
+import time
+import wave
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+import numpy as np
+from src.protocol import AUDIO_FRAME, END_OF_SENTENCE, END_OF_UTTERANCE, decode_frame
+from src.sentences import SentenceChunker
+
+# Stage -> (end mark, start mark); no start mark means "from when the utterance was sent".
+#   stt             utterance sent    -> "🎤 You said"
+#   context         "🎤 You said"     -> "🤖 Thinking..." (history and profile fetch)
+#   llm_ttft        "🤖 Thinking..."  -> first "💭 AI partial"
+#   tts_first_byte  first sentence complete in the partials -> first audio frame
+#   first_audio     utterance sent    -> first audio frame
+#   first_playable  utterance sent    -> first end-of-sentence frame (a file the client can play)
+#   turn            utterance sent    -> end-of-utterance frame
+SPANS = {
+    "stt": ("heard", None),
+    "context": ("thinking", "heard"),
+    "llm_ttft": ("partial", "thinking"),
+    "tts_first_byte": ("audio", "sentence"),
+    "first_audio": ("audio", None),
+    "first_playable": ("playable", None),
+    "turn": ("end", None),
+}
+STAGES = list(SPANS)
+TURN_TIMEOUT_S = 30  # longest wait for the next message of a turn
+
+def fake_pcm(seconds: float, sample_rate: int) -> bytes:
+    """Low-level noise as 16-bit PCM, for STT backends that don't listen to it."""
+    samples = np.random.default_rng(0).normal(0, 800, int(seconds * sample_rate))
+    return samples.astype(np.int16).tobytes()
+
+def load_clip(path: str, sample_rate: int) -> bytes:
+    """Reads a recorded utterance: a 16-bit mono WAV at `sample_rate`, or raw PCM in that format."""
+    if not path.lower().endswith(".wav"):
+        with open(path, "rb") as f:
+            return f.read()
+    with wave.open(path, "rb") as wav:
+        if (wav.getsampwidth(), wav.getnchannels(), wav.getframerate()) != (2, 1, sample_rate):
+            raise ValueError(f"{path}: expected 16-bit mono audio at {sample_rate} Hz")
+        return wav.readframes(wav.getnframes())
+
+async def play_turn(ws: aiohttp.ClientWebSocketResponse, clip: bytes,
+                    timeout: float = TURN_TIMEOUT_S) -> Tuple[Dict[str, float], Optional[str]]:
+    """
+    Sends one clip-mode utterance and waits for the whole answer.
+
+    Returns:
+        Milliseconds per stage, and the error the server reported (None on success).
+    """
+    marks: Dict[str, float] = {}
+    chunker = SentenceChunker()
+    answered = ended = False
+    sent = time.perf_counter()
+    await ws.send_bytes(clip)
+    while not (answered and ended):
+        message = await ws.receive(timeout=timeout)
+        now = time.perf_counter()
+        if message.type == aiohttp.WSMsgType.BINARY:
+            kind, _, _, _ = decode_frame(message.data)
+            if kind == AUDIO_FRAME:
+                marks.setdefault("audio", now)
+            elif kind == END_OF_SENTENCE:
+                marks.setdefault("playable", now)
+            elif kind == END_OF_UTTERANCE:
+                marks["end"] = now
+                ended = True
+            continue
+        if message.type != aiohttp.WSMsgType.TEXT:
+            raise ConnectionError(f"WebSocket closed: {message.type}")
+        text = message.data
+        if text.startswith("🎤 You said"):
+            marks["heard"] = now
+        elif text.startswith("🤖 Thinking"):
+            marks["thinking"] = now
+        elif text.startswith("💭 AI partial: "):
+            marks.setdefault("partial", now)
+            if chunker.feed(text[len("💭 AI partial: "):]):
+                marks.setdefault("sentence", now)
+        elif text.startswith("💬 AI: "):
+            marks.setdefault("sentence", now)
+            answered = True
+        elif text.startswith("🤔") or text.startswith("An error occurred"):
+            return {}, text
+
+    durations = {}
+    for stage, (end, start) in SPANS.items():
+        if end in marks and (start is None or start in marks):
+            durations[stage] = (marks[end] - (marks[start] if start else sent)) * 1000
+    return durations, None
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """count, p50/p95/p99, mean and max of millisecond samples."""
+    data = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {"count": int(data.size), "p50": round(float(p50), 2), "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2), "mean": round(float(data.mean()), 2), "max": round(float(data.max()), 2)}
@@ -0,0 +1,324 @@
+"""
+Local stand-ins for upstream services, so the backend can be exercised without
+network access or API quotas. Every fake waits a configurable latency, with
+jitter, before answering.
+
+Run one and point the backend at it, e.g.:
+    python -m bench.fakes gemini --port 8081
+    GEMINI_API_BASE=http://127.0.0.1:8081/v1beta uvicorn api:app
+
+How each upstream is redirected:
+    gemini    GEMINI_API_BASE=http://HOST:PORT/v1beta
+    stt       http_proxy=http://HOST:PORT (speech_recognition calls Google over plain HTTP)
+    tts       edge_tts.communicate.WSS_URL = "ws://HOST:PORT/edge/v1?TrustedClientToken=x" (in-process)
+    postgrest SUPABASE_URL=http://HOST:PORT
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from aiohttp import web
+
+class Latency:
+    """A delay of `ms` milliseconds, varied uniformly by up to ±`jitter` of itself."""
+    def __init__(self, ms: float, jitter: float = 0.0):
+        self.ms = ms
+        self.jitter = jitter
+
+    async def wait(self):
+        delay = self.ms * (1 + random.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+class FakeGemini:
+    """
+    Speaks enough of the Gemini REST API for the LLM class: generateContent,
+    streamGenerateContent (SSE) and cachedContents. Replies are numbered so
+    downstream caches see distinct text. `GET /_stats` reports how requests
+    arrived, e.g. how many referenced cached content instead of resending the
+    system instruction. Like the real API, cachedContents refuses system
+    instructions shorter than `min_cache_chars`.
+    """
+    def __init__(self, first_token: Latency = Latency(150), token: Latency = Latency(20),
+                 reply: str = "Sure thing, this is answer {n}. It has a second sentence. Anything else?",
+                 min_cache_chars: int = 0):
+        self.first_token = first_token
+        self.token = token
+        self.reply = reply
+        self.min_cache_chars = min_cache_chars
+        self.cached: Dict[str, Dict] = {}
+        # Bodies of the latest generate and stream requests, oldest first.
+        self.bodies: deque = deque(maxlen=100)
+        self._ids = itertools.count(1)
+        self._replies = itertools.count(1)
+        self.stats = {"requests": 0, "cached_requests": 0, "request_bytes": 0, "cache_creates": 0,
+                      "cache_refusals": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1beta/models/{model}:generateContent", self.generate)
+        app.router.add_post("/v1beta/models/{model}:streamGenerateContent", self.stream)
+        app.router.add_post("/v1beta/cachedContents", self.create_cache)
+        app.router.add_get("/_stats", self.get_stats)
+        return app
+
+    async def _read(self, request: web.Request) -> Dict:
+        raw = await request.read()
+        body = json.loads(raw)
+        self.stats["requests"] += 1
+        self.stats["request_bytes"] += len(raw)
+        self.bodies.append(body)
+        name = body.get("cachedContent")
+        if name:
+            entry = self.cached.get(name)
+            if entry is None or entry["expires"] < time.monotonic():
+                raise web.HTTPNotFound(text=json.dumps({"error": {"code": 404, "message": f"{name} not found"}}))
+            self.stats["cached_requests"] += 1
+        return body
+
+    @staticmethod
+    def _candidate(text: str) -> Dict:
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+    async def generate(self, request: web.Request) -> web.Response:
+        body = await self._read(request)
+        await self.first_token.wait()
+        if "Return the result as a JSON list" in json.dumps(body.get("contents", [])):
+            # Fact extraction prompt.
+            return web.json_response(self._candidate("[]"))
+        return web.json_response(self._candidate(self.reply.format(n=next(self._replies))))
+
+    async def stream(self, request: web.Request) -> web.StreamResponse:
+        await self._read(request)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await self.first_token.wait()
+        for i, word in enumerate(self.reply.format(n=next(self._replies)).split(" ")):
+            if i:
+                await self.token.wait()
+            delta = word if i == 0 else " " + word
+            await response.write(f"data: {json.dumps(self._candidate(delta))}\r\n\r\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def create_cache(self, request: web.Request) -> web.Response:
+        body = json.loads(await request.read())
+        instruction = body.get("systemInstruction") or body.get("system_instruction")
+        if instruction is None:
+            raise web.HTTPBadRequest(text="systemInstruction is required")
+        if len(instruction["parts"][0]["text"]) < self.min_cache_chars:
+            self.stats["cache_refusals"] += 1
+            raise web.HTTPBadRequest(text=json.dumps(
+                {"error": {"code": 400, "message": "Cached content is too small"}}))
+        ttl = float(body.get("ttl", "3600s").rstrip("s"))
+        name = f"cachedContents/fake-{next(self._ids)}"
+        self.cached[name] = {"body": body, "expires": time.monotonic() + ttl}
+        self.stats["cache_creates"] += 1
+        return web.json_response({"name": name, "model": body.get("model")})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+class FakeGoogleSTT:
+    """
+    Google's legacy speech API as `speech_recognition.recognize_google` calls it.
+    That call has a fixed plain-HTTP URL, so the backend reaches this fake by
+    using it as its `http_proxy`; proxied requests arrive with the original path.
+    Transcripts are numbered so downstream caches see distinct text.
+    """
+    def __init__(self, latency: Latency = Latency(300), transcript: str = "tell me something useful number {n}"):
+        self.latency = latency
+        self.transcript = transcript
+        self._ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/speech-api/v2/recognize", self.recognize)
+        return app
+
+    async def recognize(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self.latency.wait()
+        result = {
+            "result": [{"alternative": [{"transcript": self.transcript.format(n=next(self._ids)), "confidence": 0.95}],
+                        "final": True}],
+            "result_index": 0,
+        }
+        # The real API streams an empty result first, one JSON document per line.
+        return web.Response(text='{"result":[]}\n' + json.dumps(result) + "\n", content_type="application/json")
+
+class FakeEdgeTTS:
+    """
+    The edge-tts read-aloud WebSocket: answers each SSML request with
+    turn.start, a few MP3-sized binary audio messages and turn.end.
+    """
+    def __init__(self, first_byte: Latency = Latency(200), chunk: Latency = Latency(10),
+                 chunks_per_request: int = 4, chunk_bytes: int = 4096):
+        self.first_byte = first_byte
+        self.chunk = chunk
+        self.chunks_per_request = chunks_per_request
+        self.chunk_bytes = chunk_bytes
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self.synthesize)
+        return app
+
+    @staticmethod
+    def _text_message(request_id: str, path: str, body: str = "{}") -> str:
+        return f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\nPath:{path}\r\n\r\n{body}"
+
+    @staticmethod
+    def _audio_message(request_id: str, audio: bytes) -> bytes:
+        headers = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode("utf-8")
+        return len(headers).to_bytes(2, "big") + headers + audio
+
+    async def synthesize(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            if message.type != web.WSMsgType.TEXT or "Path:ssml" not in message.data:
+                continue
+            request_id = uuid.uuid4().hex
+            await self.first_byte.wait()
+            await ws.send_str(self._text_message(request_id, "turn.start"))
+            for i in range(self.chunks_per_request):
+                if i:
+                    await self.chunk.wait()
+                await ws.send_bytes(self._audio_message(request_id, os.urandom(self.chunk_bytes)))
+            await ws.send_str(self._text_message(request_id, "turn.end"))
+        return ws
+
+class FakePostgREST:
+    """
+    An in-memory PostgREST with the subset of the API the backend uses:
+    select with `eq` filters, order, limit/offset (or a Range header), insert,
+    delete, and the `match_conversations` / `upsert_user_profile_batch` RPCs.
+    """
+    def __init__(self, latency: Latency = Latency(15)):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict]] = defaultdict(list)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/rest/v1/rpc/{function}", self.rpc)
+        app.router.add_get("/rest/v1/{table}", self.select)
+        app.router.add_post("/rest/v1/{table}", self.insert)
+        app.router.add_delete("/rest/v1/{table}", self.delete)
+        return app
+
+    @staticmethod
+    def _filters(request: web.Request) -> List[Tuple[str, str]]:
+        reserved = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+        filters = []
+        for column, condition in request.query.items():
+            if column in reserved:
+                continue
+            operator, _, value = condition.partition(".")
+            if operator != "eq":
+                raise web.HTTPBadRequest(text=f"Unsupported filter: {column}={condition}")
+            filters.append((column, value))
+        return filters
+
+    def _matching(self, request: web.Request) -> List[Dict]:
+        filters = self._filters(request)
+        return [row for row in self.tables[request.match_info["table"]]
+                if all(str(row.get(column)) == value for column, value in filters)]
+
+    @staticmethod
+    def _project(rows: List[Dict], select: Optional[str]) -> List[Dict]:
+        if not select or select.strip() == "*":
+            return rows
+        columns = [column.strip() for column in select.split(",")]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    async def select(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        rows = self._matching(request)
+        for clause in reversed(request.query.get("order", "").split(",")):
+            if clause:
+                column, _, direction = clause.partition(".")
+                rows = sorted(rows, key=lambda row: str(row.get(column)), reverse=direction.startswith("desc"))
+        offset, limit = int(request.query.get("offset", 0)), request.query.get("limit")
+        if "Range" in request.headers:
+            start, _, end = request.headers["Range"].partition("-")
+            offset, limit = int(start), int(end) - int(start) + 1
+        rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        return web.json_response(self._project(rows, request.query.get("select")))
+
+    async def insert(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        body = await request.json()
+        rows = body if isinstance(body, list) else [body]
+        table = self.tables[request.match_info["table"]]
+        for row in rows:
+            table.append({"id": len(table) + 1, **row})
+        return web.json_response(rows, status=201)
+
+    async def delete(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        doomed = {id(row) for row in self._matching(request)}
+        table = request.match_info["table"]
+        self.tables[table] = [row for row in self.tables[table] if id(row) not in doomed]
+        return web.json_response([])
+
+    async def rpc(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        function, args = request.match_info["function"], await request.json()
+        if function == "upsert_user_profile_batch":
+            profile = self.tables["user_profile"]
+            for fact in args["p_facts"]:
+                existing = next((row for row in profile
+                                 if row["user_id"] == fact["user_id"] and row["key"] == fact["key"]), None)
+                if existing:
+                    existing["value"] = fact["value"]
+                else:
+                    profile.append(dict(fact))
+            return web.json_response(None)
+        if function == "match_conversations":
+            rows = [row for row in self.tables["conversation_history"]
+                    if row.get("session_id") == args["p_session_id"] and row.get("embedding")]
+            if not rows:
+                return web.json_response([])
+            query = np.asarray(args["query_embedding"], dtype=np.float32)
+            matrix = np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+            scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+            ranked = sorted(zip(scores.tolist(), rows), key=lambda pair: pair[0], reverse=True)
+            return web.json_response([
+                {"content": row["text"], "role": row["role"], "created_at": row["created_at"], "similarity": score}
+                for score, row in ranked[:args["match_count"]] if score > args["match_threshold"]
+            ])
+        raise web.HTTPNotFound(text=f"Unknown function: {function}")
+
+async def start_fake(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, int]:
+    """Serves a fake's app in the running event loop. Returns the runner and the bound port."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+FAKES = {
+    "gemini": FakeGemini,
+    "stt": FakeGoogleSTT,
+    "tts": FakeEdgeTTS,
+    "postgrest": FakePostgREST,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for an upstream service.")
+    parser.add_argument("service", choices=sorted(FAKES))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(FAKES[args.service]().app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
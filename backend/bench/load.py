@@ -0,0 +1,235 @@
+"""
+Concurrent-session load generator for `/ws`.
+
+Opens WebSocket sessions that replay recorded utterances with randomized
+think-time, ramping concurrency step by step. Every step records turn latency
+(see `bench.client` for the stages) and the error rate; the ramp stops at the
+first step that breaks the latency or error budget, and the last step that held
+is reported as the capacity of the target.
+
+Tokens are minted with `create_access_token`, signed with `--secret` (or
+`SUPABASE_JWT_SECRET`), so the target must share that secret.
+
+Usage (from backend/):
+    # One uvicorn process on local fakes, spawned for the run:
+    python -m bench.load --start 10 --step 10 --max-sessions 200 --clips clips/*.wav
+    # An already running server:
+    python -m bench.load --url ws://127.0.0.1:8000 --secret "$SUPABASE_JWT_SECRET" --server-cores 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from bench.client import STAGES, fake_pcm, load_clip, percentiles, play_turn
+from bench.stack import BENCH_JWT_SECRET, add_latency_args, free_port
+
+CONNECT_TIMEOUT_S = 10
+
+class Step:
+    """Samples and failures collected while the ramp sits at one concurrency level."""
+    def __init__(self, sessions: int):
+        self.sessions = sessions
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.turns = 0
+        self.errors: Dict[str, int] = {}
+        self.connected = 0
+
+    def record(self, durations: Dict[str, float]):
+        self.turns += 1
+        for stage, ms in durations.items():
+            self.samples[stage].append(ms)
+
+    def fail(self, reason: str):
+        self.turns += 1
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.turns if self.turns else 0.0
+
+    def report(self, duration: float) -> Dict:
+        return {
+            "sessions": self.sessions,
+            "connected": self.connected,
+            "turns": self.turns,
+            "turns_per_s": round(self.turns / duration, 2) if duration else 0.0,
+            "error_rate": round(self.error_rate(), 4),
+            "errors": self.errors,
+            "stages": {stage: percentiles(values) for stage, values in self.samples.items() if values},
+        }
+
+class LoadRun:
+    """Shared state of the ramp: the step in progress and whether to keep going."""
+    def __init__(self):
+        self.step: Optional[Step] = None
+        self.stopping = asyncio.Event()
+
+async def run_session(run: LoadRun, url: str, token: str, clips: List[bytes],
+                      think_time: float, think_jitter: float):
+    """Holds one session open until the run stops, reconnecting after a dropped connection."""
+    # Spread the first utterances over one think-time so sessions don't move in lockstep.
+    await asyncio.sleep(random.uniform(0, think_time))
+    async with aiohttp.ClientSession() as http:
+        while not run.stopping.is_set():
+            try:
+                async with http.ws_connect(f"{url}/ws?token={token}&ingest=clip", max_msg_size=0,
+                                           timeout=CONNECT_TIMEOUT_S) as ws:
+                    run.step.connected += 1
+                    while not run.stopping.is_set():
+                        step = run.step
+                        try:
+                            durations, error = await play_turn(ws, random.choice(clips))
+                        except asyncio.TimeoutError:
+                            step.fail("timeout")
+                            break
+                        if error:
+                            step.fail("server")
+                        else:
+                            step.record(durations)
+                        pause = think_time * random.uniform(1 - think_jitter, 1 + think_jitter)
+                        try:
+                            await asyncio.wait_for(run.stopping.wait(), pause)
+                        except asyncio.TimeoutError:
+                            pass
+            except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError):
+                run.step.fail("connection")
+                await asyncio.sleep(1)
+
+def breaks_budget(report: Dict, args) -> Optional[str]:
+    """Why a step fails the latency or error budget, or None if it held."""
+    if not report["turns"]:
+        return "no turns completed"
+    if report["error_rate"] > args.max_error_rate:
+        return f"error rate {report['error_rate']:.1%} > {args.max_error_rate:.1%}"
+    turn = report["stages"].get(args.slo_stage)
+    if turn and turn["p95"] > args.slo_ms:
+        return f"{args.slo_stage} p95 {turn['p95']:.0f} ms > {args.slo_ms:.0f} ms"
+    return None
+
+async def ramp(args, url: str, clips: List[bytes]) -> Dict:
+    from src.tokens import create_access_token
+
+    secret = args.secret or os.environ.get("SUPABASE_JWT_SECRET") or BENCH_JWT_SECRET
+    run = LoadRun()
+    tasks: List[asyncio.Task] = []
+    steps, capacity, stopped_by = [], 0, None
+    started = time.perf_counter()
+    sessions = args.start
+    try:
+        while sessions <= args.max_sessions:
+            run.step = Step(sessions)
+            while len(tasks) < sessions:
+                i = len(tasks)
+                token = create_access_token({"sub": f"load-{i}@example.com", "uid": f"load-user-{i}"},
+                                            timedelta(minutes=args.token_minutes), secret_key=secret)
+                tasks.append(asyncio.create_task(
+                    run_session(run, url, token, clips, args.think_time, args.think_jitter)))
+            # Let the new sessions settle before measuring.
+            await asyncio.sleep(args.settle)
+            run.step = Step(sessions)
+            step_started = time.perf_counter()
+            await asyncio.sleep(args.step_duration)
+            report = run.step.report(time.perf_counter() - step_started)
+            steps.append(report)
+            turn = report["stages"].get(args.slo_stage, {})
+            print(f"{sessions:>8}{report['turns']:>8}{report['turns_per_s']:>10.1f}"
+                  f"{turn.get('p50', 0):>10.1f}{turn.get('p95', 0):>10.1f}{report['error_rate']:>9.1%}")
+            stopped_by = breaks_budget(report, args)
+            if stopped_by:
+                break
+            capacity = sessions
+            sessions += args.step
+    finally:
+        run.stopping.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "url": url,
+        "duration_s": round(time.perf_counter() - started, 2),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "secret")},
+        "capacity_sessions": capacity,
+        "capacity_per_core": round(capacity / args.server_cores, 2) if args.server_cores else None,
+        "stopped_by": stopped_by or "max sessions reached",
+        "steps": steps,
+    }
+
+def spawn_stack(args) -> Tuple[subprocess.Popen, str]:
+    """One `bench.stack` server process on local fakes, so it doesn't share a core with the load."""
+    port = free_port()
+    command = [sys.executable, "-m", "bench.stack", "--port", str(port),
+               "--stt-ms", str(args.stt_ms), "--llm-ttft-ms", str(args.llm_ttft_ms),
+               "--llm-token-ms", str(args.llm_token_ms), "--tts-ms", str(args.tts_ms),
+               "--tts-chunk-ms", str(args.tts_chunk_ms), "--db-ms", str(args.db_ms), "--jitter", str(args.jitter)]
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen(command, cwd=backend_dir), f"ws://127.0.0.1:{port}"
+
+async def wait_until_up(url: str, server: Optional[subprocess.Popen], timeout: float = 60):
+    """Polls `/ready` until the target has warmed up its models."""
+    probe = url.replace("ws://", "http://", 1).replace("wss://", "https://", 1) + "/ready"
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if server and server.poll() is not None:
+                raise RuntimeError(f"bench.stack exited with code {server.returncode}")
+            try:
+                async with http.get(probe) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up within {timeout:.0f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp concurrent /ws sessions until turn latency degrades.")
+    parser.add_argument("--url", help="target server (ws://host:port); default: spawn bench.stack on local fakes")
+    parser.add_argument("--secret", help="JWT secret of the target (default: SUPABASE_JWT_SECRET, then the bench secret)")
+    parser.add_argument("--server-cores", type=float, default=1, help="cores the target uses, for capacity per core")
+    parser.add_argument("--start", type=int, default=10, help="sessions in the first step")
+    parser.add_argument("--step", type=int, default=10, help="sessions added per step")
+    parser.add_argument("--max-sessions", type=int, default=500)
+    parser.add_argument("--step-duration", type=float, default=30, help="measured seconds per step")
+    parser.add_argument("--settle", type=float, default=5, help="unmeasured seconds after adding sessions")
+    parser.add_argument("--think-time", type=float, default=3.0, help="mean seconds between a reply and the next utterance")
+    parser.add_argument("--think-jitter", type=float, default=0.5, help="think-time variation, as a fraction of it")
+    parser.add_argument("--clips", nargs="*", default=[], help="recorded utterances (16-bit mono WAV or raw PCM)")
+    parser.add_argument("--clip-seconds", type=float, default=1.5, help="length of the synthetic clip without --clips")
+    parser.add_argument("--slo-stage", choices=STAGES, default="first_audio", help="stage the latency budget applies to")
+    parser.add_argument("--slo-ms", type=float, default=1500, help="p95 budget for --slo-stage")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--token-minutes", type=float, default=240, help="lifetime of the minted tokens")
+    parser.add_argument("--output", default="load-results.json")
+    add_latency_args(parser)
+    args = parser.parse_args()
+
+    from src.config import INPUT_SAMPLE_RATE
+    clips = [load_clip(path, INPUT_SAMPLE_RATE) for path in args.clips] or \
+        [fake_pcm(args.clip_seconds, INPUT_SAMPLE_RATE)]
+
+    server, url = (None, args.url) if args.url else spawn_stack(args)
+    if server:
+        args.secret = BENCH_JWT_SECRET
+    try:
+        asyncio.run(wait_until_up(url, server))
+        print(f"\n{'sessions':>8}{'turns':>8}{'turns/s':>10}{'p50':>10}{'p95':>10}{'errors':>9}")
+        results = asyncio.run(ramp(args, url, clips))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📈 Capacity: {results['capacity_sessions']} sessions "
+          f"({results['capacity_per_core']} per core); stopped by {results['stopped_by']}.")
+    print(f"📄 Results written to {args.output}.")
+
+if __name__ == "__main__":
+    main()
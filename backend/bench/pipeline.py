@@ -0,0 +1,123 @@
+"""
+Per-stage latency benchmark of the real voice pipeline against local fakes.
+
+Starts a fake for every upstream (Google STT, Gemini, edge-tts, PostgREST),
+serves `api:app` in-process on top of them, and drives WebSocket sessions that
+send one utterance per turn. Stage times are taken from the protocol messages
+the client receives, so nothing in the server is special-cased for the bench:
+
+    stt             utterance sent    -> "🎤 You said"
+    context         "🎤 You said"     -> "🤖 Thinking..." (history and profile fetch)
+    llm_ttft        "🤖 Thinking..."  -> first "💭 AI partial"
+    tts_first_byte  first sentence complete in the partials -> first audio frame
+    first_audio     utterance sent    -> first audio frame
+    first_playable  utterance sent    -> first end-of-sentence frame (a file the client can play)
+    turn            utterance sent    -> end-of-utterance frame
+
+Usage (from backend/):
+    python -m bench.pipeline --sessions 4 --turns 20 --output bench-results.json
+    python -m bench.pipeline --baseline bench-results.json  # exits 1 on a p95 regression
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import aiohttp
+from bench.client import STAGES, fake_pcm, percentiles, play_turn
+from bench.stack import add_latency_args, start_stack
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def summarize(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """p50/p95/p99 (plus count, mean and max) per stage, in milliseconds."""
+    return {stage: percentiles(samples[stage]) for stage in STAGES if samples.get(stage)}
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Stages whose p95 grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for stage, stats in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base and stats["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {base['p95']:.1f} ms -> {stats['p95']:.1f} ms")
+    return regressions
+
+async def run_session(base_url: str, token: str, turns: int, warmup: int, think_time: float,
+                      clip: bytes, samples: Dict[str, List[float]], errors: List[str]):
+    async with aiohttp.ClientSession() as http:
+        async with http.ws_connect(f"{base_url}/ws?token={token}&ingest=clip", max_msg_size=0) as ws:
+            for turn in range(warmup + turns):
+                durations, error = await play_turn(ws, clip)
+                if error:
+                    errors.append(error)
+                elif turn >= warmup:
+                    for stage, ms in durations.items():
+                        samples[stage].append(ms)
+                await asyncio.sleep(think_time)
+
+async def run(args) -> Dict:
+    stack = await start_stack(args)
+    # Imported late: it reads configuration set up by `start_stack`.
+    from src.config import INPUT_SAMPLE_RATE
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    errors: List[str] = []
+    clip = fake_pcm(args.clip_seconds, INPUT_SAMPLE_RATE)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            run_session(stack.url, stack.token(i), args.turns, args.warmup, args.think_time, clip, samples, errors)
+            for i in range(args.sessions)
+        ])
+    finally:
+        await stack.close()
+
+    return {
+        "commit": _commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.perf_counter() - started, 2),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "errors": len(errors),
+        "stages": summarize(samples),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-stage latency of a voice turn against local fakes.")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent WebSocket sessions")
+    parser.add_argument("--turns", type=int, default=20, help="measured turns per session")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured turns per session first")
+    parser.add_argument("--think-time", type=float, default=0.2, help="seconds between turns")
+    parser.add_argument("--clip-seconds", type=float, default=1.5)
+    add_latency_args(parser)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="earlier results to compare p95s against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'stage':<16}{'p50':>10}{'p95':>10}{'p99':>10}{'n':>6}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<16}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['count']:>6}")
+    print(f"\n📄 Results written to {args.output} ({results['errors']} failed turn(s)).")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No p95 regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+The real backend served in-process on top of local fakes for every upstream.
+
+    python -m bench.stack --port 8000   # serve until Ctrl-C, e.g. as the target of bench.load
+
+Nothing from `src` may be imported before `start_stack`: configuration is read
+from the environment it sets up.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from typing import Dict, List, Optional
+from aiohttp import web
+from bench.fakes import FakeEdgeTTS, FakeGemini, FakeGoogleSTT, FakePostgREST, Latency, start_fake
+
+BENCH_JWT_SECRET = "bench-secret"
+
+def add_latency_args(parser: argparse.ArgumentParser):
+    """Latency options for the upstream fakes."""
+    parser.add_argument("--stt-ms", type=float, default=300)
+    parser.add_argument("--llm-ttft-ms", type=float, default=250)
+    parser.add_argument("--llm-token-ms", type=float, default=15)
+    parser.add_argument("--tts-ms", type=float, default=200, help="edge-tts time to first audio")
+    parser.add_argument("--tts-chunk-ms", type=float, default=10)
+    parser.add_argument("--db-ms", type=float, default=15)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency variation, as a fraction of each latency")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Stack:
+    """A running backend and its fakes."""
+    def __init__(self, url: str, server, serving: asyncio.Task, runners: List[web.AppRunner], fakes: Dict):
+        self.url = url
+        self.fakes = fakes
+        self._server = server
+        self._serving = serving
+        self._runners = runners
+
+    def token(self, i: int) -> str:
+        """A valid access token for synthetic user `i`."""
+        from src.tokens import create_access_token
+        return create_access_token({"sub": f"bench-{i}@example.com", "uid": f"bench-user-{i}"}, timedelta(hours=1))
+
+    async def wait(self):
+        await self._serving
+
+    async def close(self):
+        self._server.should_exit = True
+        await self._serving
+        for runner in self._runners:
+            await runner.cleanup()
+
+async def start_stack(args, host: str = "127.0.0.1", port: Optional[int] = None) -> Stack:
+    fakes = {
+        "stt": FakeGoogleSTT(Latency(args.stt_ms, args.jitter)),
+        "gemini": FakeGemini(Latency(args.llm_ttft_ms, args.jitter), Latency(args.llm_token_ms, args.jitter)),
+        "tts": FakeEdgeTTS(Latency(args.tts_ms, args.jitter), Latency(args.tts_chunk_ms, args.jitter)),
+        "postgrest": FakePostgREST(Latency(args.db_ms, args.jitter)),
+    }
+    runners, ports = [], {}
+    for name, fake in fakes.items():
+        runner, ports[name] = await start_fake(fake.app())
+        runners.append(runner)
+
+    workdir = tempfile.mkdtemp(prefix="tara-bench-")
+    os.environ.update({
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_BASE": f"http://127.0.0.1:{ports['gemini']}/v1beta",
+        "SUPABASE_URL": f"http://127.0.0.1:{ports['postgrest']}",
+        # supabase-py only checks that the key is JWT-shaped.
+        "SUPABASE_KEY": "bench.bench.bench",
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+        "STT_BACKEND": "google",
+        "LOCAL_MEMORY_DIR": os.path.join(workdir, "memory"),
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts"),
+        "http_proxy": f"http://127.0.0.1:{ports['stt']}",
+        "no_proxy": "127.0.0.1,localhost",
+    })
+    import edge_tts.communicate
+    edge_tts.communicate.WSS_URL = f"ws://127.0.0.1:{ports['tts']}/edge/v1?TrustedClientToken=bench"
+    import uvicorn
+    import api
+
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host=host, port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    # Started, then warmed up: measured turns shouldn't pay for loading models.
+    while not (server.started and api.warmup.ready):
+        if serving.done():
+            serving.result()
+        if api.warmup.status()["failed"]:
+            raise RuntimeError(f"Warmup failed: {api.warmup.status()['failed']}")
+        await asyncio.sleep(0.05)
+    return Stack(f"ws://{host}:{port}", server, serving, runners, fakes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the backend on top of local upstream fakes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_latency_args(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        stack = await start_stack(args, args.host, args.port)
+        print(f"🧪 Serving {stack.url} on local fakes; tokens are signed with '{BENCH_JWT_SECRET}'.")
+        try:
+            await stack.wait()
+        finally:
+            await stack.close()
+
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    main()
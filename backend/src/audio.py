@@ -0,0 +1,231 @@
+"""
+Audio formats negotiated per WebSocket connection, and the conversions between
+them and the 16 kHz mono 16-bit PCM the rest of the pipeline works on.
+
+Compressed input (WebM or Ogg Opus, as browsers' MediaRecorder produces, or
+whatever container a browser records by default) is decoded by an ffmpeg process
+to PCM at Opus' native 48 kHz and resampled with NumPy. Outbound speech from edge-tts is MP3; with the "opus" output format it
+is re-encoded by ffmpeg into one Ogg Opus stream per sentence.
+
+ffmpeg must be installed (or FFMPEG_BINARY set) for any format but pcm16 in and
+mp3 out; when it can't be started the conversion fails with a ValueError.
+"""
+import asyncio
+from typing import AsyncIterator, Optional
+import numpy as np
+from src.config import (
+    INPUT_SAMPLE_RATE, FFMPEG_BINARY, OPUS_DECODE_RATE, OPUS_BITRATE, OPUS_PAGE_MS
+)
+
+# Input format -> ffmpeg demuxer (None: raw 16-bit little-endian mono PCM;
+# "": let ffmpeg detect the container, for browsers' default recording format).
+INPUT_FORMATS = {"pcm16": None, "webm-opus": "webm", "ogg-opus": "ogg", "mp4-aac": "mp4", "auto": ""}
+# Output format -> MIME type the client plays it as.
+OUTPUT_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg; codecs=opus"}
+# Bytes read from ffmpeg per pipe read.
+_READ_SIZE = 16384
+
+class Resampler:
+    """
+    Streaming resampler for 16-bit mono PCM. Chunks may split samples or
+    resampling periods anywhere; the remainder is carried into the next call.
+
+    An integer downsampling ratio (48 kHz -> 16 kHz) averages each block of
+    input samples, which also low-passes them; other ratios interpolate
+    linearly. Equal rates pass the bytes through untouched.
+    """
+    def __init__(self, from_rate: int, to_rate: int = INPUT_SAMPLE_RATE):
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self._factor = from_rate // to_rate if from_rate % to_rate == 0 else 0
+        self._step = from_rate / to_rate
+        self._byte = b""  # Odd trailing byte of the last chunk
+        self._tail = np.empty(0, dtype=np.int16)  # Samples not yet resampled
+        self._pos = 0.0  # Next output position, in input samples from `_tail[0]`
+
+    def process(self, data: bytes) -> bytes:
+        if self.from_rate == self.to_rate and not self._byte and len(data) % 2 == 0:
+            return data
+        if self._byte:
+            data = self._byte + data
+        usable = len(data) & ~1
+        self._byte = data[usable:]
+        # A view on the received bytes; the only copy made is the resampled output.
+        samples = np.frombuffer(data, dtype="<i2", count=usable // 2)
+        if self._tail.size:
+            samples = np.concatenate((self._tail, samples))
+        if self.from_rate == self.to_rate:
+            self._tail = samples[:0]
+            return samples.tobytes()
+        if self._factor:
+            return self._decimate(samples)
+        return self._interpolate(samples)
+
+    def _decimate(self, samples: np.ndarray) -> bytes:
+        whole = samples.size - samples.size % self._factor
+        self._tail = samples[whole:].copy()
+        blocks = samples[:whole].reshape(-1, self._factor)
+        out = blocks.sum(axis=1, dtype=np.int32)
+        out //= self._factor
+        return out.astype("<i2").tobytes()
+
+    def _interpolate(self, samples: np.ndarray) -> bytes:
+        last = samples.size - 1
+        if last < self._pos:
+            self._tail = samples.copy()
+            return b""
+        count = int((last - self._pos) // self._step) + 1
+        positions = self._pos + np.arange(count) * self._step
+        out = np.interp(positions, np.arange(samples.size), samples)
+        # Keep the last sample: the next output may fall between it and the next chunk.
+        self._pos = positions[-1] + self._step - last
+        self._tail = samples[last:].copy()
+        return np.round(out).astype("<i2").tobytes()
+
+class AudioCodec:
+    """
+    The formats negotiated for one connection and the conversions they need.
+
+    Args:
+        input_format: One of INPUT_FORMATS.
+        input_rate: Sample rate of "pcm16" input.
+        output_format: One of OUTPUT_FORMATS.
+
+    Raises:
+        ValueError: For a format or rate the server doesn't support.
+    """
+    def __init__(self, input_format: str = "pcm16", input_rate: int = INPUT_SAMPLE_RATE,
+                 output_format: str = "mp3"):
+        if input_format not in INPUT_FORMATS:
+            raise ValueError(f"Unsupported input format: {input_format}")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        if not 8000 <= input_rate <= 96000:
+            raise ValueError(f"Unsupported input sample rate: {input_rate}")
+        self.input_format = input_format
+        self.input_rate = input_rate if input_format == "pcm16" else OPUS_DECODE_RATE
+        self.output_format = output_format
+
+    @property
+    def output_mime(self) -> str:
+        return OUTPUT_FORMATS[self.output_format]
+
+    def describe(self) -> str:
+        rate = f"@{self.input_rate}" if self.input_format == "pcm16" else ""
+        return f"input={self.input_format}{rate} output={self.output_format}"
+
+    async def decode_clip(self, data: bytes) -> bytes:
+        """One complete utterance in the input format as 16 kHz PCM."""
+        if INPUT_FORMATS[self.input_format] is not None:
+            data = await _run_ffmpeg(self._decode_args(), data)
+        return Resampler(self.input_rate).process(data)
+
+    def stream_decoder(self) -> "StreamDecoder":
+        """A decoder for continuous input, e.g. MediaRecorder timeslices of one recording."""
+        if INPUT_FORMATS[self.input_format] is None:
+            return StreamDecoder(Resampler(self.input_rate))
+        return StreamDecoder(Resampler(self.input_rate), self._decode_args())
+
+    async def encode(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Re-encodes one sentence of edge-tts MP3 chunks into the output format, streaming."""
+        if self.output_format == "mp3":
+            async for chunk in chunks:
+                yield chunk
+            return
+        args = ["-probesize", "32", "-analyzeduration", "0", "-f", "mp3", "-i", "pipe:0",
+                "-c:a", "libopus", "-b:a", OPUS_BITRATE,
+                "-application", "voip", "-page_duration", str(OPUS_PAGE_MS * 1000), "-f", "ogg", "pipe:1"]
+        async for chunk in _pipe_ffmpeg(args, chunks):
+            yield chunk
+
+    def _decode_args(self):
+        demuxer = INPUT_FORMATS[self.input_format]
+        # A known container starts decoding at once; an unknown one must be probed first.
+        probe = ["-probesize", "32", "-analyzeduration", "0", "-f", demuxer] if demuxer else []
+        return probe + ["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(OPUS_DECODE_RATE), "pipe:1"]
+
+class StreamDecoder:
+    """
+    Continuous input to 16 kHz PCM. `feed` takes received bytes and `chunks`
+    yields PCM as it is decoded; with compressed input a long-running ffmpeg
+    process sits in between, so output isn't aligned with input messages.
+    """
+    def __init__(self, resampler: Resampler, ffmpeg_args: Optional[list] = None):
+        self.resampler = resampler
+        self._ffmpeg_args = ffmpeg_args
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._pcm: asyncio.Queue = asyncio.Queue()
+
+    async def feed(self, data: bytes):
+        if self._ffmpeg_args is None:
+            self._pcm.put_nowait(self.resampler.process(data))
+            return
+        if self._process is None:
+            self._process = await _spawn_ffmpeg(self._ffmpeg_args)
+        self._process.stdin.write(data)
+        await self._process.stdin.drain()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        if self._ffmpeg_args is None:
+            while True:
+                yield await self._pcm.get()
+        while self._process is None:
+            # Nothing to read before the first input starts ffmpeg.
+            await asyncio.sleep(0.01)
+        while data := await self._process.stdout.read(_READ_SIZE):
+            pcm = self.resampler.process(data)
+            if pcm:
+                yield pcm
+
+    async def close(self):
+        if self._process is not None:
+            await _stop_ffmpeg(self._process)
+            self._process = None
+
+async def _spawn_ffmpeg(args) -> asyncio.subprocess.Process:
+    try:
+        return await asyncio.create_subprocess_exec(
+            FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", *args,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError as e:
+        raise ValueError(f"ffmpeg could not be started ({FFMPEG_BINARY}): {e}") from e
+
+async def _stop_ffmpeg(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        process.kill()
+    await process.wait()
+
+async def _run_ffmpeg(args, data: bytes) -> bytes:
+    process = await _spawn_ffmpeg(args)
+    try:
+        output, _ = await process.communicate(data)
+    except OSError as e:
+        raise ValueError(f"ffmpeg could not decode the audio: {e}") from e
+    finally:
+        await _stop_ffmpeg(process)
+    if process.returncode:
+        raise ValueError(f"ffmpeg could not decode the audio (exit code {process.returncode})")
+    return output
+
+async def _pipe_ffmpeg(args, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Streams `chunks` through ffmpeg, yielding its output as it is produced."""
+    process = await _spawn_ffmpeg(args)
+
+    async def write():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    writer = asyncio.create_task(write())
+    try:
+        while data := await process.stdout.read(_READ_SIZE):
+            yield data
+        await writer
+    finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+        await _stop_ffmpeg(process)
@@ -1,21 +1,46 @@
 """
 Handles user authentication using Supabase Auth.
 """
-from supabase import create_client, Client
-from src.config import SUPABASE_URL, SUPABASE_KEY
-from typing import Optional
+import asyncio
+import time
+from collections import OrderedDict
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from src.db import get_supabase
+from src.config import SUPABASE_URL, SUPABASE_KEY, USER_ID_CACHE_TTL_S, USER_ID_NEGATIVE_TTL_S, USER_ID_CACHE_SIZE
+from src import metrics
+from typing import Dict, Optional, Tuple
 
 class AuthManager:
     """
     Manages user sign-up, sign-in, and session state with Supabase.
+
+    Database queries go through the process-wide async client unless one is
+    injected. Sign-in and sign-up use a separate client of their own: signing
+    in switches a client's requests over to that user's JWT, which must never
+    happen to the shared one.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[AsyncClient] = None):
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("Supabase URL and Key must be set in the .env file.")
-        self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        self.auth = self.client.auth
+        self._client = client
+        self._auth_client: Optional[AsyncClient] = None
+        # email -> (user id or None if unknown, expiry), for `resolve_user_id`.
+        self._user_ids: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lookups: Dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> AsyncClient:
+        return self._client or get_supabase()
 
-    def sign_up(self, email: str, password: str) -> Optional[dict]:
+    async def _auth(self):
+        if self._auth_client is None:
+            self._auth_client = await acreate_client(
+                SUPABASE_URL, SUPABASE_KEY,
+                options=AsyncClientOptions(auto_refresh_token=False, persist_session=False)
+            )
+        return self._auth_client.auth
+
+    async def sign_up(self, email: str, password: str) -> Optional[dict]:
         """
         Signs up a new user.
 
@@ -23,7 +48,7 @@ class AuthManager:
             The user session object on success, None on failure.
         """
         try:
-            response = self.auth.sign_up({"email": email, "password": password})
+            response = await (await self._auth()).sign_up({"email": email, "password": password})
             print("✅ Sign-up successful! Please check your email for verification.")
             # Note: Supabase may require email verification before login is possible.
             # This depends on your Supabase project settings.
@@ -32,7 +57,7 @@ class AuthManager:
             print(f"❌ Sign-up failed: {e}")
             return None
 
-    def sign_in(self, email: str, password: str) -> Optional[dict]:
+    async def sign_in(self, email: str, password: str) -> Optional[dict]:
         """
         Signs in an existing user.
 
@@ -40,22 +65,22 @@ class AuthManager:
             The user session object on success, None on failure.
         """
         try:
-            response = self.auth.sign_in_with_password({"email": email, "password": password})
+            response = await (await self._auth()).sign_in_with_password({"email": email, "password": password})
             print(f"✅ Login successful! Welcome back, {response.user.email}.")
             return response.session
         except Exception as e:
             print(f"❌ Login failed: {e}")
             return None
 
-    def sign_out(self):
+    async def sign_out(self):
         """Signs out the current user."""
         try:
-            self.auth.sign_out()
+            await (await self._auth()).sign_out()
             print("👋 You have been successfully signed out.")
         except Exception as e:
             print(f"❌ Sign-out failed: {e}")
 
-    def get_user_id_from_email(self, email: str) -> Optional[str]:
+    async def get_user_id_from_email(self, email: str) -> Optional[str]:
         """
         Retrieves the user ID for a given email address.
         Note: This requires admin privileges on the Supabase client.
@@ -64,15 +89,59 @@ class AuthManager:
         or a database function to achieve this securely.
         """
         try:
-            # This is a simplified approach. In a production environment,
-            # you should handle this with more robust error checking and security.
-            # The `auth.admin.list_users()` method might be an option with an admin client.
-            # A more secure way is to create a DB function that can be called.
-            # For this project, we'll try a direct query.
-            response = self.client.table('users').select('id').eq('email', email).execute()
-            if response.data:
-                return response.data[0]['id']
+            return await self._query_user_id(email)
+        except Exception as e:
+            metrics.upstream_error("supabase")
+            print(f"❌ Could not retrieve user ID for email {email}: {e}")
             return None
+
+    async def _query_user_id(self, email: str) -> Optional[str]:
+        # This is a simplified approach. In a production environment,
+        # you should handle this with more robust error checking and security.
+        # The `auth.admin.list_users()` method might be an option with an admin client.
+        # A more secure way is to create a DB function that can be called.
+        # For this project, we'll try a direct query.
+        response = await self.client.table('users').select('id').eq('email', email).execute()
+        if response.data:
+            return response.data[0]['id']
+        return None
+
+    async def resolve_user_id(self, email: str) -> Optional[str]:
+        """
+        Async, cached `get_user_id_from_email` for authenticating requests.
+
+        Results are kept for USER_ID_CACHE_TTL_S, unknown emails for
+        USER_ID_NEGATIVE_TTL_S. Concurrent lookups of the same email share one
+        query, so a reconnect storm costs one
+        query per user rather than one per connection.
+        """
+        entry = self._user_ids.get(email)
+        if entry is not None and entry[1] > time.monotonic():
+            self._user_ids.move_to_end(email)
+            return entry[0]
+        task = self._lookups.get(email)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup_user_id(email))
+            self._lookups[email] = task
+            task.add_done_callback(lambda _: self._lookups.pop(email, None))
+        # Shielded: one client disconnecting must not cancel the lookup for the others.
+        return await asyncio.shield(task)
+
+    async def _lookup_user_id(self, email: str) -> Optional[str]:
+        try:
+            user_id = await self._query_user_id(email)
         except Exception as e:
+            # Errors aren't cached: the next request tries again.
+            metrics.upstream_error("supabase")
             print(f"❌ Could not retrieve user ID for email {email}: {e}")
-            return None 
\ No newline at end of file
+            return None
+        self.remember_user_id(email, user_id)
+        return user_id
+
+    def remember_user_id(self, email: str, user_id: Optional[str]):
+        """Caches an email -> user id mapping, e.g. one learned at sign-in."""
+        ttl = USER_ID_CACHE_TTL_S if user_id else USER_ID_NEGATIVE_TTL_S
+        self._user_ids[email] = (user_id, time.monotonic() + ttl)
+        self._user_ids.move_to_end(email)
+        while len(self._user_ids) > USER_ID_CACHE_SIZE:
+            self._user_ids.popitem(last=False)
@@ -0,0 +1,88 @@
+"""
+Per-process background worker for work that must not sit on a response's critical path.
+"""
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+from src.config import BACKGROUND_WORKERS, BACKGROUND_QUEUE_SIZE, BACKGROUND_DRAIN_TIMEOUT_S
+
+Job = Callable[..., Awaitable[None]]
+
+class BackgroundWorker:
+    """
+    Runs submitted coroutine jobs on a fixed number of worker tasks.
+
+    The queue is bounded: when it is full, `submit` waits, pushing back on the
+    producers instead of letting memory grow. On shutdown `stop` drains what is
+    already queued (up to a timeout) before cancelling the workers.
+    """
+    def __init__(self, workers: int = BACKGROUND_WORKERS, queue_size: int = BACKGROUND_QUEUE_SIZE):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting to be picked up."""
+        return self._queue.qsize()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def submit(self, job: Job, *args):
+        """Queues `job(*args)`, waiting for room if the queue is full."""
+        if not self._accepting:
+            raise RuntimeError("Background worker is not running.")
+        await self._queue.put((job, args))
+
+    def try_submit(self, job: Job, *args) -> bool:
+        """
+        Queues `job(*args)` only if there is room right now, for optional work
+        that must never hold up its caller.
+
+        Returns:
+            False if the job was skipped because the queue is full or the worker stopped.
+        """
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put_nowait((job, args))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def stop(self, timeout: float = BACKGROUND_DRAIN_TIMEOUT_S):
+        """Stops accepting jobs, drains the queue, then stops the workers."""
+        self._accepting = False
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️  Background worker stopped with {self.depth} job(s) still queued.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            job, args = await self._queue.get()
+            try:
+                await job(*args)
+            except Exception as e:
+                print(f"❌ Background job {getattr(job, '__qualname__', job)} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+_background_worker: Optional[BackgroundWorker] = None
+
+def get_background_worker() -> BackgroundWorker:
+    """Returns the process-wide BackgroundWorker, creating it on first use."""
+    global _background_worker
+    if _background_worker is None:
+        _background_worker = BackgroundWorker()
+    return _background_worker
@@ -8,16 +8,57 @@ load_dotenv()
 # It's recommended to set your API key in the .env file for security
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# --- Gemini Configuration ---
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-1.5-flash"
+# Shared keep-alive connection pool used by every LLM instance in the process
+GEMINI_POOL_SIZE = 100  # max open connections to the API host
+GEMINI_KEEPALIVE_S = 30  # seconds an idle connection stays in the pool
+GEMINI_DNS_CACHE_TTL_S = 300
+GEMINI_CONNECT_TIMEOUT_S = 5
+GEMINI_REQUEST_TIMEOUT_S = 30
+# Serialized system-instruction prefixes, one per distinct profile version
+GEMINI_PREFIX_CACHE_SIZE = 1024
+# Also register each prefix as server-side cached content, so turns send only
+# their own contents. Needs a model version that supports context caching and a
+# prefix above the API's minimum cacheable size.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL_S = 3600
+
 # --- Supabase Configuration ---
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 # A boolean flag to easily check if Supabase is configured
 USE_SUPABASE = bool(SUPABASE_URL and SUPABASE_KEY)
+# Email -> user id lookups for tokens issued without a `uid` claim
+USER_ID_CACHE_TTL_S = 300
+USER_ID_NEGATIVE_TTL_S = 30  # unknown emails are remembered for less time
+USER_ID_CACHE_SIZE = 10000
+# Shared async client: one connection pool to Supabase per process
+SUPABASE_POOL_SIZE = 100  # max open connections
+SUPABASE_KEEPALIVE_CONNECTIONS = 20  # idle connections kept for reuse
+SUPABASE_KEEPALIVE_S = 30
+SUPABASE_CONNECT_TIMEOUT_S = 5
+SUPABASE_REQUEST_TIMEOUT_S = 10
 
 # --- TTS Configuration ---
 # Voice for Microsoft Edge TTS, find more at `edge-tts --list-voices`
 EDGE_TTS_VOICE = "en-US-AriaNeural"
 
+# Synthesized-audio cache, keyed by (voice, normalized text)
+TTS_CACHE_MEMORY_BYTES = 32 * 1024 * 1024  # in-memory LRU tier
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(".cache", "tts"))
+TTS_CACHE_DISK_BYTES = 512 * 1024 * 1024  # on-disk tier, oldest files evicted first
+TTS_CACHE_MAX_TEXT_CHARS = 200  # longer (unique) answers aren't worth caching
+# Fallback replies synthesized at startup so they are served from the cache on first use.
+# They are split into sentences first, as every spoken reply is.
+TTS_PREWARM_PHRASES = [
+    "I'm having trouble connecting to my brain right now.",
+    "It seems I can't connect to the internet. Please check your connection.",
+    "I've run into an unexpected issue. Please try again.",
+    "I'm not sure how to respond to that.",
+]
+
 # --- STT Configuration ---
 # Energy threshold for silence detection with speech_recognition
 # Higher values mean you have to speak louder
@@ -31,10 +72,19 @@ INPUT_SAMPLE_RATE = 16000  # 16kHz
 INPUT_CHANNELS = 1
 INPUT_FORMAT = "int16"  # 16-bit PCM
 
+# Per-connection audio formats (negotiated with the `input` and `output` /ws query parameters)
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")  # Decodes Opus input, encodes Opus output
+OPUS_DECODE_RATE = 48000  # Opus input is decoded at its native rate, then resampled
+OPUS_BITRATE = "24k"  # Outbound speech; MP3 from edge-tts is 48 kbit/s
+OPUS_PAGE_MS = 60  # Ogg page length, i.e. how often encoded audio is flushed to the client
+
 # VAD - More sensitive settings
 VAD_AGGRESSIVENESS = 1  # Reduced from 3 to 1 for more sensitivity
 VAD_FRAME_MS = 30  # ms
 VAD_SILENCE_TIMEOUT_MS = 2000  # Reduced from 3000 to 2000ms for faster response
+VAD_PRE_ROLL_MS = 300  # Audio kept from before speech onset so soft starts aren't clipped
+VAD_MIN_SPEECH_MS = 200  # Shorter bursts (clicks, coughs) are discarded, not transcribed
+VAD_MAX_UTTERANCE_MS = 30000  # An utterance is cut here even without a pause
 
 # Audio processing
 AUDIO_GAIN = 5.0  # Amplify audio by this factor
@@ -48,6 +98,26 @@ OUTPUT_FORMAT = "int16"
 # --- Models ---
 # STT
 WHISPER_MODEL = "base" # Using multilingual base model
+WHISPER_COMPUTE_TYPE = "int8"  # CPU-friendly quantized inference
+STT_BACKEND = os.getenv("STT_BACKEND", "google")  # "google" (Web Speech API) or "whisper" (local CPU, opt-in)
+# Whisper worker processes per web worker; by default the cores are split between web workers
+STT_WORKERS = int(os.getenv("STT_WORKERS", max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_WORKERS", "1")))))
+STT_QUEUE_SIZE = 32  # Transcription jobs allowed to wait for a free worker
+# Interim transcripts of the utterance in progress (stream ingest only)
+STT_INTERIM = os.getenv("STT_INTERIM", "true").lower() == "true"
+STT_INTERIM_INTERVAL_MS = 400  # How often the utterance so far is re-transcribed
+STT_INTERIM_MIN_SPEECH_MS = 300  # Voiced audio needed before the first interim transcript
+STT_INTERIM_WINDOW_MS = 4000  # Interims transcribe at most this much of the utterance's tail
+STT_INTERIM_CONCURRENCY = 2  # Interim transcriptions in flight per process; more are skipped, not queued
+# A reply is generated speculatively once the interim transcript has stayed the same this long
+SPECULATION_STABLE_MS = 300
+
+# Embeddings
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # 384-dim, matches the conversation_history.embedding column
+# Encode requests from all sessions arriving within this window share one forward pass
+EMBEDDING_BATCH_WINDOW_MS = 10
+EMBEDDING_MAX_BATCH_SIZE = 64
+EMBEDDING_CACHE_BYTES = 64 * 1024 * 1024  # Memoized vectors (~1.5 KB each), LRU-evicted
 
 # TTS
 PIPER_VOICE = "en_US-libritts-high" # As per PRD
@@ -55,9 +125,43 @@ VAKYANSH_VOICE_TE = "te_IN-cmu-male" # Placeholder for Vakyansh Telugu voice
 
 # --- Real-time settings ---
 MIN_INTERRUPTION_DELAY_MS = 100 # To prevent accidental barge-in
+WS_SEND_QUEUE_SIZE = 256  # Outbound messages buffered per WebSocket before producers wait
+# What a broadcast does to a connection whose send queue is full:
+# "drop" it, "coalesce" it with broadcasts still queued, or "disconnect" the client
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")
+
+# --- Deployment ---
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))  # uvicorn worker processes serving HTTP and /ws
+# Open sessions, resumable session state and cross-worker broadcasts
+SESSION_REGISTRY = os.getenv("SESSION_REGISTRY", "memory")  # "memory" (single worker) or "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_STATE_TTL_S = 3600  # How long a disconnected session can be resumed
 
 # --- Conversation ---
-MAX_CONTEXT_TOKENS = 2000
+MAX_CONTEXT_TOKENS = 2000  # Prompt budget: system instruction, profile, history and the user's turn
+PROFILE_MAX_TOKENS = 300  # Share of the budget profile facts may take
+CONTEXT_SUMMARY_MAX_LINES = 24  # Older messages kept as one-line summaries per session
+CONTEXT_SUMMARY_WORDS = 16  # Words kept from a message when it is summarized
+RECENT_CONTEXT_MESSAGES = 4  # Latest messages kept in memory per session for LLM context
+# Semantic recall of older messages
+# "local" (in-process index; one web worker on one node only) or "supabase" (pgvector RPC)
+MEMORY_STORE = os.getenv("MEMORY_STORE", "local")
+LOCAL_MEMORY_DIR = os.getenv("LOCAL_MEMORY_DIR", os.path.join(".cache", "memory"))
+LOCAL_MEMORY_DTYPE = "float32"  # "int8" quantizes vectors to a quarter of the size
+LOCAL_MEMORY_MAX_OPEN_USERS = 1024  # Per-user indexes kept mapped at once
+SEMANTIC_MATCH_THRESHOLD = 0.7  # Minimum cosine similarity for a recalled message
+SEMANTIC_MATCH_COUNT = 3
+
+# --- Background work (persistence, fact extraction) ---
+BACKGROUND_WORKERS = 8  # Post-turn jobs running concurrently per process
+BACKGROUND_QUEUE_SIZE = 1000  # Jobs queued before submitters have to wait
+BACKGROUND_DRAIN_TIMEOUT_S = 10  # Time allowed on shutdown to finish queued jobs
+
+# --- Write-behind persistence ---
+WRITE_BEHIND_BATCH_SIZE = 200  # Pending rows that trigger an immediate bulk insert
+WRITE_BEHIND_FLUSH_MS = 250  # Longest a row waits for its batch to fill
+WRITE_BEHIND_MAX_ATTEMPTS = 5  # Failed writes of a batch before its rows are dropped
+WRITE_BEHIND_MAX_PENDING = 10000  # Rows kept for retry while Supabase is failing; the oldest are dropped beyond this
 
 # --- Database ---
 # PostgreSQL (legacy support)
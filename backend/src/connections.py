@@ -0,0 +1,211 @@
+"""
+WebSocket connections of this worker: per-connection send queues with
+backpressure, and fan-out that never waits on a slow client.
+"""
+import asyncio
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Union
+from fastapi import WebSocket
+from src.session_registry import get_session_registry
+from src import metrics
+from src.config import WS_SEND_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY
+
+# Tag of broadcast messages in a send queue; turn output is tagged with its turn id (> 0)
+# and other session-level messages with 0.
+BROADCAST = -1
+# Close code for connections dropped by the "disconnect" policy ("Try Again Later").
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+Payload = Union[str, bytes]
+
+class Connection:
+    """
+    One WebSocket and the bounded queue of messages waiting to go out on it,
+    drained by a writer task of its own so no producer ever awaits the socket.
+
+    The session's own output goes through `send`, which waits while the queue
+    is full. Broadcasts go through `offer`, which never waits; when the queue
+    is full it applies `policy`:
+
+        drop        the broadcast is discarded for this connection
+        coalesce    broadcasts still queued are replaced by the newest one
+        disconnect  the connection is closed so the client can reconnect
+    """
+    def __init__(self, connection_id: str, user_id: str, websocket: WebSocket,
+                 queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY):
+        if policy not in ("drop", "coalesce", "disconnect"):
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.id = connection_id
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.policy = policy
+        # Set by the owner to discard queued messages by tag just before they are sent.
+        self.skip: Optional[Callable[[int], bool]] = None
+        self.closed = False
+        self._items: deque = deque()
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self.writer: Optional[asyncio.Task] = None
+
+    @property
+    def full(self) -> bool:
+        return len(self._items) >= self.queue_size
+
+    def start(self):
+        if self.writer is None:
+            self.writer = asyncio.create_task(self._write_loop())
+
+    async def send(self, payload: Payload, tag: int = 0):
+        """Queues a message, waiting while the queue is full. Dropped once the connection is closed."""
+        while self.full and not self.closed:
+            self._room.clear()
+            await self._room.wait()
+        if not self.closed:
+            self._push(tag, payload)
+
+    def try_send(self, payload: Payload, tag: int = 0) -> bool:
+        """Queues a message if there is room right now."""
+        if self.closed or self.full:
+            return False
+        self._push(tag, payload)
+        return True
+
+    def offer(self, payload: Payload) -> bool:
+        """Queues a broadcast without waiting, applying the slow-consumer policy if the queue is full."""
+        if self.closed:
+            return False
+        if not self.full:
+            self._push(BROADCAST, payload)
+            return True
+        metrics.slow_consumer(self.policy)
+        if self.policy == "coalesce":
+            self.purge(lambda tag: tag == BROADCAST)
+            if not self.full:
+                self._push(BROADCAST, payload)
+                return True
+        elif self.policy == "disconnect":
+            print(f"🐢 Closing slow connection {self.id} of {self.user_id}.")
+            asyncio.create_task(self.close(SLOW_CONSUMER_CLOSE_CODE))
+        return False
+
+    def purge(self, drop: Callable[[int], bool]):
+        """Removes queued messages whose tag matches `drop`."""
+        kept = [item for item in self._items if not drop(item[0])]
+        if len(kept) != len(self._items):
+            self._items = deque(kept)
+            self._room.set()
+
+    async def close(self, code: int = 1000):
+        """Stops the writer, discarding anything still queued, and closes the socket."""
+        if self.closed:
+            return
+        self.closed = True
+        self._items.clear()
+        self._ready.set()
+        self._room.set()
+        try:
+            await self.websocket.close(code)
+        except Exception:
+            pass  # Already closed by the client.
+
+    def _push(self, tag: int, payload: Payload):
+        self._items.append((tag, payload))
+        self._ready.set()
+
+    async def _write_loop(self):
+        """Sends queued messages in order until the connection closes; a failed send ends it."""
+        try:
+            while not self.closed:
+                if not self._items:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                tag, payload = self._items.popleft()
+                self._room.set()
+                if self.skip is not None and self.skip(tag):
+                    continue
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+        finally:
+            self.closed = True
+            self._room.set()
+
+class ConnectionManager:
+    """
+    This worker's connections, indexed by id and by user. Each session is also
+    recorded in the shared session registry, and `broadcast` goes through the
+    registry so it reaches the connections of every worker.
+    """
+    def __init__(self):
+        self.connections: Dict[str, Connection] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+
+    async def connect(self, websocket: WebSocket, connection_id: str, user_id: str) -> Connection:
+        """
+        Accepts a connection; one still open under the same id (a client reconnecting) is closed.
+
+        Raises:
+            Exception: If the session registry can't record the session; the
+                connection is closed with 1011 and nothing of it is left behind.
+        """
+        await websocket.accept()
+        stale = self.connections.get(connection_id)
+        if stale is not None:
+            await self.disconnect(stale)
+        connection = Connection(connection_id, user_id, websocket)
+        connection.start()
+        self.connections[connection_id] = connection
+        self._by_user.setdefault(user_id, set()).add(connection_id)
+        try:
+            await get_session_registry().register(connection_id, user_id)
+        except Exception as e:
+            metrics.upstream_error("session_registry")
+            print(f"❌ Error registering session {connection_id}: {e}")
+            await self.disconnect(connection, code=1011)
+            raise
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = 1000):
+        await connection.close(code)
+        if connection.writer is not None:
+            await asyncio.gather(connection.writer, return_exceptions=True)
+        # A newer connection may have taken over the id; leave its entries alone.
+        if self.connections.get(connection.id) is not connection:
+            return
+        del self.connections[connection.id]
+        ids = self._by_user[connection.user_id]
+        ids.discard(connection.id)
+        if not ids:
+            del self._by_user[connection.user_id]
+        try:
+            await get_session_registry().unregister(connection.id)
+        except Exception as e:
+            # The registry entry is removed when this worker stops.
+            metrics.upstream_error("session_registry")
+            print(f"❌ Error unregistering session {connection.id}: {e}")
+
+    def get(self, connection_id: str) -> Optional[Connection]:
+        return self.connections.get(connection_id)
+
+    def for_user(self, user_id: str) -> List[Connection]:
+        """This worker's open connections of `user_id`."""
+        return [self.connections[connection_id] for connection_id in self._by_user.get(user_id, ())]
+
+    async def send_personal_message(self, message: str, connection: Connection):
+        await connection.send(message)
+
+    async def broadcast(self, message: str):
+        await get_session_registry().publish(message)
+
+    async def deliver(self, message: str):
+        """
+        Queues a broadcast, from any worker, on every connection of this one.
+        Nothing here awaits a socket, so fan-out time depends only on the
+        connection count, not on how fast any client reads.
+        """
+        for connection in list(self.connections.values()):
+            connection.offer(message)
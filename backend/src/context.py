@@ -0,0 +1,107 @@
+"""
+Token-budgeted assembly of the conversation history sent to Gemini each turn.
+"""
+from datetime import datetime
+from typing import Dict, List
+from src.config import PROFILE_MAX_TOKENS, CONTEXT_SUMMARY_WORDS
+
+# Role and part framing Gemini counts on top of each message's text.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "Summary of our earlier conversation:"
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local token estimate: about four characters per token for English
+    text. Close enough for budgeting without a `countTokens` round trip.
+    """
+    return (len(text) + 3) // 4
+
+def summarize(text: str, max_words: int = CONTEXT_SUMMARY_WORDS) -> str:
+    """Collapses a message to its first `max_words` words."""
+    words = text.split()
+    if len(words) <= max_words:
+        return " ".join(words)
+    return " ".join(words[:max_words]) + "…"
+
+def summary_line(role: str, text: str) -> str:
+    """One line of the earlier-conversation summary for a message."""
+    return f"{'User' if role == 'user' else 'You'}: {summarize(text)}"
+
+def fit_profile(facts: List[Dict[str, str]], max_tokens: int = PROFILE_MAX_TOKENS) -> List[Dict[str, str]]:
+    """Keeps profile facts, in order, until they would exceed `max_tokens`."""
+    kept, used = [], 0
+    for fact in facts:
+        cost = estimate_tokens(f"- {fact['key']}: {fact['value']}\n")
+        if used + cost > max_tokens:
+            break
+        kept.append(fact)
+        used += cost
+    return kept
+
+class ContextBuilder:
+    """
+    Packs history into a fixed token budget, so prompt size stays bounded no
+    matter how long a user has been talking.
+
+    Candidates are scored by recency (the newest message scores 1, each older
+    one `recency_decay` times less) plus their similarity to the current
+    utterance. In score order each goes in verbatim if it fits, else as a
+    short summary if that fits. Whatever budget is left holds the one-line
+    summaries of turns that have aged out of recent context, newest first.
+    """
+    def __init__(self, recency_decay: float = 0.5):
+        self.recency_decay = recency_decay
+
+    def pack(self, recent: List[Dict], semantic: List[Dict], summaries: List[str],
+             budget: int) -> List[Dict]:
+        """
+        Args:
+            recent: Recent messages ('role', 'text', 'created_at'), oldest first.
+            semantic: Recalled messages ('role', 'content', 'created_at', 'similarity').
+            summaries: Summary lines of older messages, oldest first.
+            budget: Tokens the history may take.
+
+        Returns:
+            Gemini `contents` entries, in conversation order.
+        """
+        candidates: Dict[str, Dict] = {}
+        for item in semantic:
+            text = item.get('content')
+            if text:
+                candidates[text] = {'role': item['role'], 'text': text, 'created_at': item['created_at'],
+                                    'score': item.get('similarity', 0.0)}
+        for age, item in enumerate(reversed(recent)):
+            text = item.get('text')
+            if not text:
+                continue
+            recency = self.recency_decay ** age
+            if text in candidates:
+                candidates[text]['score'] += recency
+            else:
+                candidates[text] = {'role': item['role'], 'text': text, 'created_at': item['created_at'],
+                                    'score': recency}
+
+        chosen = []
+        for item in sorted(candidates.values(), key=lambda c: c['score'], reverse=True):
+            for text in (item['text'], summarize(item['text'])):
+                cost = estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+                if cost <= budget:
+                    chosen.append((item, text))
+                    budget -= cost
+                    break
+        chosen.sort(key=lambda pair: datetime.fromisoformat(pair[0]['created_at']))
+        contents = [{"role": item['role'], "parts": [{"text": text}]} for item, text in chosen]
+
+        budget -= estimate_tokens(SUMMARY_HEADER) + MESSAGE_OVERHEAD_TOKENS
+        lines = []
+        for line in reversed(summaries):
+            cost = estimate_tokens(line) + 1
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        if lines:
+            summary = "\n".join([SUMMARY_HEADER] + lines[::-1])
+            contents.insert(0, {"role": "user", "parts": [{"text": summary}]})
+        return contents
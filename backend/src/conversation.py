@@ -2,36 +2,65 @@
 Refactored ConversationManager to be fully asynchronous and use the Supabase Python client.
 """
 import asyncio
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional
-from src.config import USE_SUPABASE, SUPABASE_URL, SUPABASE_KEY
-from supabase import create_client, Client
-from datetime import datetime
+from collections import deque
+from typing import List, Dict, Optional, Set, Tuple
+import json
+from src.config import (
+    USE_SUPABASE, RECENT_CONTEXT_MESSAGES,
+    SEMANTIC_MATCH_THRESHOLD, SEMANTIC_MATCH_COUNT, MAX_CONTEXT_TOKENS, CONTEXT_SUMMARY_MAX_LINES
+)
+from src.context import ContextBuilder, estimate_tokens, summary_line
+from src.embeddings import EmbeddingService, get_embedding_service
+from src.write_behind import WriteBehindBuffer, get_write_behind
+from src.memory_store import MemoryStore, get_memory_store
+from src.db import get_supabase, open_supabase
+from src import metrics
+from supabase import AsyncClient
+from datetime import datetime, timedelta, timezone
 
 class ConversationManager:
     """
     Manages conversation state and history using Supabase.
     This class is designed to be used in an async environment.
     """
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, client: Optional[AsyncClient] = None,
+                 embedding_service: Optional[EmbeddingService] = None,
+                 writer: Optional[WriteBehindBuffer] = None, memory_store: Optional[MemoryStore] = None):
         if not user_id:
             raise ValueError("A user ID must be provided to initialize the ConversationManager.")
         self.user_id = user_id
         self.use_supabase = USE_SUPABASE
-        self.supabase: Optional[Client] = self._connect_supabase()
+        self.supabase: Optional[AsyncClient] = self._connect_supabase(client)
         if self.use_supabase and self.supabase:
             print("✅ Conversation history is enabled (Supabase).")
-            # The embedding model is loaded only if Supabase is in use.
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Embeddings come from the process-wide service so sessions share one model.
+            self.embeddings: Optional[EmbeddingService] = embedding_service or get_embedding_service()
+            # Writes are batched across sessions by the process-wide write-behind buffer.
+            self.writer: Optional[WriteBehindBuffer] = writer or get_write_behind()
+            # Semantic recall goes through the pluggable, process-wide memory store.
+            self.memory: Optional[MemoryStore] = memory_store or get_memory_store()
         else:
             print("⚠️  Conversation history is disabled. Supabase not configured in .env file.")
-            self.embedding_model = None
+            self.embeddings = None
+            self.writer = None
+            self.memory = None
 
-    def _connect_supabase(self) -> Optional[Client]:
-        """Establishes a connection to Supabase if configured."""
+        # In-memory copies of what this session reads every turn. Loaded once by
+        # `load` and kept current by our own writes, so steady-state turns don't
+        # query Supabase just to rebuild recent context.
+        self._recent: deque = deque(maxlen=RECENT_CONTEXT_MESSAGES)
+        self._recent_loaded = False
+        # One-line summaries of messages that have aged out of `_recent`. Each is
+        # made once, when its message is evicted, and reused every turn after.
+        self._summaries: deque = deque(maxlen=CONTEXT_SUMMARY_MAX_LINES)
+        self.context_builder = ContextBuilder()
+        self._profile: Optional[Dict[str, str]] = None
+
+    def _connect_supabase(self, client: Optional[AsyncClient]) -> Optional[AsyncClient]:
+        """Uses the given client, or the process-wide one, if Supabase is configured."""
         if self.use_supabase:
             try:
-                return create_client(SUPABASE_URL, SUPABASE_KEY)
+                return client or get_supabase()
             except Exception as e:
                 print(f"❌ Failed to connect to Supabase: {e}")
                 return None
@@ -39,43 +68,152 @@ class ConversationManager:
 
     async def add_message(self, role: str, text: str):
         """Adds a message to the conversation history in Supabase."""
-        if not self.use_supabase or not self.supabase or not self.embedding_model:
+        await self.add_messages([(role, text)])
+
+    async def load(self):
+        """Loads recent turns and the user profile into memory. Called once at connect."""
+        if not self.use_supabase or not self.supabase:
             return
+        await asyncio.gather(self._load_recent_context(), self._load_user_profile())
 
-        embedding = self.embedding_model.encode(text).tolist()
-        
+    def snapshot(self) -> Dict:
+        """The in-memory context as plain data, so another worker can resume this session."""
+        return {
+            'recent': list(self._recent) if self._recent_loaded else None,
+            'summaries': list(self._summaries),
+            'profile': self._profile,
+        }
+
+    def restore(self, state: Dict):
+        """
+        Adopts a snapshot taken by `snapshot`, in place of `load`. The snapshot
+        includes turns still sitting in another worker's write-behind buffer,
+        which a fresh read from Supabase would miss.
+        """
+        if state.get('recent') is not None:
+            self._recent.clear()
+            self._recent.extend(state['recent'])
+            self._summaries.clear()
+            self._summaries.extend(state.get('summaries') or [])
+            self._recent_loaded = True
+        if state.get('profile') is not None:
+            self._profile = dict(state['profile'])
+
+    async def backfill_memory(self):
+        """
+        Seeds the memory store with the user's existing history from Supabase,
+        once per user. Pages through the whole history, so it runs as a
+        background job rather than on a turn's critical path.
+        """
+        if not self.use_supabase or not self.supabase:
+            return
+        if self.user_id in _backfilling or not await self.memory.needs_backfill(self.user_id):
+            return
+        _backfilling.add(self.user_id)
         try:
-            await asyncio.to_thread(
-                lambda: self.supabase.table('conversation_history').insert({
-                    'session_id': self.user_id,
-                    'role': role,
-                    'text': text,
-                    'embedding': embedding
-                }).execute()
-            )
+            rows, page_size = [], 1000
+            while True:
+                response = await (
+                    self.supabase.table('conversation_history')
+                    .select('role, text, created_at, embedding')
+                    .eq('session_id', self.user_id)
+                    .order('created_at')
+                    .range(len(rows), len(rows) + page_size - 1)
+                    .execute()
+                )
+                rows.extend(response.data)
+                if len(response.data) < page_size:
+                    break
+            for row in rows:
+                # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings.
+                if isinstance(row['embedding'], str):
+                    row['embedding'] = json.loads(row['embedding'])
+            await self.memory.seed(self.user_id, [row for row in rows if row['embedding']])
+            print(f"✅ Seeded {self.memory.name} memory store with {len(rows)} message(s).")
         except Exception as e:
-            print(f"❌ Error adding message to Supabase: {e}")
+            metrics.upstream_error("supabase")
+            print(f"❌ Error seeding memory store from Supabase: {e}")
+        finally:
+            _backfilling.discard(self.user_id)
+
+    async def add_messages(self, messages: List[Tuple[str, str]]):
+        """
+        Adds (role, text) messages, e.g. both sides of a turn, to the conversation
+        history. Rows are queued on the write-behind buffer and inserted in bulk.
+        """
+        if not self.use_supabase or not self.supabase or not self.embeddings or not messages:
+            return
 
-    async def _get_semantic_context(self, current_text: str, max_results: int = 3) -> List[Dict]:
-        """Retrieves semantically similar messages from the past."""
-        current_embedding = self.embedding_model.encode(current_text).tolist()
+        embeddings = await asyncio.gather(*[self.embeddings.encode(text) for _, text in messages])
+        # Timestamps are taken now, not at insert time, so rows written in one
+        # bulk insert keep their order.
+        created_at = datetime.now(timezone.utc)
+        rows = [
+            {
+                'session_id': self.user_id,
+                'role': role,
+                'text': text,
+                'embedding': embedding,
+                'created_at': (created_at + timedelta(microseconds=i)).isoformat(),
+            }
+            for i, ((role, text), embedding) in enumerate(zip(messages, embeddings))
+        ]
+        self.writer.add_messages(rows)
         try:
-            response = await asyncio.to_thread(
-                lambda: self.supabase.rpc(
-                    'match_conversations', 
-                    {'query_embedding': current_embedding, 'match_threshold': 0.7, 'match_count': max_results}
-                ).execute()
-            )
-            return response.data
+            await self.memory.add(self.user_id, rows)
         except Exception as e:
+            metrics.upstream_error("memory_store")
+            print(f"❌ Error indexing messages in the {self.memory.name} memory store: {e}")
+        for row in rows:
+            self._remember_recent({'role': row['role'], 'text': row['text'], 'created_at': row['created_at']})
+
+    def _remember_recent(self, item: Dict):
+        """Appends to recent context, summarizing the message it pushes out."""
+        if len(self._recent) == self._recent.maxlen:
+            evicted = self._recent[0]
+            self._summaries.append(summary_line(evicted['role'], evicted['text']))
+        self._recent.append(item)
+
+    async def flush(self):
+        """Writes any buffered history and profile facts to Supabase now."""
+        if self.writer:
+            await self.writer.flush()
+
+    async def _get_semantic_context(self, current_text: str, max_results: int = SEMANTIC_MATCH_COUNT) -> List[Dict]:
+        """Retrieves semantically similar messages from this user's past."""
+        current_embedding = await self.embeddings.encode(current_text)
+        try:
+            return await self.memory.search(self.user_id, current_embedding, SEMANTIC_MATCH_THRESHOLD, max_results)
+        except Exception as e:
+            metrics.upstream_error("memory_store")
             print(f"❌ Vector search error: {e}.")
             return []
 
-    async def _get_recent_context(self, max_results: int = 4) -> List[Dict]:
-        """Retrieves the most recent messages."""
+    async def _get_recent_context(self) -> List[Dict]:
+        """Retrieves the most recent messages, from memory once loaded."""
+        if not self._recent_loaded:
+            await self._load_recent_context()
+        return [dict(item) for item in self._recent]
+
+    async def _load_recent_context(self):
+        # Older rows beyond the recent window seed the summaries.
+        rows = await self._fetch_recent_context(self._recent.maxlen + self._summaries.maxlen)
+        if rows is None:
+            return
+        # Messages this session wrote while the query was in flight are newer.
+        messages = list(reversed(rows)) + list(self._recent)
+        older, recent = messages[:-self._recent.maxlen], messages[-self._recent.maxlen:]
+        self._summaries.clear()
+        self._summaries.extend(summary_line(item['role'], item['text']) for item in older)
+        self._recent.clear()
+        self._recent.extend(recent)
+        self._recent_loaded = True
+
+    async def _fetch_recent_context(self, max_results: int) -> Optional[List[Dict]]:
+        """Queries the most recent messages (newest first), or None on failure."""
         try:
-            response = await asyncio.to_thread(
-                lambda: self.supabase.table('conversation_history')
+            response = await (
+                self.supabase.table('conversation_history')
                 .select('role, text, created_at')
                 .eq('session_id', self.user_id)
                 .order('created_at', desc=True)
@@ -84,95 +222,95 @@ class ConversationManager:
             )
             return response.data
         except Exception as e:
+            metrics.upstream_error("supabase")
             print(f"❌ Error fetching simple history from Supabase: {e}")
-            return []
+            return None
 
-    async def get_context_for_llm(self, current_text: str) -> List[Dict[str, str]]:
+    async def get_context_for_llm(self, current_text: str, budget_tokens: Optional[int] = None) -> List[Dict[str, str]]:
         """
-        Retrieves a combined context of recent and semantically relevant messages.
+        Retrieves a combined context of recent and semantically relevant messages,
+        packed by the context builder into `budget_tokens` (by default, whatever
+        MAX_CONTEXT_TOKENS leaves after the current text).
         """
-        if not self.use_supabase or not self.supabase or not self.embedding_model:
+        if not self.use_supabase or not self.supabase or not self.embeddings:
             return []
-        
+        if budget_tokens is None:
+            budget_tokens = MAX_CONTEXT_TOKENS - estimate_tokens(current_text)
+
         # Concurrently fetch recent and semantic history
-        tasks = [
+        recent_history, semantic_history = await asyncio.gather(
             self._get_recent_context(),
             self._get_semantic_context(current_text)
-        ]
-        results = await asyncio.gather(*tasks)
-        recent_history, semantic_history = results[0], results[1]
-
-        # Combine and deduplicate the histories
-        combined_history = {}
-        for item in semantic_history:
-            # The RPC function returns 'content' for the text field
-            item_text = item.get('content')
-            if item_text:
-                combined_history[item_text] = item
-
-        for item in recent_history:
-            item_text = item.get('text')
-            if item_text:
-                # The table select returns 'text' for the text field
-                # Unify the key to 'text' for consistent formatting
-                item['content'] = item_text
-                combined_history[item_text] = item
-        
-        # Sort the unique history items by timestamp
-        sorted_history = sorted(list(combined_history.values()), key=lambda x: datetime.fromisoformat(x['created_at']))
-        
-        # Format for the Gemini API
-        return [{"role": row['role'], "parts": [{"text": row['content']}]} for row in sorted_history]
+        )
+        return self.context_builder.pack(recent_history, semantic_history, list(self._summaries), budget_tokens)
 
     async def get_user_profile(self) -> List[Dict[str, str]]:
-        """Retrieves all facts for the current user."""
+        """Retrieves all facts for the current user, from memory once loaded."""
         if not self.use_supabase or not self.supabase:
             return []
+        if self._profile is None:
+            await self._load_user_profile()
+        return [{'key': key, 'value': value} for key, value in (self._profile or {}).items()]
+
+    async def _load_user_profile(self):
+        rows = await self._fetch_user_profile()
+        if rows is not None:
+            self._profile = {**{row['key']: row['value'] for row in rows}, **(self._profile or {})}
+
+    async def _fetch_user_profile(self) -> Optional[List[Dict[str, str]]]:
+        """Queries all facts for the current user, or None on failure."""
         try:
-            response = await asyncio.to_thread(
-                lambda: self.supabase.table('user_profile')
+            response = await (
+                self.supabase.table('user_profile')
                 .select('key, value')
                 .eq('user_id', self.user_id)
                 .execute()
             )
             return response.data
         except Exception as e:
+            metrics.upstream_error("supabase")
             print(f"❌ Error fetching user profile from Supabase: {e}")
-            return []
+            return None
 
     async def update_user_profile(self, facts: List[Dict[str, str]]):
-        """Updates (upserts) a list of facts for the user."""
+        """
+        Updates (upserts) a list of facts for the user. Facts are queued on the
+        write-behind buffer and written with a single set-based RPC.
+        """
         if not self.use_supabase or not self.supabase or not facts:
             return
 
-        try:
-            for fact in facts:
-                await asyncio.to_thread(
-                    lambda fact=fact: self.supabase.rpc(
-                        'upsert_user_profile',
-                        {'p_user_id': self.user_id, 'p_key': fact['key'], 'p_value': fact['value']}
-                    ).execute()
-                )
-            print(f"✅ Updated user profile with facts: {facts}")
-        except Exception as e:
-            print(f"❌ Error updating user profile in Supabase: {e}")
+        valid = [fact for fact in facts if isinstance(fact, dict) and 'key' in fact and 'value' in fact]
+        self.writer.upsert_facts(self.user_id, valid)
+        # Update the cached profile in place rather than dropping it: the write is
+        # still buffered, so re-reading Supabase now would return stale values.
+        if self._profile is not None:
+            for fact in valid:
+                self._profile[fact['key']] = str(fact['value'])
+        print(f"✅ Queued user profile facts: {valid}")
 
     async def clear_history(self):
         """Clears the history for the current session in Supabase."""
         if not self.use_supabase or not self.supabase:
             return
         try:
-            await asyncio.to_thread(
-                lambda: self.supabase.table('conversation_history').delete().eq('session_id', self.user_id).execute()
-            )
+            await self.supabase.table('conversation_history').delete().eq('session_id', self.user_id).execute()
+            self._recent.clear()
+            self._summaries.clear()
             print(f"✅ History cleared for session: {self.user_id}")
         except Exception as e:
+            metrics.upstream_error("supabase")
             print(f"❌ Error clearing history in Supabase: {e}")
 
+# Users whose memory store is being seeded right now, so concurrent sessions don't seed twice.
+_backfilling: Set[str] = set()
+
 # --- Example Usage ---
 async def main():
     """Example of how to use the async ConversationManager."""
     print("--- ConversationManager Example ---")
+    if USE_SUPABASE:
+        await open_supabase()
     manager = ConversationManager("user_123")
     
     if not manager.use_supabase:
@@ -187,6 +325,7 @@ async def main():
     await manager.add_message("model", "The capital of Italy is Rome.")
     await manager.add_message("user", "And what is its most famous landmark?")
     await manager.add_message("model", "That would likely be the Colosseum.")
+    await manager.flush()
 
     print("\nSearching for context related to 'famous places there'...")
     context = await manager.get_context_for_llm("famous places there")
@@ -0,0 +1,58 @@
+"""
+Process-wide async Supabase client shared by every component that talks to the database.
+"""
+from typing import Optional
+import httpx
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from src.config import (
+    SUPABASE_URL, SUPABASE_KEY, SUPABASE_POOL_SIZE, SUPABASE_KEEPALIVE_CONNECTIONS,
+    SUPABASE_KEEPALIVE_S, SUPABASE_CONNECT_TIMEOUT_S, SUPABASE_REQUEST_TIMEOUT_S
+)
+
+_client: Optional[AsyncClient] = None
+_http: Optional[httpx.AsyncClient] = None
+
+async def open_supabase() -> AsyncClient:
+    """
+    Opens the shared client. Called from the app lifespan so every session,
+    the auth layer and the write-behind buffer reuse one pool of keep-alive
+    connections, and the socket count stays flat as sessions grow.
+    """
+    global _client, _http
+    if _client is not None:
+        return _client
+    http = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_S,
+        ),
+        timeout=httpx.Timeout(SUPABASE_REQUEST_TIMEOUT_S, connect=SUPABASE_CONNECT_TIMEOUT_S),
+    )
+    # The service client never signs users in, so it has no session to persist or refresh.
+    options = AsyncClientOptions(
+        httpx_client=http,
+        postgrest_client_timeout=SUPABASE_REQUEST_TIMEOUT_S,
+        auto_refresh_token=False,
+        persist_session=False,
+    )
+    client = await acreate_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+    if _client is not None:
+        # Another caller opened it while we were creating ours.
+        await http.aclose()
+        return _client
+    _client, _http = client, http
+    return _client
+
+async def close_supabase():
+    """Closes the shared client and its pooled connections."""
+    global _client, _http
+    if _http is not None:
+        await _http.aclose()
+    _client, _http = None, None
+
+def get_supabase() -> AsyncClient:
+    """Returns the shared client; `open_supabase` must have been awaited first."""
+    if _client is None:
+        raise RuntimeError("Supabase client is not open; call open_supabase() first.")
+    return _client
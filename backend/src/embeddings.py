@@ -0,0 +1,193 @@
+"""
+Process-wide embedding service shared by every conversation session.
+"""
+import asyncio
+import hashlib
+import re
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import numpy as np
+from src.config import (
+    EMBEDDING_MODEL, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_CACHE_BYTES
+)
+from src import metrics
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+def content_key(text: str) -> str:
+    """
+    Hash of the text as the model sees it. all-MiniLM-L6-v2 uses an uncased
+    tokenizer, so case and whitespace differences don't change the embedding.
+    """
+    normalized = re.sub(r"\s+", " ", text).strip().lower()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+class EmbeddingService:
+    """
+    Owns the single SentenceTransformer model for the process.
+    `encode` requests from all sessions are queued and grouped into micro-batches,
+    so concurrent users share one batched forward pass instead of each encoding
+    a single sentence on their own copy of the model.
+
+    Results are memoized in an LRU keyed by content hash and bounded by bytes, and
+    concurrent requests for the same text share one encode. An utterance is thus
+    encoded once per turn, and common phrases hit across sessions.
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL,
+                 batch_window_ms: int = EMBEDDING_BATCH_WINDOW_MS,
+                 max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+                 cache_bytes: int = EMBEDDING_CACHE_BYTES):
+        self.model_name = model_name
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.model: Optional["SentenceTransformer"] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cached_bytes = 0
+        # Encodes queued or running, by content key, so duplicates share them.
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def depth(self) -> int:
+        """Texts waiting to be batched."""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        """Loads the model (off the event loop) and starts the batching worker."""
+        async with self._start_lock:
+            if self.is_running:
+                return
+            if self.model is None:
+                print(f"🧮 Loading embedding model '{self.model_name}'...")
+                self.model = await asyncio.to_thread(_load_model, self.model_name)
+                print("✅ Embedding model loaded.")
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the batching worker and fails every request still queued, being
+        batched or being encoded, so no caller is left waiting on it.
+        """
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+        # Every request not yet answered is in `_inflight`, wherever the worker had got to.
+        inflight, self._inflight = self._inflight, {}
+        for future in inflight.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Embedding service stopped."))
+
+    async def encode(self, text: str) -> List[float]:
+        """
+        Encodes a single text, batched together with concurrent requests.
+
+        Returns:
+            The embedding as a list of floats.
+        """
+        key = content_key(text)
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return vector.tolist()
+
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                if not self.is_running:
+                    await self.start()
+            except BaseException:
+                self._inflight.pop(key, None)
+                future.cancel()
+                raise
+            self._queue.put_nowait((key, text, future))
+        # Shielded: one caller giving up must not cancel the encode for the others.
+        vector = await asyncio.shield(future)
+        return vector.tolist()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if key in self._cache:
+            return
+        self._cache[key] = vector
+        self._cached_bytes += vector.nbytes
+        while self._cached_bytes > self.cache_bytes and self._cache:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+
+    async def _collect_batch(self) -> List[Tuple[str, str, asyncio.Future]]:
+        """Waits for one request, then gathers more until the window closes or the batch is full."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            texts = [text for _, text, _ in batch]
+            try:
+                vectors = await asyncio.to_thread(
+                    self.model.encode, texts, batch_size=len(texts), convert_to_numpy=True
+                )
+            except Exception as e:
+                metrics.upstream_error("embeddings")
+                print(f"❌ Embedding batch of {len(texts)} failed: {e}")
+                for key, _, future in batch:
+                    self._inflight.pop(key, None)
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (key, _, future), vector in zip(batch, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                self._inflight.pop(key, None)
+                if not future.done():
+                    future.set_result(vector)
+
+def _load_model(model_name: str) -> "SentenceTransformer":
+    # Imported here: sentence-transformers pulls in torch, which takes seconds
+    # to import and would otherwise be paid by every process that imports us.
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+_embedding_service: Optional[EmbeddingService] = None
+
+def get_embedding_service() -> EmbeddingService:
+    """Returns the process-wide EmbeddingService, creating it on first use."""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = EmbeddingService()
+    return _embedding_service
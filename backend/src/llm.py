@@ -1,22 +1,63 @@
 """
 Refactored LLM module to use aiohttp for direct, fast communication with the Gemini API.
 """
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 import aiohttp
-from src.config import GEMINI_API_KEY
-from typing import List, Dict
+from src.config import (
+    GEMINI_API_KEY, GEMINI_API_BASE, GEMINI_MODEL, GEMINI_POOL_SIZE, GEMINI_KEEPALIVE_S,
+    GEMINI_DNS_CACHE_TTL_S, GEMINI_CONNECT_TIMEOUT_S, GEMINI_REQUEST_TIMEOUT_S,
+    GEMINI_PREFIX_CACHE_SIZE, GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_TTL_S
+)
+from src.context import MESSAGE_OVERHEAD_TOKENS, estimate_tokens, fit_profile
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+import json
+from src import metrics
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+class _Prefix:
+    """A serialized system instruction and its estimated token count."""
+    __slots__ = ("json", "tokens")
+
+    def __init__(self, system_text: str):
+        self.json = json.dumps({"parts": [{"text": system_text}]}).encode("utf-8")
+        self.tokens = estimate_tokens(system_text)
 
 class LLM:
     """
     Handles communication with the Gemini LLM.
-    Uses aiohttp for fast, asynchronous API calls.
+    Uses aiohttp for fast, asynchronous API calls over one process-wide,
+    keep-alive connection pool shared by every instance.
+
+    The system instruction (persona plus profile facts) is the same bytes every
+    turn until the profile changes, so it is serialized once per profile version
+    and spliced into each request body. With GEMINI_CONTEXT_CACHE it is also
+    registered as server-side cached content, and turns send only their contents.
     """
+    _session: Optional[aiohttp.ClientSession] = None
+    # Shared by every instance: profile version -> serialized prefix.
+    _prefixes: "OrderedDict[str, _Prefix]" = OrderedDict()
+    # Profile version -> (cachedContents name, or None if the API refused it; refresh deadline).
+    _cached_contents: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+    _cache_tasks: Dict[str, asyncio.Task] = {}
+
     def __init__(self, api_key: str = GEMINI_API_KEY):
         if not api_key:
             raise ValueError("GEMINI_API_KEY is not set in the .env file.")
         self.api_key = api_key
-        self.api_url = (
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
-            f"?key={self.api_key}"
+        self.api_url = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent?key={self.api_key}"
+        self.stream_url = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={self.api_key}"
+        self.cache_url = f"{GEMINI_API_BASE}/cachedContents?key={self.api_key}"
+        self.request_timeout = aiohttp.ClientTimeout(
+            total=GEMINI_REQUEST_TIMEOUT_S, sock_connect=GEMINI_CONNECT_TIMEOUT_S
+        )
+        # A streamed answer may legitimately take longer than the total timeout,
+        # so only the gap between chunks is bounded.
+        self.stream_timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=GEMINI_CONNECT_TIMEOUT_S, sock_read=GEMINI_REQUEST_TIMEOUT_S
         )
         # The system instruction defines the AI's personality.
         # This is now a separate object to be passed in the API call.
@@ -65,6 +106,139 @@ class LLM:
             }]
         }
 
+        self._persona_hash = hashlib.blake2b(
+            self.system_instruction['parts'][0]['text'].encode("utf-8"), digest_size=16
+        ).digest()
+
+    @classmethod
+    async def open_session(cls) -> aiohttp.ClientSession:
+        """
+        Opens the shared HTTP session. Called from the app lifespan so the pool
+        lives as long as the process and TLS connections are reused across turns.
+        """
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=GEMINI_POOL_SIZE,
+                keepalive_timeout=GEMINI_KEEPALIVE_S,
+                ttl_dns_cache=GEMINI_DNS_CACHE_TTL_S,
+            )
+            cls._session = aiohttp.ClientSession(connector=connector)
+        return cls._session
+
+    @classmethod
+    async def close_session(cls):
+        """Closes the shared HTTP session and its pooled connections."""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Falls back to opening the pool lazily when used outside the app (e.g. scripts).
+        if LLM._session is None or LLM._session.closed:
+            return await LLM.open_session()
+        return LLM._session
+
+    def _system_text(self, user_profile: List[Dict]) -> str:
+        system_text = self.system_instruction['parts'][0]['text']
+        if user_profile:
+            system_text += "\n\nHere are some facts you know about the user. Use them to personalize your response:\n"
+            for fact in user_profile:
+                system_text += f"- {fact['key']}: {fact['value']}\n"
+        return system_text
+
+    def _prefix(self, user_profile: List[Dict] = None) -> Tuple[str, _Prefix]:
+        """
+        Returns the profile version and the system-instruction prefix for it,
+        with as many profile facts as PROFILE_MAX_TOKENS allows.
+        """
+        facts = fit_profile(user_profile or [])
+        digest = hashlib.blake2b(self._persona_hash, digest_size=16)
+        for fact in facts:
+            digest.update(f"{fact['key']}\0{fact['value']}\0".encode("utf-8"))
+        version = digest.hexdigest()
+        prefix = LLM._prefixes.get(version)
+        if prefix is not None:
+            LLM._prefixes.move_to_end(version)
+            return version, prefix
+        prefix = _Prefix(self._system_text(facts))
+        LLM._prefixes[version] = prefix
+        while len(LLM._prefixes) > GEMINI_PREFIX_CACHE_SIZE:
+            LLM._prefixes.popitem(last=False)
+        return version, prefix
+
+    def prompt_tokens(self, user_text: str, user_profile: List[Dict] = None) -> int:
+        """Estimated size of the prompt without history, i.e. what the history budget must leave room for."""
+        return self._prefix(user_profile)[1].tokens + estimate_tokens(user_text) + MESSAGE_OVERHEAD_TOKENS
+
+    async def _build_request_body(self, user_text: str, conversation_history: List[Dict] = None,
+                                  user_profile: List[Dict] = None) -> Tuple[bytes, Optional[str]]:
+        """
+        Builds the serialized generateContent request body, personalized with user profile facts.
+
+        Returns:
+            The body, and the profile version if it refers to server-side cached content.
+        """
+        # The 'contents' field should only contain 'user' and 'model' roles.
+        contents = []
+        if conversation_history:
+            contents.extend(conversation_history)
+        contents.append({"role": "user", "parts": [{"text": user_text}]})
+        contents_json = json.dumps(contents).encode("utf-8")
+
+        version, prefix = self._prefix(user_profile)
+        if GEMINI_CONTEXT_CACHE:
+            name = await self._cached_content(version, prefix)
+            if name:
+                return b'{"cachedContent":' + json.dumps(name).encode("utf-8") + b',"contents":' + contents_json + b'}', version
+
+        # The system instruction is passed at the top level of the request body.
+        return b'{"system_instruction":' + prefix.json + b',"contents":' + contents_json + b'}', None
+
+    async def _cached_content(self, version: str, prefix: _Prefix) -> Optional[str]:
+        """Returns the cachedContents name for a prefix, registering it once per TTL."""
+        entry = LLM._cached_contents.get(version)
+        if entry is not None and entry[1] > time.monotonic():
+            LLM._cached_contents.move_to_end(version)
+            return entry[0]
+        # Concurrent turns for the same profile share one registration.
+        task = LLM._cache_tasks.get(version)
+        if task is None:
+            task = asyncio.ensure_future(self._create_cached_content(version, prefix))
+            LLM._cache_tasks[version] = task
+            task.add_done_callback(lambda _: LLM._cache_tasks.pop(version, None))
+        return await asyncio.shield(task)
+
+    async def _create_cached_content(self, version: str, prefix: _Prefix) -> Optional[str]:
+        body = (
+            b'{"model":' + json.dumps(f"models/{GEMINI_MODEL}").encode("utf-8")
+            + b',"systemInstruction":' + prefix.json
+            + b',"ttl":"' + str(GEMINI_CONTEXT_CACHE_TTL_S).encode("ascii") + b's"}'
+        )
+        name = None
+        try:
+            session = await self._get_session()
+            async with session.post(self.cache_url, data=body, headers=_JSON_HEADERS, timeout=self.request_timeout) as resp:
+                if resp.status == 200:
+                    name = (await resp.json()).get("name")
+                else:
+                    # E.g. a prefix below the minimum cacheable size. Remembered as
+                    # None so we don't retry it every turn until the TTL is up.
+                    print(f"⚠️  Gemini context cache refused the prompt prefix: {resp.status} - {await resp.text()}")
+        except Exception as e:
+            metrics.upstream_error("gemini")
+            print(f"❌ Error registering Gemini cached content: {e}")
+            return None
+        # Refresh a little before the server expires it.
+        LLM._cached_contents[version] = (name, time.monotonic() + GEMINI_CONTEXT_CACHE_TTL_S * 0.9)
+        while len(LLM._cached_contents) > GEMINI_PREFIX_CACHE_SIZE:
+            LLM._cached_contents.popitem(last=False)
+        return name
+
+    def _forget_cached_content(self, version: Optional[str]):
+        """Drops a cachedContents entry the API rejected, e.g. one that expired early."""
+        if version is not None:
+            LLM._cached_contents.pop(version, None)
+
     async def generate_response(self, user_text: str, conversation_history: List[Dict] = None, user_profile: List[Dict] = None) -> str:
         """
         Generates a response from the Gemini API, now personalized with user profile facts.
@@ -80,45 +254,88 @@ class LLM:
         if not user_text:
             return "I'm sorry, I didn't hear anything."
 
-        # The 'contents' field should only contain 'user' and 'model' roles.
-        contents = []
-        if conversation_history:
-            contents.extend(conversation_history)
-        contents.append({"role": "user", "parts": [{"text": user_text}]})
+        try:
+            body, cached_version = await self._build_request_body(user_text, conversation_history, user_profile)
+            session = await self._get_session()
+            async with session.post(self.api_url, data=body, headers=_JSON_HEADERS, timeout=self.request_timeout) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    # Safely access the response text
+                    return result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "I'm not sure how to respond to that.")
+                else:
+                    self._forget_cached_content(cached_version)
+                    error_text = await resp.text()
+                    metrics.upstream_error("gemini")
+                    print(f"❌ Gemini API Error: {resp.status} - {error_text}")
+                    return "I'm having trouble connecting to my brain right now."
+        except asyncio.TimeoutError:
+            metrics.upstream_error("gemini")
+            print(f"❌ Gemini API request timed out after {GEMINI_REQUEST_TIMEOUT_S}s.")
+            return "I'm having trouble connecting to my brain right now."
+        except aiohttp.ClientConnectorError as e:
+            metrics.upstream_error("gemini")
+            print(f"❌ Network Error: Could not connect to Gemini API. {e}")
+            return "It seems I can't connect to the internet. Please check your connection."
+        except Exception as e:
+            metrics.upstream_error("gemini")
+            print(f"❌ An unexpected error occurred in LLM: {e}")
+            return "I've run into an unexpected issue. Please try again."
 
-        # Create the system instruction, now with profile facts
-        system_text = self.system_instruction['parts'][0]['text']
+    async def stream_response(self, user_text: str, conversation_history: List[Dict] = None, user_profile: List[Dict] = None) -> AsyncIterator[str]:
+        """
+        Streams a response from the Gemini API using `streamGenerateContent`.
 
-        if user_profile:
-            system_text += "\n\nHere are some facts you know about the user. Use them to personalize your response:\n"
-            for fact in user_profile:
-                system_text += f"- {fact['key']}: {fact['value']}\n"
-        
-        system_instruction = {"parts": [{"text": system_text}]}
+        Takes the same arguments as `generate_response`, but yields text deltas
+        as soon as they arrive so callers can forward and speak the answer while
+        the rest of it is still being generated. Errors are yielded as the same
+        fallback messages `generate_response` returns.
+        """
+        if not user_text:
+            yield "I'm sorry, I didn't hear anything."
+            return
 
-        # The system instruction is passed at the top level of the request body.
-        body = {
-            "contents": contents,
-            "system_instruction": system_instruction
-        }
+        produced = False
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=body) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        # Safely access the response text
-                        return result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "I'm not sure how to respond to that.")
-                    else:
-                        error_text = await resp.text()
-                        print(f"❌ Gemini API Error: {resp.status} - {error_text}")
-                        return "I'm having trouble connecting to my brain right now."
+            body, cached_version = await self._build_request_body(user_text, conversation_history, user_profile)
+            session = await self._get_session()
+            async with session.post(self.stream_url, data=body, headers=_JSON_HEADERS, timeout=self.stream_timeout) as resp:
+                if resp.status != 200:
+                    self._forget_cached_content(cached_version)
+                    error_text = await resp.text()
+                    metrics.upstream_error("gemini")
+                    print(f"❌ Gemini API Error: {resp.status} - {error_text}")
+                    yield "I'm having trouble connecting to my brain right now."
+                    return
+
+                # Server-sent events: one `data: {...}` line per partial candidate.
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[len("data:"):])
+                    for part in chunk.get("candidates", [{}])[0].get("content", {}).get("parts", []):
+                        text = part.get("text")
+                        if text:
+                            produced = True
+                            yield text
+
+            if not produced:
+                yield "I'm not sure how to respond to that."
+        except asyncio.TimeoutError:
+            metrics.upstream_error("gemini")
+            print(f"❌ Gemini API stream stalled for more than {GEMINI_REQUEST_TIMEOUT_S}s.")
+            if not produced:
+                yield "I'm having trouble connecting to my brain right now."
         except aiohttp.ClientConnectorError as e:
+            metrics.upstream_error("gemini")
             print(f"❌ Network Error: Could not connect to Gemini API. {e}")
-            return "It seems I can't connect to the internet. Please check your connection."
+            yield "It seems I can't connect to the internet. Please check your connection."
         except Exception as e:
-            print(f"❌ An unexpected error occurred in LLM: {e}")
-            return "I've run into an unexpected issue. Please try again."
+            metrics.upstream_error("gemini")
+            print(f"❌ An unexpected error occurred in LLM stream: {e}")
+            if not produced:
+                yield "I've run into an unexpected issue. Please try again."
 
     async def extract_facts(self, text: str) -> List[Dict[str, str]]:
         """
@@ -151,20 +368,21 @@ class LLM:
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=body) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        response_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "[]")
-                        # Clean up the response to make it valid JSON
-                        response_text = response_text.strip().replace("```json", "").replace("```", "")
-                        import json
-                        # Add a final check to ensure we return a list
-                        facts = json.loads(response_text)
-                        return facts if isinstance(facts, list) else []
-                    else:
-                        return []
+            session = await self._get_session()
+            async with session.post(self.api_url, json=body, timeout=self.request_timeout) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    response_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "[]")
+                    # Clean up the response to make it valid JSON
+                    response_text = response_text.strip().replace("```json", "").replace("```", "")
+                    # Add a final check to ensure we return a list
+                    facts = json.loads(response_text)
+                    return facts if isinstance(facts, list) else []
+                else:
+                    metrics.upstream_error("gemini")
+                    return []
         except Exception as e:
+            metrics.upstream_error("gemini")
             print(f"❌ Error during fact extraction: {e}")
             return []
 
@@ -0,0 +1,251 @@
+"""
+Pluggable stores for semantic recall of past conversation messages.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import numpy as np
+from supabase import AsyncClient
+from src.db import get_supabase
+from src.config import (
+    MEMORY_STORE, LOCAL_MEMORY_DIR, LOCAL_MEMORY_DTYPE, LOCAL_MEMORY_MAX_OPEN_USERS, WEB_WORKERS, SESSION_REGISTRY
+)
+
+class MemoryStore:
+    """
+    Interface for semantic recall backends used by ConversationManager.
+    Search results use the `match_conversations` row shape:
+    {'content', 'role', 'created_at', 'similarity'}.
+    """
+    name = "base"
+
+    async def search(self, user_id: str, embedding: List[float], match_threshold: float,
+                     match_count: int) -> List[Dict]:
+        """Returns the user's messages most similar to `embedding`, best first."""
+        raise NotImplementedError
+
+    async def add(self, user_id: str, rows: List[Dict]):
+        """Indexes new conversation_history rows ('role', 'text', 'created_at', 'embedding')."""
+
+    async def needs_backfill(self, user_id: str) -> bool:
+        """True if the user hasn't been seeded from Supabase yet."""
+        return False
+
+    async def seed(self, user_id: str, rows: List[Dict]):
+        """
+        Indexes the user's existing history, skipping rows already indexed, and
+        only then marks the user as seeded.
+        """
+
+class SupabaseMemoryStore(MemoryStore):
+    """pgvector search through the `match_conversations` RPC. Rows are indexed by the insert itself."""
+    name = "supabase"
+
+    def __init__(self, client: AsyncClient):
+        self.client = client
+
+    async def search(self, user_id: str, embedding: List[float], match_threshold: float,
+                     match_count: int) -> List[Dict]:
+        response = await self.client.rpc(
+            'match_conversations',
+            {'p_session_id': user_id, 'query_embedding': embedding,
+             'match_threshold': match_threshold, 'match_count': match_count}
+        ).execute()
+        return response.data
+
+class _UserIndex:
+    """
+    One user's embeddings as a contiguous (capacity, dim) matrix in a memory-mapped
+    file, plus an append-only JSONL file with the matching message metadata.
+    Vectors are stored L2-normalized so cosine similarity is a dot product; with
+    the int8 dtype they are additionally quantized to [-127, 127]. An empty
+    marker file records that the user's earlier history has been seeded.
+    """
+    def __init__(self, path: str, dtype: str):
+        self.vectors_path = f"{path}.{dtype}.vec"
+        self.meta_path = f"{path}.jsonl"
+        self.seeded_path = f"{path}.seeded"
+        self.dtype = np.dtype(dtype)
+        # Reentrant: `seed` holds it across its own `add`.
+        self.lock = threading.RLock()
+        self.meta: List[Dict] = []
+        self.matrix: Optional[np.memmap] = None
+        self.dim = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta = [json.loads(line) for line in f if line.strip()]
+        if self.meta and os.path.exists(self.vectors_path):
+            self.dim = self.meta[0]['dim']
+            capacity = os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+            # A crash between the vector and metadata writes leaves extra vectors; ignore them.
+            self.meta = self.meta[:capacity]
+            self.matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def count(self) -> int:
+        return len(self.meta)
+
+    def _ensure_capacity(self, needed: int, dim: int):
+        """Maps the vector file with room for `needed` rows, growing it by doubling."""
+        row_bytes = dim * self.dtype.itemsize
+        current = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        self.dim = dim
+        if self.matrix is not None and self.matrix.shape[0] >= needed:
+            return
+        capacity = max(256, current)
+        while capacity < needed:
+            capacity *= 2
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        if capacity > current:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self.matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, dim))
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        if self.dtype == np.int8:
+            return np.round(vectors * 127).astype(np.int8)
+        return vectors.astype(self.dtype)
+
+    def add(self, rows: List[Dict]):
+        if not rows:
+            return
+        vectors = np.asarray([row['embedding'] for row in rows], dtype=np.float32)
+        with self.lock:
+            start = self.count
+            self._ensure_capacity(start + len(rows), vectors.shape[1])
+            self.matrix[start:start + len(rows)] = self._encode(vectors)
+            self.matrix.flush()
+            # Metadata is written last: it defines how many vectors are valid.
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    meta = {'role': row['role'], 'content': row['text'],
+                            'created_at': row['created_at'], 'dim': int(vectors.shape[1])}
+                    f.write(json.dumps(meta) + "\n")
+                    self.meta.append(meta)
+
+    def seed(self, rows: List[Dict]):
+        # Messages written since the user connected may already be indexed.
+        with self.lock:
+            indexed = {(meta['role'], meta['content'], _instant(meta['created_at'])) for meta in self.meta}
+            self.add([row for row in rows
+                      if (row['role'], row['text'], _instant(row['created_at'])) not in indexed])
+        # Written last: a failed seed is retried on the next connect.
+        open(self.seeded_path, "a", encoding="utf-8").close()
+
+    def search(self, embedding: List[float], match_threshold: float, match_count: int) -> List[Dict]:
+        with self.lock:
+            count = self.count
+            if not count or self.matrix is None:
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self.matrix[:count] @ query
+            if self.dtype == np.int8:
+                scores = scores / 127.0
+            k = min(match_count, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {'content': self.meta[i]['content'], 'role': self.meta[i]['role'],
+                 'created_at': self.meta[i]['created_at'], 'similarity': float(scores[i])}
+                for i in top if scores[i] > match_threshold
+            ]
+
+    def close(self):
+        with self.lock:
+            if self.matrix is not None:
+                self.matrix.flush()
+                self.matrix = None
+
+def _instant(created_at: str) -> str:
+    """A timestamp in one canonical form, so Postgres' and Python's ISO 8601 renderings compare equal."""
+    try:
+        return datetime.fromisoformat(created_at).astimezone(timezone.utc).isoformat()
+    except ValueError:
+        return created_at
+
+class LocalVectorStore(MemoryStore):
+    """
+    In-process cosine top-k search over per-user memory-mapped embedding matrices.
+    Retrieval cost grows with one user's history, not the whole table, and needs
+    no network hop. At most `max_open_users` indexes are kept open at once.
+
+    The index files have a single writer: this process. Several web workers
+    would overwrite each other's rows, and sessions resumed on another node
+    would find no index there, so those deployments need the Supabase store.
+    """
+    name = "local"
+
+    def __init__(self, directory: str = LOCAL_MEMORY_DIR, dtype: str = LOCAL_MEMORY_DTYPE,
+                 max_open_users: int = LOCAL_MEMORY_MAX_OPEN_USERS):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported local memory dtype: {dtype}")
+        self.directory = directory
+        self.dtype = dtype
+        self.max_open_users = max_open_users
+        self._indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._open_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(user_id.encode("utf-8")).hexdigest())
+
+    def _index(self, user_id: str) -> _UserIndex:
+        with self._open_lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+            index = _UserIndex(self._path(user_id), self.dtype)
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.max_open_users:
+                _, evicted = self._indexes.popitem(last=False)
+                evicted.close()
+            return index
+
+    async def search(self, user_id: str, embedding: List[float], match_threshold: float,
+                     match_count: int) -> List[Dict]:
+        return await asyncio.to_thread(
+            lambda: self._index(user_id).search(embedding, match_threshold, match_count)
+        )
+
+    async def add(self, user_id: str, rows: List[Dict]):
+        await asyncio.to_thread(lambda: self._index(user_id).add(rows))
+
+    async def needs_backfill(self, user_id: str) -> bool:
+        return not os.path.exists(f"{self._path(user_id)}.seeded")
+
+    async def seed(self, user_id: str, rows: List[Dict]):
+        await asyncio.to_thread(lambda: self._index(user_id).seed(rows))
+
+def create_memory_store(name: str = MEMORY_STORE) -> MemoryStore:
+    """Builds the memory store selected by `MEMORY_STORE`."""
+    if name == "local":
+        if WEB_WORKERS > 1 or SESSION_REGISTRY != "memory":
+            raise ValueError("MEMORY_STORE=local is only safe with one web worker on one node; "
+                             "use MEMORY_STORE=supabase with WEB_WORKERS > 1 or a shared session registry")
+        return LocalVectorStore()
+    if name == "supabase":
+        return SupabaseMemoryStore(get_supabase())
+    raise ValueError(f"Unknown memory store: {name}")
+
+_memory_store: Optional[MemoryStore] = None
+
+def get_memory_store() -> MemoryStore:
+    """
+    Returns the process-wide MemoryStore, creating it on first use. Sharing it
+    matters for the local store: one open index per user, one writer per file.
+    """
+    global _memory_store
+    if _memory_store is None:
+        _memory_store = create_memory_store()
+    return _memory_store
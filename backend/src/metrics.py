@@ -0,0 +1,71 @@
+"""
+Prometheus metrics for the voice pipeline: per-stage latency histograms,
+session and queue gauges, and upstream error counters.
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Voice turns span tens of milliseconds (context fetch) to tens of seconds (a long answer).
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "tara_stage_duration_seconds", "Time spent in each stage of a voice turn.",
+    ["stage"], buckets=_LATENCY_BUCKETS,
+)
+ACTIVE_SESSIONS = Gauge("tara_active_sessions", "Open voice WebSocket sessions.")
+QUEUE_DEPTH = Gauge("tara_queue_depth", "Items waiting in an internal queue.", ["queue"])
+UPSTREAM_ERRORS = Counter("tara_upstream_errors_total", "Failed calls to an upstream service.", ["upstream"])
+SPECULATIONS = Counter("tara_speculations_total", "Speculative LLM responses, by outcome (used, wasted).", ["outcome"])
+SLOW_CONSUMERS = Counter("tara_slow_consumer_total", "Broadcasts that found a full send queue, by policy.", ["policy"])
+DROPPED_WRITES = Counter("tara_dropped_writes_total", "Rows the write-behind buffer gave up on, by table.", ["table"])
+
+# Label lookups take a lock; hot paths reuse the bound children instead.
+_stages: Dict[str, Histogram] = {}
+_upstreams: Dict[str, Counter] = {}
+
+def observe(stage: str, seconds: float):
+    """Records one duration for `stage`."""
+    child = _stages.get(stage)
+    if child is None:
+        child = _stages[stage] = STAGE_SECONDS.labels(stage)
+    child.observe(seconds)
+
+@contextmanager
+def span(stage: str):
+    """Times the enclosed block as `stage`, including when it raises or is cancelled."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def upstream_error(upstream: str):
+    """Counts one failed call to `upstream` (gemini, stt, tts, supabase, embeddings)."""
+    child = _upstreams.get(upstream)
+    if child is None:
+        child = _upstreams[upstream] = UPSTREAM_ERRORS.labels(upstream)
+    child.inc()
+
+def speculation(outcome: str):
+    """Counts one speculative LLM response that was `used` or `wasted`."""
+    SPECULATIONS.labels(outcome).inc()
+
+def slow_consumer(policy: str):
+    """Counts one broadcast handled by the slow-consumer `policy` (drop, coalesce, disconnect)."""
+    SLOW_CONSUMERS.labels(policy).inc()
+
+def dropped_writes(table: str, count: int):
+    """Counts `count` rows for `table` that were dropped without being written."""
+    DROPPED_WRITES.labels(table).inc(count)
+
+def track_queue(name: str, depth: Callable[[], int]):
+    """Reports `depth()` as the depth of queue `name`, read only when metrics are scraped."""
+    QUEUE_DEPTH.labels(name).set_function(depth)
+
+def render() -> bytes:
+    """All metrics in the Prometheus text exposition format."""
+    return generate_latest()
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,45 @@
+"""
+Binary framing for audio streamed to the client over the WebSocket.
+
+Every binary message is one frame: a fixed header followed by the payload.
+    kind (1 byte) | utterance id (4 bytes) | sequence number (4 bytes) | payload
+All integers are big-endian. An utterance is one spoken AI response; its audio
+arrives as AUDIO frames in sequence order and is closed by an END_OF_UTTERANCE
+frame with an empty payload.
+
+Within an utterance, an END_OF_SENTENCE frame follows the audio of each
+sentence: the AUDIO frames since the previous boundary form a complete,
+independently playable file, so the client can start playing the first
+sentence while later ones are still being generated. Boundary frames carry the
+sequence number of the next AUDIO frame and don't consume one.
+"""
+import struct
+from typing import Tuple
+
+AUDIO_FRAME = 1
+END_OF_UTTERANCE = 2
+END_OF_SENTENCE = 3
+
+FRAME_HEADER = struct.Struct(">BII")
+
+def encode_audio_frame(utterance_id: int, seq: int, payload: bytes) -> bytes:
+    """Wraps a chunk of encoded audio in a frame header."""
+    return FRAME_HEADER.pack(AUDIO_FRAME, utterance_id, seq) + payload
+
+def encode_end_frame(utterance_id: int, seq: int) -> bytes:
+    """Builds the end-of-utterance marker sent after the last audio frame."""
+    return FRAME_HEADER.pack(END_OF_UTTERANCE, utterance_id, seq)
+
+def encode_sentence_end_frame(utterance_id: int, seq: int) -> bytes:
+    """Builds the marker sent after the last audio frame of each sentence."""
+    return FRAME_HEADER.pack(END_OF_SENTENCE, utterance_id, seq)
+
+def decode_frame(data: bytes) -> Tuple[int, int, int, bytes]:
+    """
+    Splits a frame into its header fields and payload.
+
+    Returns:
+        A (kind, utterance_id, seq, payload) tuple.
+    """
+    kind, utterance_id, seq = FRAME_HEADER.unpack_from(data)
+    return kind, utterance_id, seq, data[FRAME_HEADER.size:]
@@ -0,0 +1,54 @@
+"""
+Splits streamed LLM text into complete sentences so each can be spoken
+while the rest of the answer is still being generated.
+"""
+import re
+from typing import List, Optional
+
+# End of sentence: terminal punctuation (plus closing quotes/brackets) followed
+# by whitespace, or a line break.
+_SENTENCE_END = re.compile(r'[.!?…]+["\'”’)\]]*\s+|\n+')
+
+class SentenceChunker:
+    """
+    Accumulates text deltas and emits sentences as soon as they are complete.
+    Very short fragments (e.g. "Sure.") are merged into the next sentence so
+    TTS isn't called for a single word.
+    """
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """
+        Adds a text delta.
+
+        Returns:
+            The sentences completed by this delta, in order.
+        """
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            if len(candidate) < self.min_chars:
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """Returns whatever text remains once the stream has ended."""
+        tail = self._buffer.strip()
+        self._buffer = ""
+        return tail or None
+
+def split_sentences(text: str) -> List[str]:
+    """The sentences a complete text is spoken as, chunked exactly as a stream of it would be."""
+    chunker = SentenceChunker()
+    sentences = chunker.feed(text)
+    tail = chunker.flush()
+    if tail:
+        sentences.append(tail)
+    return sentences
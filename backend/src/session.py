@@ -0,0 +1,461 @@
+"""
+Full-duplex voice session: one per WebSocket connection.
+"""
+import asyncio
+import itertools
+import time
+from typing import AsyncIterator, Optional, Set, Union
+from fastapi import WebSocketDisconnect
+from src.stt import get_stt_backend, InterimTranscriber, normalize_transcript, INPUT_SAMPLE_WIDTH
+from src.llm import LLM
+from src.tts import TTS
+from src.tts_cache import get_tts_cache
+from src.conversation import ConversationManager
+from src.background import get_background_worker
+from src.sentences import SentenceChunker
+from src.vad import VADSegmenter
+from src.session_registry import SessionRegistry, get_session_registry
+from src.connections import Connection, SLOW_CONSUMER_CLOSE_CODE
+from src.protocol import encode_audio_frame, encode_end_frame, encode_sentence_end_frame
+from src.audio import AudioCodec
+from src import metrics
+from src.config import (
+    USE_SUPABASE, INPUT_SAMPLE_RATE, MIN_INTERRUPTION_DELAY_MS, MAX_CONTEXT_TOKENS,
+    STT_INTERIM, SPECULATION_STABLE_MS
+)
+
+class Turn:
+    """
+    One user utterance and all the work done to answer it (Gemini request,
+    TTS stream, sends). Its tasks are cancelled together on barge-in.
+    """
+    def __init__(self, turn_id: int):
+        self.id = turn_id
+        self._tasks: Set[asyncio.Task] = set()
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def done(self) -> bool:
+        return not self._tasks
+
+class Speculation:
+    """
+    A reply generated from a stable interim transcript while the user may
+    still be talking. Its deltas are buffered until the final transcript
+    either matches, and the turn replays them, or differs, and it is cancelled.
+    """
+    def __init__(self, text: str, deltas: AsyncIterator[str]):
+        self.text = text
+        self._key = normalize_transcript(text)
+        self._deltas: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._buffer(deltas))
+
+    def matches(self, text: str) -> bool:
+        return normalize_transcript(text) == self._key
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def replay(self) -> AsyncIterator[str]:
+        """The buffered deltas, then the rest as they arrive; re-raises what ended the stream early."""
+        while (delta := await self._deltas.get()) is not None:
+            if isinstance(delta, Exception):
+                raise delta
+            yield delta
+
+    async def _buffer(self, deltas: AsyncIterator[str]):
+        try:
+            async for delta in deltas:
+                self._deltas.put_nowait(delta)
+            self._deltas.put_nowait(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._deltas.put_nowait(e)
+
+class VoiceSession:
+    """
+    Runs a conversation over a WebSocket with separate receive and send tasks,
+    so the server keeps listening while it is talking.
+
+    Outbound messages go through the connection's bounded send queue, drained
+    by its writer task, and are tagged with the turn that produced them. When
+    new user speech lasts longer than MIN_INTERRUPTION_DELAY_MS, the current
+    turn is cancelled and its queued output dropped, freeing upstream
+    capacity immediately.
+
+    With stream ingest the utterance in progress is re-transcribed as it
+    grows and each new hypothesis is sent to the client. Once one has held for
+    SPECULATION_STABLE_MS, the reply to it starts generating; if the final
+    transcript matches, the turn uses that reply instead of starting its own.
+
+    After every turn the conversation context is saved to the session registry
+    under `session_id`, so a client that reconnects with that id, to any
+    worker, resumes where it left off without reloading from Supabase.
+
+    Audio in and out is converted by the connection's negotiated `codec`, so
+    the pipeline itself only ever sees 16 kHz PCM in and edge-tts MP3 out.
+    """
+    def __init__(self, connection: Connection, user_id: str, session_id: str, ingest: str = "clip",
+                 registry: Optional[SessionRegistry] = None, codec: Optional[AudioCodec] = None):
+        self.connection = connection
+        self.websocket = connection.websocket
+        self.user_id = user_id
+        self.session_id = session_id
+        self.registry = registry or get_session_registry()
+        # Server sessions only transcribe; they never open a local microphone.
+        self.stt = get_stt_backend()
+        self.llm = LLM()
+        self.tts = TTS(cache=get_tts_cache())
+        self.conversation = ConversationManager(user_id=user_id) if USE_SUPABASE else None
+        self.codec = codec or AudioCodec()
+        self.segmenter = VADSegmenter() if ingest == "stream" else None
+        self._decoder = self.codec.stream_decoder() if self.segmenter else None
+        self._speculation: Optional[Speculation] = None
+        self._loading: Optional[asyncio.Task] = None
+
+        self._turn_ids = itertools.count(1)
+        self._turn: Optional[Turn] = None
+        # Output tagged with a turn id below this belongs to an interrupted turn.
+        self._drop_before = 0
+        connection.skip = self._interrupted
+
+    async def run(self):
+        """Runs until the client disconnects; re-raises the error that ended the session."""
+        await self.send(f"🔗 Session: {self.session_id}")
+        await self.send(f"🎚️ Audio: {self.codec.describe()}")
+        if self.conversation:
+            # Loaded while the user is still speaking; the first turn's context waits for it.
+            self._loading = asyncio.create_task(self._load_context())
+            # Seeding semantic recall pages through the whole history; no turn waits
+            # for it, nor does session setup. Skipped when the worker is busy or
+            # stopping: the user stays unseeded and the next session tries again.
+            if not get_background_worker().try_submit(self.conversation.backfill_memory):
+                print(f"⚠️  Skipped memory backfill for {self.user_id}: background worker busy.")
+        receiver = asyncio.create_task(self._receive_loop())
+        writer = self.connection.writer
+        tasks = {receiver, writer}
+        if self._decoder:
+            tasks.add(asyncio.create_task(self._segment_loop()))
+            if STT_INTERIM:
+                tasks.add(asyncio.create_task(self._interim_loop()))
+        metrics.ACTIVE_SESSIONS.inc()
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+            if writer in done:
+                # Closed from our side, e.g. by the slow-consumer policy.
+                raise WebSocketDisconnect(SLOW_CONSUMER_CLOSE_CODE)
+        finally:
+            metrics.ACTIVE_SESSIONS.dec()
+            if self._turn:
+                self._turn.cancel()
+            if self._speculation:
+                self._speculation.cancel()
+            if self._loading:
+                tasks.add(self._loading)
+            tasks.discard(writer)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._decoder:
+                await self._decoder.close()
+
+    # --- Transport ---
+
+    async def send(self, payload: Union[str, bytes], turn_id: int = 0):
+        """Queues a message for the client. `turn_id` 0 marks session-level messages."""
+        await self.connection.send(payload, turn_id)
+
+    def _interrupted(self, tag: int) -> bool:
+        """True for queued output of a turn that has been interrupted."""
+        return 0 < tag < self._drop_before
+
+    async def _receive_loop(self):
+        while True:
+            data = await self.websocket.receive_bytes()
+            if self._decoder:
+                await self._decoder.feed(data)
+                continue
+            # Clip mode: every message is a complete utterance. While a turn is
+            # active, clips too short to be deliberate speech are ignored.
+            try:
+                pcm = await self.codec.decode_clip(data)
+            except ValueError as e:
+                print(f"❌ Error decoding {self.codec.input_format} audio from {self.user_id}: {e}")
+                await self.send(f"An error occurred: {str(e)}")
+                continue
+            duration_ms = len(pcm) * 1000 // (INPUT_SAMPLE_RATE * INPUT_SAMPLE_WIDTH)
+            if duration_ms >= MIN_INTERRUPTION_DELAY_MS or self._turn is None or self._turn.done():
+                self._start_turn(pcm)
+
+    async def _segment_loop(self):
+        """Stream mode: cuts decoded PCM into utterances with VAD as it arrives."""
+        async for pcm in self._decoder.chunks():
+            utterances = self.segmenter.feed(pcm)
+            if self.segmenter.in_speech and self.segmenter.speech_ms >= MIN_INTERRUPTION_DELAY_MS:
+                self._interrupt()
+            for utterance in utterances:
+                self._start_turn(utterance)
+
+    async def _interim_loop(self):
+        """Stream mode: sends interim transcripts and starts speculating on stable ones."""
+        transcriber = InterimTranscriber(self.stt)
+        while True:
+            await asyncio.sleep(transcriber.interval)
+            audio = None
+            if self.segmenter.speech_ms >= transcriber.min_speech_ms:
+                audio = self.segmenter.current_utterance()
+            if audio is None:
+                transcriber.reset()
+                continue
+            with metrics.span("stt_interim"):
+                changed = await transcriber.update(audio)
+            if changed:
+                # A long utterance is transcribed by its tail only.
+                prefix = "" if transcriber.complete else "…"
+                await self.send(f"📝 Hearing: {prefix}{transcriber.hypothesis}")
+                if self._speculation and not self._speculation.matches(transcriber.hypothesis):
+                    self._drop_speculation()
+            elif (transcriber.hypothesis and transcriber.complete and self._speculation is None
+                  and transcriber.stable_ms >= SPECULATION_STABLE_MS):
+                self._speculation = Speculation(transcriber.hypothesis, self._generate(transcriber.hypothesis))
+
+    def _drop_speculation(self):
+        self._speculation.cancel()
+        self._speculation = None
+        metrics.speculation("wasted")
+
+    def _claim_speculation(self, user_text: str) -> Optional[Speculation]:
+        """The speculative reply for `user_text`, if there is one; any other is discarded."""
+        if self._speculation is None:
+            return None
+        if not self._speculation.matches(user_text):
+            self._drop_speculation()
+            return None
+        speculation, self._speculation = self._speculation, None
+        metrics.speculation("used")
+        return speculation
+
+    # --- Turn handling ---
+
+    def _interrupt(self):
+        """Barge-in: cancels the current turn and drops anything it still has queued."""
+        if self._turn is None or self._turn.id < self._drop_before:
+            return
+        self._drop_before = self._turn.id + 1
+        if not self._turn.done():
+            self._turn.cancel()
+            print(f"✋ Turn {self._turn.id} of {self.user_id} interrupted.")
+        # Purge the interrupted output now so the notice isn't stuck behind it.
+        self.connection.purge(self._interrupted)
+        if not self.connection.try_send("🛑 Interrupted"):
+            asyncio.create_task(self.send("🛑 Interrupted"))
+
+    def _start_turn(self, audio_bytes: bytes):
+        self._interrupt()
+        turn = Turn(next(self._turn_ids))
+        self._turn = turn
+        turn.spawn(self._run_turn(turn, audio_bytes))
+
+    async def _run_turn(self, turn: Turn, audio_bytes: bytes):
+        started = time.perf_counter()
+        try:
+            await self._answer(turn, audio_bytes)
+            # Only turns that ran to completion; interrupted ones would skew it low.
+            metrics.observe("turn", time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            await self.send(f"An error occurred: {str(e)}", turn.id)
+
+    async def _answer(self, turn: Turn, audio_bytes: bytes):
+        with metrics.span("stt"):
+            user_text = await self.stt.transcribe(audio_bytes)
+
+        if not user_text:
+            await self.send("🤔 Sorry, I didn't catch that.", turn.id)
+            return
+
+        await self.send(f"🎤 You said: {user_text}", turn.id)
+
+        # 2. Get Conversation History & User Profile, unless a speculative reply
+        # to this transcript already did, and started the response too.
+        speculation = self._claim_speculation(user_text)
+        if speculation:
+            deltas = speculation.replay()
+        else:
+            with metrics.span("context"):
+                history, profile_facts = await self._context(user_text)
+            deltas = self.llm.stream_response(user_text, history, profile_facts)
+
+        # 3. Stream the AI Response and 4. speak it sentence by sentence
+        await self.send("🤖 Thinking...", turn.id)
+        sentences: asyncio.Queue = asyncio.Queue()
+        speaker = turn.spawn(self._speak_sentences(turn, sentences))
+        chunker = SentenceChunker()
+        response_parts = []
+        llm_started = time.perf_counter()
+        try:
+            async for delta in deltas:
+                if not response_parts:
+                    metrics.observe("llm_first_token", time.perf_counter() - llm_started)
+                response_parts.append(delta)
+                await self.send(f"💭 AI partial: {delta}", turn.id)
+                for sentence in chunker.feed(delta):
+                    sentences.put_nowait(sentence)
+            tail = chunker.flush()
+            if tail:
+                sentences.put_nowait(tail)
+            sentences.put_nowait(None)
+            metrics.observe("llm", time.perf_counter() - llm_started)
+
+            ai_response = "".join(response_parts).strip()
+            await self.send(f"💬 AI: {ai_response}", turn.id)
+            await speaker
+        finally:
+            if not speaker.done():
+                speaker.cancel()
+            if speculation:
+                speculation.cancel()
+
+        # 5. Update history and learn new facts in the background, so the next
+        # turn never waits on Supabase or Gemini. Shielded: a barge-in stops the
+        # answer, not the bookkeeping for what was already said.
+        if self.conversation:
+            await asyncio.shield(get_background_worker().submit(self._persist_turn, user_text, ai_response))
+
+    async def _context(self, user_text: str):
+        """
+        History and profile facts for the prompt. History gets whatever
+        MAX_CONTEXT_TOKENS leaves after the system instruction, profile and
+        utterance, so the prompt size stays fixed.
+        """
+        if not self.conversation:
+            return [], []
+        await asyncio.shield(self._loading)
+        profile_facts = await self.conversation.get_user_profile()
+        budget = MAX_CONTEXT_TOKENS - self.llm.prompt_tokens(user_text, profile_facts)
+        history = await self.conversation.get_context_for_llm(user_text, budget)
+        return history, profile_facts
+
+    async def _generate(self, user_text: str) -> AsyncIterator[str]:
+        """Context fetch and streamed reply in one, for speculation."""
+        history, profile_facts = await self._context(user_text)
+        async for delta in self.llm.stream_response(user_text, history, profile_facts):
+            yield delta
+
+    async def _speak_sentences(self, turn: Turn, sentences: asyncio.Queue):
+        """
+        Speaks sentences as the LLM stream produces them, so audio for the first
+        sentence starts while later ones are still being generated.
+        Each sentence is encoded in the negotiated output format as a file of
+        its own, framed and queued as soon as chunks are ready, and followed by
+        a sentence boundary so the client can play it right away. The utterance
+        is closed with an end marker once the queue yields `None`.
+        """
+        seq = 0
+        while (sentence := await sentences.get()) is not None:
+            first_seq = seq
+            try:
+                async for chunk in self._encoded(sentence):
+                    await self.send(encode_audio_frame(turn.id, seq, chunk), turn.id)
+                    seq += 1
+            except (OSError, ValueError) as e:
+                print(f"❌ Error encoding {self.codec.output_format} audio: {e}")
+            if seq > first_seq:
+                await self.send(encode_sentence_end_frame(turn.id, seq), turn.id)
+        await self.send(encode_end_frame(turn.id, seq), turn.id)
+        if seq == 0:
+            await self.send("️Could not generate audio response.", turn.id)
+
+    async def _encoded(self, sentence: str) -> AsyncIterator[bytes]:
+        """
+        One sentence in the negotiated output format. Re-encoded sentences are
+        kept in the TTS cache beside their MP3, so a cached sentence is sent
+        without starting ffmpeg.
+        """
+        cache, fmt = self.tts.cache, self.codec.output_format
+        if fmt == "mp3" or cache is None or not cache.cacheable(sentence):
+            async for chunk in self.codec.encode(self._synthesize(sentence)):
+                yield chunk
+            return
+        audio = await cache.get(self.tts.voice, sentence, fmt)
+        if audio is not None:
+            yield audio
+            return
+        chunks = []
+        async for chunk in self.codec.encode(self._synthesize(sentence)):
+            chunks.append(chunk)
+            yield chunk
+        # TTS caches the MP3 only once the whole sentence was synthesized, so
+        # an encoding of a failed or partial synthesis is never kept.
+        if chunks and cache.contains(self.tts.voice, sentence):
+            await cache.put(self.tts.voice, sentence, b"".join(chunks), fmt)
+
+    async def _synthesize(self, sentence: str) -> AsyncIterator[bytes]:
+        """edge-tts audio of one sentence."""
+        started = time.perf_counter()
+        first = True
+        try:
+            async for chunk in self.tts.stream(sentence):
+                if first:
+                    metrics.observe("tts_first_byte", time.perf_counter() - started)
+                    first = False
+                yield chunk
+            metrics.observe("tts", time.perf_counter() - started)
+        except Exception as e:
+            metrics.upstream_error("tts")
+            print(f"❌ Error in TTS stream: {e}")
+
+    async def _persist_turn(self, user_text: str, ai_response: str):
+        # Both sides of the turn go into the same bulk insert.
+        with metrics.span("persist"):
+            await self.conversation.add_messages([("user", user_text), ("model", ai_response)])
+
+        with metrics.span("fact_extraction"):
+            new_facts = await self.llm.extract_facts(f"User: {user_text}\nAI: {ai_response}")
+        if new_facts:
+            await self.conversation.update_user_profile(new_facts)
+        await self._save_state()
+
+    # --- Resumption ---
+
+    async def _load_context(self):
+        """The context saved under this session id, or else the user's context from Supabase."""
+        with metrics.span("session_load"):
+            if not await self._resume():
+                await self.conversation.load()
+
+    async def _resume(self) -> bool:
+        """Restores the context saved under this session id, if it belongs to this user."""
+        try:
+            state = await self.registry.load_state(self.session_id)
+        except Exception as e:
+            metrics.upstream_error("session_registry")
+            print(f"❌ Error loading state of session {self.session_id}: {e}")
+            return False
+        if not state or state.get('user_id') != self.user_id:
+            return False
+        self.conversation.restore(state['conversation'])
+        print(f"🔁 Resumed session {self.session_id} of {self.user_id}.")
+        return True
+
+    async def _save_state(self):
+        try:
+            await self.registry.save_state(
+                self.session_id, {'user_id': self.user_id, 'conversation': self.conversation.snapshot()})
+        except Exception as e:
+            metrics.upstream_error("session_registry")
+            print(f"❌ Error saving state of session {self.session_id}: {e}")
+
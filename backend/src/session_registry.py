@@ -0,0 +1,202 @@
+"""
+Pluggable registry of live voice sessions, shared by every worker that serves `/ws`.
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from src.config import SESSION_REGISTRY, REDIS_URL, SESSION_STATE_TTL_S
+
+# Identifies this worker process in the registry.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+BroadcastHandler = Callable[[str], Awaitable[None]]
+
+class SessionRegistry:
+    """
+    Interface for session registries used by the WebSocket endpoint.
+
+    A registry knows which worker holds each open session, keeps a snapshot of
+    each session's conversation state so a reconnect can resume it on any
+    worker, and fans broadcasts out to every worker. Each worker delivers a
+    broadcast to its own connections through the handler given to `start`.
+    """
+    name = "base"
+
+    async def start(self, on_broadcast: BroadcastHandler):
+        """Begins delivering broadcasts from any worker to `on_broadcast`."""
+
+    async def stop(self):
+        """Stops broadcast delivery and releases connections."""
+
+    async def register(self, session_id: str, user_id: str):
+        """Records that this worker now holds `session_id`."""
+        raise NotImplementedError
+
+    async def unregister(self, session_id: str):
+        """Forgets the open connection; the saved state outlives it until it expires."""
+        raise NotImplementedError
+
+    async def save_state(self, session_id: str, state: Dict):
+        """Stores a JSON-serializable snapshot of the session for later resumption."""
+        raise NotImplementedError
+
+    async def load_state(self, session_id: str) -> Optional[Dict]:
+        """The last snapshot saved for `session_id`, or None if there is none or it expired."""
+        raise NotImplementedError
+
+    async def owner(self, session_id: str) -> Optional[str]:
+        """
+        The user whose session `session_id` is, from its open connection on any
+        worker or else its saved state; None if the registry doesn't know it.
+        """
+        raise NotImplementedError
+
+    async def publish(self, message: str):
+        """Sends `message` to the broadcast handler of every worker, this one included."""
+        raise NotImplementedError
+
+class InMemorySessionRegistry(SessionRegistry):
+    """
+    Registry held in this process. Only correct with a single worker: other
+    workers neither see its sessions nor receive its broadcasts.
+    """
+    name = "memory"
+
+    def __init__(self, state_ttl_s: float = SESSION_STATE_TTL_S):
+        self.state_ttl_s = state_ttl_s
+        self.sessions: Dict[str, Dict] = {}
+        # session_id -> (expiry on the monotonic clock, snapshot)
+        self._states: Dict[str, tuple] = {}
+        self._on_broadcast: Optional[BroadcastHandler] = None
+
+    async def start(self, on_broadcast: BroadcastHandler):
+        self._on_broadcast = on_broadcast
+
+    async def stop(self):
+        self._on_broadcast = None
+
+    async def register(self, session_id: str, user_id: str):
+        self.sessions[session_id] = {"worker": WORKER_ID, "user_id": user_id}
+
+    async def unregister(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    async def save_state(self, session_id: str, state: Dict):
+        # Round-trip through JSON so callers see the same copy semantics as the networked store.
+        self._states[session_id] = (time.monotonic() + self.state_ttl_s, json.loads(json.dumps(state)))
+
+    async def load_state(self, session_id: str) -> Optional[Dict]:
+        entry = self._states.get(session_id)
+        if entry is None:
+            return None
+        expires, state = entry
+        if expires < time.monotonic():
+            del self._states[session_id]
+            return None
+        return state
+
+    async def owner(self, session_id: str) -> Optional[str]:
+        if session_id in self.sessions:
+            return self.sessions[session_id]["user_id"]
+        state = await self.load_state(session_id)
+        return state.get("user_id") if state else None
+
+    async def publish(self, message: str):
+        if self._on_broadcast is not None:
+            await self._on_broadcast(message)
+
+class RedisSessionRegistry(SessionRegistry):
+    """
+    Registry in Redis, shared by every worker on every node.
+
+    Open sessions are fields of one hash (session id -> worker and user),
+    snapshots are string keys with a TTL, and broadcasts go over a pub/sub
+    channel that each worker listens on. Any client with the `redis.asyncio`
+    interface works, e.g. `fakeredis.aioredis.FakeRedis` as a local stand-in.
+    """
+    name = "redis"
+
+    def __init__(self, client, prefix: str = "tara", state_ttl_s: float = SESSION_STATE_TTL_S):
+        self.client = client
+        self.state_ttl_s = state_ttl_s
+        self._sessions_key = f"{prefix}:sessions"
+        self._state_prefix = f"{prefix}:state:"
+        self._channel = f"{prefix}:broadcast"
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, on_broadcast: BroadcastHandler):
+        if self._listener is not None:
+            return
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self._channel)
+        self._listener = asyncio.create_task(self._listen(pubsub, on_broadcast))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        # Sessions of this worker are gone with it.
+        sessions = await self.client.hgetall(self._sessions_key)
+        mine = [session_id for session_id, entry in sessions.items() if json.loads(entry)["worker"] == WORKER_ID]
+        if mine:
+            await self.client.hdel(self._sessions_key, *mine)
+        await self.client.aclose()
+
+    async def _listen(self, pubsub, on_broadcast: BroadcastHandler):
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                data = message["data"]
+                try:
+                    await on_broadcast(data.decode() if isinstance(data, bytes) else data)
+                except Exception as e:
+                    print(f"❌ Error delivering a broadcast: {e}")
+        finally:
+            await pubsub.unsubscribe(self._channel)
+            await pubsub.aclose()
+
+    async def register(self, session_id: str, user_id: str):
+        await self.client.hset(self._sessions_key, session_id, json.dumps({"worker": WORKER_ID, "user_id": user_id}))
+
+    async def unregister(self, session_id: str):
+        await self.client.hdel(self._sessions_key, session_id)
+
+    async def save_state(self, session_id: str, state: Dict):
+        await self.client.set(self._state_prefix + session_id, json.dumps(state), ex=int(self.state_ttl_s))
+
+    async def load_state(self, session_id: str) -> Optional[Dict]:
+        data = await self.client.get(self._state_prefix + session_id)
+        return json.loads(data) if data else None
+
+    async def owner(self, session_id: str) -> Optional[str]:
+        entry = await self.client.hget(self._sessions_key, session_id)
+        if entry:
+            return json.loads(entry)["user_id"]
+        state = await self.load_state(session_id)
+        return state.get("user_id") if state else None
+
+    async def publish(self, message: str):
+        await self.client.publish(self._channel, message)
+
+def create_session_registry(name: str = SESSION_REGISTRY) -> SessionRegistry:
+    """Builds the session registry selected by `SESSION_REGISTRY`."""
+    if name == "memory":
+        return InMemorySessionRegistry()
+    if name == "redis":
+        import redis.asyncio as redis
+        return RedisSessionRegistry(redis.from_url(REDIS_URL, decode_responses=True))
+    raise ValueError(f"Unknown session registry: {name}")
+
+_session_registry: Optional[SessionRegistry] = None
+
+def get_session_registry() -> SessionRegistry:
+    """Returns the process-wide SessionRegistry, creating it on first use."""
+    global _session_registry
+    if _session_registry is None:
+        _session_registry = create_session_registry()
+    return _session_registry
@@ -1,26 +1,300 @@
 """
 Refactored Speech-to-Text (STT) module to use the simple and effective `speech_recognition` library.
+Server-side transcription goes through a pluggable backend: Google's web API, or a local
+CPU Whisper model preloaded in a pool of worker processes.
 """
+import asyncio
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
 import speech_recognition as sr
-from src.config import ENERGY_THRESHOLD, PAUSE_THRESHOLD
+from src.config import (
+    ENERGY_THRESHOLD, PAUSE_THRESHOLD, INPUT_SAMPLE_RATE, WHISPER_MODEL, WHISPER_COMPUTE_TYPE,
+    STT_BACKEND, STT_WORKERS, STT_QUEUE_SIZE, STT_INTERIM_INTERVAL_MS, STT_INTERIM_MIN_SPEECH_MS,
+    STT_INTERIM_WINDOW_MS, STT_INTERIM_CONCURRENCY
+)
+from src import metrics
+
+# Bytes per sample of the 16-bit PCM the WebSocket clients send.
+INPUT_SAMPLE_WIDTH = 2
+
+class STTBackend:
+    """
+    Interface for speech-to-text engines used by the WebSocket API.
+    One backend instance is shared by every session in the process.
+
+    Interim transcriptions of utterances still in progress have a budget of
+    their own, `interim_concurrency` at a time across all sessions, so they
+    never take capacity that complete utterances need.
+    """
+    name = "base"
+
+    def __init__(self, interim_concurrency: int = STT_INTERIM_CONCURRENCY):
+        self._interim_slots = asyncio.Semaphore(max(1, interim_concurrency))
+
+    async def start(self):
+        """Loads models or opens connections. Called once from the app lifespan."""
+
+    async def stop(self):
+        """Releases anything acquired in `start`."""
+
+    async def transcribe(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                         sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        """
+        Transcribes a complete utterance of raw PCM audio.
+
+        Returns:
+            The transcribed text, or None if nothing could be recognized.
+        """
+        raise NotImplementedError
+
+    async def transcribe_interim(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                                 sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        """
+        Best-effort transcription of an utterance in progress.
+
+        Returns:
+            The transcribed text, or None if nothing was recognized or the
+            interim budget is used up; the caller simply tries again later.
+        """
+        if self._interim_slots.locked():
+            return None
+        async with self._interim_slots:
+            return await self.transcribe(audio_data, sample_rate, sample_width)
+
+class GoogleSTTBackend(STTBackend):
+    """
+    Google's free web API via `speech_recognition`. The blocking HTTP call runs in
+    a worker thread so it never stalls the event loop.
+    """
+    name = "google"
+
+    def __init__(self):
+        super().__init__()
+        self.recognizer = sr.Recognizer()
+
+    async def transcribe(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                         sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        audio = sr.AudioData(audio_data, sample_rate, sample_width)
+        try:
+            return await asyncio.to_thread(self.recognizer.recognize_google, audio)
+        except sr.UnknownValueError:
+            print("🤔 Sorry, I didn't catch that.")
+            return None
+        except sr.RequestError as e:
+            metrics.upstream_error("stt")
+            print(f"📡 Could not request results from Google Speech Recognition service; {e}")
+            return None
+        except Exception as e:
+            metrics.upstream_error("stt")
+            print(f"An unexpected error occurred in Google STT: {e}")
+            return None
+
+# --- Whisper worker process state ---
+# Each worker process loads the model once in its initializer and keeps it here.
+_whisper_model = None
+
+def _whisper_worker_init(model_name: str, compute_type: str):
+    global _whisper_model
+    from faster_whisper import WhisperModel
+    _whisper_model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=1)
+
+def _whisper_transcribe(audio_data: bytes, sample_rate: int, sample_width: int) -> str:
+    """Runs in a worker process: converts PCM to float32 at 16 kHz and decodes it."""
+    if sample_width != 2:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    samples = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+    if sample_rate != 16000 and samples.size:
+        target_length = int(samples.size * 16000 / sample_rate)
+        samples = np.interp(
+            np.linspace(0, samples.size - 1, target_length), np.arange(samples.size), samples
+        ).astype(np.float32)
+    segments, _ = _whisper_model.transcribe(samples, beam_size=1, vad_filter=True)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+class WhisperSTTBackend(STTBackend):
+    """
+    Local CPU Whisper (faster-whisper) preloaded in a pool of worker processes,
+    so transcription throughput scales with cores. At most `queue_size` jobs may
+    wait for a free worker; beyond that new jobs are rejected instead of piling up.
+    Interim jobs only run on a worker that is idle right now and never take one
+    of those slots, so a busy pool sheds interims, not utterances.
+    """
+    name = "whisper"
+
+    def __init__(self, model_name: str = WHISPER_MODEL, workers: int = STT_WORKERS,
+                 queue_size: int = STT_QUEUE_SIZE, compute_type: str = WHISPER_COMPUTE_TYPE):
+        super().__init__()
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.compute_type = compute_type
+        self._slots = asyncio.Semaphore(self.workers + queue_size)
+        self._running = 0  # Jobs, final or interim, submitted to the pool and not finished
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if self._executor is None:
+                await self._start_workers()
+
+    async def _start_workers(self):
+        print(f"🧠 Starting {self.workers} Whisper '{self.model_name}' worker(s)...")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_whisper_worker_init,
+            initargs=(self.model_name, self.compute_type),
+        )
+        # One warmup job per worker forces every process to spawn and load the model now.
+        loop = asyncio.get_running_loop()
+        silence = bytes(INPUT_SAMPLE_RATE * INPUT_SAMPLE_WIDTH // 2)
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _whisper_transcribe, silence, INPUT_SAMPLE_RATE, INPUT_SAMPLE_WIDTH)
+            for _ in range(self.workers)
+        ])
+        print("✅ Whisper workers ready.")
+
+    async def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def transcribe(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                         sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        if self._executor is None:
+            await self.start()
+        if self._slots.locked():
+            print("⚠️  STT queue is full, dropping utterance.")
+            return None
+        async with self._slots:
+            return await self._run(audio_data, sample_rate, sample_width)
+
+    async def transcribe_interim(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                                 sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        if self._executor is None or self._running >= self.workers or self._interim_slots.locked():
+            return None
+        async with self._interim_slots:
+            return await self._run(audio_data, sample_rate, sample_width)
+
+    async def _run(self, audio_data: bytes, sample_rate: int, sample_width: int) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        self._running += 1
+        try:
+            transcript = await loop.run_in_executor(
+                self._executor, _whisper_transcribe, audio_data, sample_rate, sample_width
+            )
+        except Exception as e:
+            metrics.upstream_error("stt")
+            print(f"An unexpected error occurred in Whisper STT: {e}")
+            return None
+        finally:
+            self._running -= 1
+        return transcript or None
+
+def create_stt_backend(name: str = STT_BACKEND) -> STTBackend:
+    """Builds the STT backend selected by `STT_BACKEND`."""
+    if name == "whisper":
+        return WhisperSTTBackend()
+    if name == "google":
+        return GoogleSTTBackend()
+    raise ValueError(f"Unknown STT backend: {name}")
+
+_stt_backend: Optional[STTBackend] = None
+
+def get_stt_backend() -> STTBackend:
+    """Returns the process-wide STT backend, creating it on first use."""
+    global _stt_backend
+    if _stt_backend is None:
+        _stt_backend = create_stt_backend()
+    return _stt_backend
+
+def normalize_transcript(text: str) -> str:
+    """Lowercased words without punctuation, for comparing hypotheses of the same speech."""
+    return " ".join(re.findall(r"[\w']+", text.lower()))
+
+class InterimTranscriber:
+    """
+    Interim hypotheses for an utterance still in progress. Each `update`
+    transcribes the utterance so far, at most its last `window_ms`, within the
+    backend's interim budget, and reports whether the hypothesis changed.
+    `complete` says whether the hypothesis covers the whole utterance, and
+    `stable_ms` how long it has held, as confirmed by later transcriptions.
+    """
+    def __init__(self, backend: Optional[STTBackend] = None, interval_ms: int = STT_INTERIM_INTERVAL_MS,
+                 min_speech_ms: int = STT_INTERIM_MIN_SPEECH_MS, window_ms: int = STT_INTERIM_WINDOW_MS):
+        self.backend = backend or get_stt_backend()
+        self.interval = interval_ms / 1000
+        self.min_speech_ms = min_speech_ms
+        self.window_bytes = INPUT_SAMPLE_RATE * window_ms // 1000 * INPUT_SAMPLE_WIDTH
+        self.hypothesis: Optional[str] = None
+        self.complete = False
+        self._normalized = ""
+        self._since = 0.0
+        self._confirmed = 0.0
+
+    @property
+    def stable_ms(self) -> float:
+        """How long the current hypothesis has been confirmed unchanged, in milliseconds."""
+        return (self._confirmed - self._since) * 1000 if self.hypothesis else 0.0
+
+    def reset(self):
+        self.hypothesis = None
+        self.complete = False
+        self._normalized = ""
+
+    async def update(self, audio: bytes) -> bool:
+        """
+        Transcribes the utterance so far. Each call costs at most one window of
+        audio, however long the utterance has grown.
+
+        Returns:
+            True if it produced a new hypothesis.
+        """
+        complete = len(audio) <= self.window_bytes
+        if not complete:
+            audio = audio[-self.window_bytes:]
+        text = await self.backend.transcribe_interim(audio)
+        normalized = normalize_transcript(text or "")
+        if not normalized:
+            return False
+        now = time.perf_counter()
+        if normalized == self._normalized and complete == self.complete:
+            self._confirmed = now
+            return False
+        self.hypothesis, self._normalized, self.complete = text, normalized, complete
+        self._since = self._confirmed = now
+        return True
 
 class STT:
     """
     Handles Speech-to-Text conversion using Google's free web API via the
     `speech_recognition` library. It automatically handles silence detection.
+    Audio received over the network is transcribed by the pluggable `backend`.
+
+    Construction does no device I/O, so it is safe on a headless server; the
+    local microphone is opened and calibrated on the first `listen_and_transcribe`.
     """
-    def __init__(self):
+    def __init__(self, backend: Optional[STTBackend] = None):
+        self.backend = backend or get_stt_backend()
         self.recognizer = sr.Recognizer()
         self.recognizer.energy_threshold = ENERGY_THRESHOLD
         self.recognizer.pause_threshold = PAUSE_THRESHOLD
         self.recognizer.non_speaking_duration = PAUSE_THRESHOLD
-        self.microphone = sr.Microphone()
+        self.microphone: Optional[sr.Microphone] = None
 
-        # Calibrate for ambient noise upon initialization
-        print("🎙️  Calibrating microphone for ambient noise... Please be quiet for a moment.")
-        with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source)
-        print("✅ Microphone calibrated.")
+    def _open_microphone(self) -> sr.Microphone:
+        if self.microphone is None:
+            self.microphone = sr.Microphone()
+            # Calibrate for ambient noise on first use
+            print("🎙️  Calibrating microphone for ambient noise... Please be quiet for a moment.")
+            with self.microphone as source:
+                self.recognizer.adjust_for_ambient_noise(source)
+            print("✅ Microphone calibrated.")
+        return self.microphone
 
     def listen_and_transcribe(self) -> str:
         """
@@ -31,7 +305,7 @@ class STT:
             The transcribed text as a string, or None if speech could not be recognized.
         """
         try:
-            with self.microphone as source:
+            with self._open_microphone() as source:
                 print("\n👂 Listening for your command...")
                 audio = self.recognizer.listen(source)
             
@@ -54,23 +328,35 @@ class STT:
             print(f"An unexpected error occurred in STT: {e}")
             return None
 
+    async def transcribe(self, audio_data: bytes, sample_rate: int = INPUT_SAMPLE_RATE,
+                         sample_width: int = INPUT_SAMPLE_WIDTH) -> Optional[str]:
+        """
+        Transcribes a complete utterance of raw PCM audio with the STT backend
+        without blocking the event loop.
+
+        Returns:
+            The transcribed text, or None.
+        """
+        print(f"🧠 Transcribing audio stream ({self.backend.name})...")
+        transcript = await self.backend.transcribe(audio_data, sample_rate, sample_width)
+        if transcript:
+            print(f"🎤 You said: {transcript}")
+        return transcript
+
     def transcribe_audio_stream(self, audio_data) -> str:
         """
         Transcribes a chunk of audio data.
 
         Args:
-            audio_data: The audio data in bytes.
+            audio_data: 16-bit mono PCM at INPUT_SAMPLE_RATE, the format the
+                WebSocket API decodes every client's audio to.
 
         Returns:
             The transcribed text, or None.
         """
         try:
             print("🧠 Transcribing audio stream...")
-            # We need to convert the raw bytes to an AudioData object
-            # This requires the sample rate and width, which the client must provide.
-            # For this example, let's assume a standard format.
-            # You'll likely need to get this from the client-side audio recorder.
-            audio = sr.AudioData(audio_data, self.microphone.SAMPLE_RATE, self.microphone.SAMPLE_WIDTH)
+            audio = sr.AudioData(audio_data, INPUT_SAMPLE_RATE, INPUT_SAMPLE_WIDTH)
             transcript = self.recognizer.recognize_google(audio)
             print(f"🎤 You said: {transcript}")
             return transcript
@@ -0,0 +1,25 @@
+"""
+JWT access tokens issued by `/token` and accepted by the HTTP and WebSocket endpoints.
+Kept apart from `api.py` so tools (e.g. the load generator) can mint tokens
+without importing the app.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from jose import jwt
+import src.config  # noqa: F401  (loads .env before the secret is read)
+
+SECRET_KEY = os.environ.get("SUPABASE_JWT_SECRET")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Token creation
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, secret_key: Optional[str] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, secret_key or SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
@@ -1,19 +1,54 @@
 """
 Refactored Text-to-Speech (TTS) module using edge-tts for a fast and high-quality voice.
-This version uses an external `ffplay` process and streams audio for ultra-low latency.
+Audio can either be streamed to the caller chunk by chunk (server mode, used by the
+WebSocket API) or played locally through an external `ffplay` process.
 """
 import asyncio
 import edge_tts
+from typing import AsyncIterator, Optional
 from src.config import EDGE_TTS_VOICE
+from src.tts_cache import TTSCache
 
 class TTS:
     """
     Handles Text-to-Speech synthesis using Microsoft Edge's TTS engine.
-    Audio is streamed directly to an external `ffplay` process to ensure stability
-    and begin playback almost instantaneously.
+    `stream` yields MP3 chunks as edge-tts produces them, without touching a
+    subprocess or temp file; `speak` plays the same stream locally via `ffplay`.
+    Short phrases are served from, and stored in, an optional TTSCache.
     """
-    def __init__(self, voice: str = EDGE_TTS_VOICE):
+    def __init__(self, voice: str = EDGE_TTS_VOICE, cache: Optional[TTSCache] = None):
         self.voice = voice
+        self.cache = cache
+
+    async def stream(self, text: str) -> AsyncIterator[bytes]:
+        """
+        Synthesizes text and yields the encoded audio chunks as they arrive.
+
+        Args:
+            text: The text to be spoken.
+        """
+        if not text:
+            return
+
+        cacheable = self.cache is not None and self.cache.cacheable(text)
+        if cacheable:
+            audio = await self.cache.get(self.voice, text)
+            if audio is not None:
+                yield audio
+                return
+
+        chunks = []
+        communicate = edge_tts.Communicate(text, self.voice)
+        async for chunk in communicate.stream():
+            if chunk["type"] != "audio" or not chunk["data"]:
+                continue
+            if cacheable:
+                chunks.append(chunk["data"])
+            yield chunk["data"]
+
+        # Only reached when the whole phrase was synthesized and consumed.
+        if cacheable and chunks:
+            await self.cache.put(self.voice, text, b"".join(chunks))
 
     async def speak(self, text: str):
         """
@@ -40,24 +75,24 @@ class TTS:
             )
 
             # Stream audio from edge-tts directly to the ffplay process
-            communicate = edge_tts.Communicate(text, self.voice)
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio" and process.stdin:
-                    try:
-                        process.stdin.write(chunk["data"])
-                        await process.stdin.drain()
-                    except (BrokenPipeError, ConnectionResetError):
-                        # This can happen if ffplay closes unexpectedly
-                        print("⚠️  TTS stream pipe broke. Playback may have been interrupted.")
-                        break
+            async for data in self.stream(text):
+                if not process.stdin:
+                    break
+                try:
+                    process.stdin.write(data)
+                    await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    # This can happen if ffplay closes unexpectedly
+                    print("⚠️  TTS stream pipe broke. Playback may have been interrupted.")
+                    break
 
             # Close stdin to signal that we're done sending audio
             if process.stdin:
                 process.stdin.close()
-            
+
             # Wait for the ffplay process to finish
             await process.wait()
-                
+
         except FileNotFoundError:
             print("❌ Error: `ffplay` not found. Please install ffmpeg.")
             print("   On macOS, run: brew install ffmpeg")
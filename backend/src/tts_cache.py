@@ -0,0 +1,220 @@
+"""
+Two-tier cache for synthesized speech, shared by every TTS instance in the process.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+from src.sentences import split_sentences
+from src.config import (
+    TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_BYTES, TTS_CACHE_MAX_TEXT_CHARS
+)
+
+def normalize_text(text: str) -> str:
+    """Normalizes text so trivially different spellings of a phrase share an entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+# Audio formats the cache stores, as file extensions: edge-tts MP3 and the Ogg
+# Opus it is re-encoded into for clients that negotiate "opus".
+FORMATS = ("mp3", "opus")
+
+class TTSCache:
+    """
+    Caches synthesized audio keyed by (voice, normalized text, format).
+
+    The memory tier is an LRU bounded by total bytes and is checked without
+    leaving the event loop. The disk tier survives restarts and is bounded by
+    total file size, evicting the least recently used files first.
+    """
+    def __init__(self, memory_budget: int = TTS_CACHE_MEMORY_BYTES,
+                 directory: Optional[str] = TTS_CACHE_DIR,
+                 disk_budget: int = TTS_CACHE_DISK_BYTES,
+                 max_text_chars: int = TTS_CACHE_MAX_TEXT_CHARS):
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.disk_budget = disk_budget
+        self.max_text_chars = max_text_chars
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # Disk index: key -> file size, in least-recently-used order.
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def open(self):
+        """Builds the disk index from files left by a previous run."""
+        if not self.directory:
+            return
+        await asyncio.to_thread(self._load_disk_index)
+        print(f"✅ TTS cache ready ({len(self._disk)} phrases on disk).")
+
+    def _load_disk_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.rpartition(".")[2] not in FORMATS:
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        self._disk.clear()
+        self._disk_bytes = 0
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        _remove_files(self._evict_disk())
+
+    def cacheable(self, text: str) -> bool:
+        return bool(text) and len(text) <= self.max_text_chars
+
+    @staticmethod
+    def make_key(voice: str, text: str, fmt: str = "mp3") -> str:
+        """The entry's file name: a hash of voice and text with the format as extension."""
+        digest = hashlib.sha256(f"{voice}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+        return f"{digest}.{fmt}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def contains(self, voice: str, text: str, fmt: str = "mp3") -> bool:
+        """Whether either tier holds the phrase, without reading it or counting a hit."""
+        key = self.make_key(voice, text, fmt)
+        return key in self._memory or key in self._disk
+
+    def get_from_memory(self, voice: str, text: str, fmt: str = "mp3") -> Optional[bytes]:
+        """Looks up the memory tier only. Never blocks."""
+        key = self.make_key(voice, text, fmt)
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+        return audio
+
+    async def get(self, voice: str, text: str, fmt: str = "mp3") -> Optional[bytes]:
+        """
+        Looks up a phrase in memory, then on disk (promoting disk hits to memory).
+
+        Returns:
+            The cached audio, or None on a miss.
+        """
+        if not self.cacheable(text):
+            return None
+        audio = self.get_from_memory(voice, text, fmt)
+        if audio is not None:
+            return audio
+
+        key = self.make_key(voice, text, fmt)
+        if self.directory and key in self._disk:
+            try:
+                audio = await asyncio.to_thread(self._read_file, key)
+            except OSError:
+                self._forget_disk(key)
+                audio = None
+            if audio is not None:
+                self._disk.move_to_end(key)
+                self._remember(key, audio)
+                self.hits += 1
+                return audio
+
+        self.misses += 1
+        return None
+
+    async def put(self, voice: str, text: str, audio: bytes, fmt: str = "mp3"):
+        """Stores a fully synthesized (or fully re-encoded) phrase in both tiers."""
+        if not audio or not self.cacheable(text):
+            return
+        key = self.make_key(voice, text, fmt)
+        self._remember(key, audio)
+        if self.directory and key not in self._disk:
+            try:
+                await asyncio.to_thread(self._write_file, key, audio)
+            except OSError as e:
+                print(f"⚠️  Could not write TTS cache entry: {e}")
+                return
+            # Re-checked after the write: a concurrent put of the same phrase may
+            # have indexed the file meanwhile, and its size must count only once.
+            self._disk_bytes += len(audio) - self._disk.get(key, 0)
+            self._disk[key] = len(audio)
+            victims = self._evict_disk()
+            if victims:
+                await asyncio.to_thread(_remove_files, victims)
+
+    async def prewarm(self, tts, phrases: Iterable[str]):
+        """
+        Synthesizes any sentence of `phrases` that isn't cached yet. Replies
+        reach TTS one sentence at a time, so sentences are what get looked up.
+        """
+        warmed = 0
+        sentences = dict.fromkeys(sentence for phrase in phrases for sentence in split_sentences(phrase))
+        for sentence in sentences:
+            if await self.get(tts.voice, sentence) is not None:
+                continue
+            try:
+                # TTS.stream stores the sentence in this cache once it completes.
+                async for _ in tts.stream(sentence):
+                    pass
+                warmed += 1
+            except Exception as e:
+                print(f"⚠️  Could not pre-warm TTS phrase '{sentence}': {e}")
+        print(f"✅ TTS cache pre-warmed ({warmed} new phrases).")
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.memory_budget:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_file(self, key: str) -> bytes:
+        path = self._path(key)
+        with open(path, "rb") as f:
+            audio = f.read()
+        # mtime doubles as the last-use time when the index is rebuilt.
+        os.utime(path)
+        return audio
+
+    def _write_file(self, key: str, audio: bytes):
+        path = self._path(key)
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        with open(partial, "wb") as f:
+            f.write(audio)
+        os.replace(partial, path)
+
+    def _forget_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self) -> List[str]:
+        """Drops least recently used entries over budget and returns their paths."""
+        victims = []
+        while self._disk_bytes > self.disk_budget and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            victims.append(self._path(key))
+        return victims
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+_tts_cache: Optional[TTSCache] = None
+
+def get_tts_cache() -> TTSCache:
+    """Returns the process-wide TTSCache, creating it on first use."""
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = TTSCache()
+    return _tts_cache
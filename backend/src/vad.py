@@ -0,0 +1,138 @@
+"""
+Server-side streaming voice activity detection (VAD) and utterance endpointing.
+"""
+from typing import List, Optional
+import webrtcvad
+from src.config import (
+    INPUT_SAMPLE_RATE, VAD_AGGRESSIVENESS, VAD_FRAME_MS, VAD_SILENCE_TIMEOUT_MS,
+    VAD_PRE_ROLL_MS, VAD_MIN_SPEECH_MS, VAD_MAX_UTTERANCE_MS
+)
+
+# 16-bit mono PCM
+SAMPLE_WIDTH = 2
+
+class VADSegmenter:
+    """
+    Cuts a continuous stream of 16-bit mono PCM into utterances.
+
+    Incoming bytes are split into fixed-size frames, each classified by
+    webrtcvad, and written into a ring buffer preallocated for the longest
+    allowed utterance. An utterance starts at the first speech frame (plus a
+    short pre-roll so soft onsets aren't clipped) and is cut once trailing
+    silence reaches the silence timeout, so only speech is sent to STT.
+    """
+    def __init__(self, sample_rate: int = INPUT_SAMPLE_RATE,
+                 aggressiveness: int = VAD_AGGRESSIVENESS,
+                 frame_ms: int = VAD_FRAME_MS,
+                 silence_timeout_ms: int = VAD_SILENCE_TIMEOUT_MS,
+                 pre_roll_ms: int = VAD_PRE_ROLL_MS,
+                 min_speech_ms: int = VAD_MIN_SPEECH_MS,
+                 max_utterance_ms: int = VAD_MAX_UTTERANCE_MS):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.silence_frames = max(1, silence_timeout_ms // frame_ms)
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_frames = max_utterance_ms // frame_ms
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+        # Ring buffer holding the current utterance plus pre-roll, in whole frames.
+        self._capacity = (self.max_frames + self.pre_roll_frames) * self.frame_bytes
+        self._ring = bytearray(self._capacity)
+        self._frames_written = 0  # total frames ever written to the ring
+        self._partial = bytearray()  # bytes that don't make a whole frame yet
+
+        self._triggered = False
+        self._start_frame = 0  # ring frame index where the current utterance begins
+        self._speech_frames = 0
+        self._trailing_silence = 0
+
+    @property
+    def in_speech(self) -> bool:
+        """True while an utterance is being collected."""
+        return self._triggered
+
+    @property
+    def speech_ms(self) -> int:
+        """Milliseconds of voiced audio in the current utterance so far."""
+        return self._speech_frames * self.frame_ms
+
+    def current_utterance(self) -> Optional[bytes]:
+        """A copy of the utterance collected so far (pre-roll included), or None outside speech."""
+        if not self._triggered:
+            return None
+        return self._read_frames(self._start_frame, self._frames_written)
+
+    def reset(self):
+        self._partial.clear()
+        self._triggered = False
+        self._speech_frames = 0
+        self._trailing_silence = 0
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """
+        Adds a chunk of PCM audio of any length.
+
+        Returns:
+            The utterances completed by this chunk, as contiguous PCM bytes.
+        """
+        utterances = []
+        self._partial.extend(pcm)
+        usable = len(self._partial) - len(self._partial) % self.frame_bytes
+        view = memoryview(self._partial)
+        try:
+            for offset in range(0, usable, self.frame_bytes):
+                utterance = self._process_frame(view[offset:offset + self.frame_bytes])
+                if utterance is not None:
+                    utterances.append(utterance)
+        finally:
+            view.release()
+        del self._partial[:usable]
+        return utterances
+
+    def _process_frame(self, frame: memoryview):
+        index = self._frames_written
+        self._write_frame(frame)
+        is_speech = self.vad.is_speech(frame.tobytes(), self.sample_rate)
+
+        if not self._triggered:
+            if is_speech:
+                self._triggered = True
+                self._start_frame = max(0, index - self.pre_roll_frames)
+                self._speech_frames = 1
+                self._trailing_silence = 0
+            return None
+
+        if is_speech:
+            self._speech_frames += 1
+            self._trailing_silence = 0
+        else:
+            self._trailing_silence += 1
+
+        length = index + 1 - self._start_frame
+        if self._trailing_silence < self.silence_frames and length < self.max_frames:
+            return None
+
+        # End of utterance: drop the trailing silence (the timeout itself).
+        end_frame = index + 1 - self._trailing_silence
+        enough_speech = self._speech_frames >= self.min_speech_frames
+        utterance = self._read_frames(self._start_frame, end_frame) if enough_speech else None
+        self._triggered = False
+        self._speech_frames = 0
+        self._trailing_silence = 0
+        return utterance
+
+    def _write_frame(self, frame: memoryview):
+        offset = (self._frames_written * self.frame_bytes) % self._capacity
+        self._ring[offset:offset + self.frame_bytes] = frame
+        self._frames_written += 1
+
+    def _read_frames(self, start_frame: int, end_frame: int) -> bytes:
+        """Copies frames [start_frame, end_frame) out of the ring as one contiguous block."""
+        start = (start_frame * self.frame_bytes) % self._capacity
+        length = (end_frame - start_frame) * self.frame_bytes
+        if start + length <= self._capacity:
+            return bytes(self._ring[start:start + length])
+        head = self._capacity - start
+        return bytes(self._ring[start:]) + bytes(self._ring[:length - head])
@@ -0,0 +1,57 @@
+"""
+Model warmup that runs after the server starts, and the readiness it reports.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+class Warmup:
+    """
+    Loads models in the background so the process starts serving at once.
+    Each component runs concurrently; `ready` turns true when all of them
+    have finished. A component that fails is reported and keeps the process
+    unready, since sessions would otherwise pay for loading it on first use.
+    """
+    def __init__(self):
+        self._started: Optional[float] = None
+        self._finished: Dict[str, float] = {}
+        self._failed: Dict[str, str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._started is not None and len(self._finished) == len(self._tasks)
+
+    def start(self, components: Dict[str, Callable[[], Awaitable[None]]]):
+        """Starts warming each component; `components` maps names to their start coroutines."""
+        self._started = time.perf_counter()
+        for name, start in components.items():
+            self._tasks[name] = asyncio.create_task(self._run(name, start))
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def status(self) -> Dict:
+        """Readiness, and the seconds each component took to warm up."""
+        pending = [name for name in self._tasks if name not in self._finished and name not in self._failed]
+        return {
+            "ready": self.ready,
+            "warmed": {name: round(seconds, 3) for name, seconds in self._finished.items()},
+            "pending": pending,
+            "failed": self._failed,
+        }
+
+    async def _run(self, name: str, start: Callable[[], Awaitable[None]]):
+        try:
+            await start()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed[name] = str(e)
+            print(f"❌ Warming up {name} failed: {e}")
+            return
+        self._finished[name] = time.perf_counter() - self._started
+        if self.ready:
+            print(f"✅ Warmup done in {time.perf_counter() - self._started:.1f}s.")
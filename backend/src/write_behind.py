@@ -0,0 +1,181 @@
+"""
+Batched write-behind buffer for conversation history and profile facts.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from supabase import AsyncClient
+from src.db import get_supabase
+from src.config import (
+    WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_ATTEMPTS, WRITE_BEHIND_MAX_PENDING,
+)
+from src import metrics
+
+class WriteBehindBuffer:
+    """
+    Collects conversation rows and profile facts from every session in the
+    process and writes them in bulk: one multi-row insert for messages and one
+    set-based RPC for facts per chunk of at most `batch_size` rows. A flush
+    happens when `batch_size` rows are pending or `flush_ms` after the first
+    pending write, whichever is first.
+
+    A chunk that fails is retried on later flushes and dropped after
+    `max_attempts` failures, so one rejected row cannot hold up the rest. While
+    Supabase is failing at most `max_pending` rows are kept for retry; older
+    ones are dropped first. Dropped rows are counted in
+    tara_dropped_writes_total. `stop` performs a final flush.
+    """
+    def __init__(self, client: AsyncClient, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_ms: int = WRITE_BEHIND_FLUSH_MS, max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._messages: List[Dict] = []
+        # Message chunks that failed before, oldest first, with their failed attempts.
+        self._retry: List[Tuple[int, List[Dict]]] = []
+        # (user_id, key) -> value; a later fact for the same key replaces the earlier one.
+        self._facts: Dict[Tuple[str, str], str] = {}
+        self._fact_attempts: Dict[Tuple[str, str], int] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Rows and facts waiting to be written."""
+        return len(self._messages) + sum(len(chunk) for _, chunk in self._retry) + len(self._facts)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop and writes everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self.depth:
+            print(f"⚠️  Write-behind buffer stopped with {self.depth} unwritten row(s).")
+
+    def add_messages(self, rows: List[Dict]):
+        """Queues conversation_history rows for the next bulk insert."""
+        self._messages.extend(rows)
+        self._wakeup.set()
+
+    def upsert_facts(self, user_id: str, facts: List[Dict[str, str]]):
+        """Queues profile facts for the next set-based upsert."""
+        for fact in facts:
+            self._facts[(user_id, fact['key'])] = str(fact['value'])
+        self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """
+        Writes pending rows and facts now, in chunks of at most `batch_size`.
+
+        Once a chunk fails the rest are left for the next flush rather than
+        sent to an upstream that is likely down.
+
+        Returns:
+            False if any write failed (its rows stay pending for a retry).
+        """
+        async with self._flush_lock:
+            started = time.perf_counter()
+            wrote = bool(self._messages or self._retry or self._facts)
+            ok = await self._flush_messages()
+            ok = await self._flush_facts() and ok
+            if wrote:
+                metrics.observe("db_flush", time.perf_counter() - started)
+        return ok
+
+    async def _flush_messages(self) -> bool:
+        messages, self._messages = self._messages, []
+        chunks, self._retry = self._retry, []
+        chunks += [(0, messages[i:i + self.batch_size]) for i in range(0, len(messages), self.batch_size)]
+        for index, (attempts, chunk) in enumerate(chunks):
+            try:
+                await self.client.table('conversation_history').insert(chunk).execute()
+            except Exception as e:
+                metrics.upstream_error("supabase")
+                print(f"❌ Error writing {len(chunk)} message(s) to Supabase: {e}")
+                if attempts + 1 >= self.max_attempts:
+                    self._drop('conversation_history', len(chunk), "after repeated failures")
+                else:
+                    self._retry.append((attempts + 1, chunk))
+                self._retry += chunks[index + 1:]
+                self._trim_retry()
+                return False
+        return True
+
+    async def _flush_facts(self) -> bool:
+        facts, self._facts = self._facts, {}
+        items = list(facts.items())
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            payload = [{'user_id': user_id, 'key': key, 'value': value} for (user_id, key), value in chunk]
+            try:
+                await self.client.rpc('upsert_user_profile_batch', {'p_facts': payload}).execute()
+            except Exception as e:
+                metrics.upstream_error("supabase")
+                print(f"❌ Error upserting {len(chunk)} profile fact(s) in Supabase: {e}")
+                retry = {}
+                for fact_key, value in chunk:
+                    attempts = self._fact_attempts.get(fact_key, 0) + 1
+                    if attempts >= self.max_attempts:
+                        self._fact_attempts.pop(fact_key, None)
+                    else:
+                        self._fact_attempts[fact_key] = attempts
+                        retry[fact_key] = value
+                if len(retry) < len(chunk):
+                    self._drop('user_profile', len(chunk) - len(retry), "after repeated failures")
+                # Keep any newer value written for the same key while we were flushing.
+                self._facts = {**retry, **dict(items[start + self.batch_size:]), **self._facts}
+                return False
+            for fact_key, _ in chunk:
+                self._fact_attempts.pop(fact_key, None)
+        return True
+
+    def _trim_retry(self):
+        """Drops the oldest failed message chunks beyond `max_pending` rows."""
+        pending = sum(len(chunk) for _, chunk in self._retry)
+        while self._retry and pending > self.max_pending:
+            _, chunk = self._retry.pop(0)
+            pending -= len(chunk)
+            self._drop('conversation_history', len(chunk), "to stay under the retry limit")
+
+    def _drop(self, table: str, count: int, reason: str):
+        metrics.dropped_writes(table, count)
+        print(f"⚠️  Dropped {count} {table} row(s) {reason}.")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give other sessions a moment to add rows unless the batch is already full.
+            if len(self._messages) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wait_for_full_batch(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if not await self.flush():
+                # Back off before retrying the rows that were put back.
+                await asyncio.sleep(self.flush_interval)
+                self._wakeup.set()
+
+    async def _wait_for_full_batch(self):
+        while len(self._messages) < self.batch_size:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+_write_behind: Optional[WriteBehindBuffer] = None
+
+def get_write_behind() -> WriteBehindBuffer:
+    """Returns the process-wide WriteBehindBuffer on the shared Supabase client, creating it on first use."""
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehindBuffer(get_supabase())
+    return _write_behind
@@ -36,7 +36,9 @@ create table public.conversation_history (
 -- 4. Create the RPC function for vector similarity search
 --    This function is called by the application to find relevant
 --    past messages based on the current user input.
+--    Only the given session's history is searched.
 create or replace function public.match_conversations (
+  p_session_id text,
   query_embedding vector(384),
   match_threshold float,
   match_count int
@@ -57,15 +59,18 @@ as $$
     ch.created_at,
     1 - (ch.embedding <=> query_embedding) as similarity
   from public.conversation_history as ch
-  where 1 - (ch.embedding <=> query_embedding) > match_threshold
-  order by similarity desc
+  where ch.session_id = p_session_id
+    and 1 - (ch.embedding <=> query_embedding) > match_threshold
+  order by ch.embedding <=> query_embedding
   limit match_count;
 $$;
 
--- 5. Create a vector index for performance
---    As your conversation history grows, this index will make the
---    similarity search much faster.
-create index if not exists conversation_history_embedding_idx on public.conversation_history using ivfflat (embedding vector_l2_ops) with (lists = 100);
+-- 5. Create indexes for performance
+--    The vector index uses cosine ops to match the `<=>` operator in
+--    match_conversations; an L2 index would never be used by that query.
+--    The session index serves per-user history reads and the session filter.
+create index if not exists conversation_history_embedding_idx on public.conversation_history using ivfflat (embedding vector_cosine_ops) with (lists = 100);
+create index if not exists conversation_history_session_created_idx on public.conversation_history (session_id, created_at desc);
 
 -- 6. Create User Profile Table for long-term memory
 create table if not exists public.user_profile (
@@ -87,4 +92,18 @@ begin
   on conflict (user_id, key) do update
   set value = p_value;
 end;
-$$ language plpgsql; 
\ No newline at end of file
+$$ language plpgsql; 
+
+-- 8. Create RPC function to upsert many user profile facts at once
+-- Takes a JSON array of {"user_id", "key", "value"} objects, possibly for
+-- several users, and writes them in one set-based statement.
+create or replace function public.upsert_user_profile_batch(p_facts jsonb)
+returns void as $$
+begin
+  insert into public.user_profile(user_id, key, value)
+  select f->>'user_id', f->>'key', f->>'value'
+  from jsonb_array_elements(p_facts) as f
+  on conflict (user_id, key) do update
+  set value = excluded.value;
+end;
+$$ language plpgsql;
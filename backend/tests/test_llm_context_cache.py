@@ -0,0 +1,76 @@
+"""
+The LLM client against the local Gemini stand-in, with and without
+GEMINI_CONTEXT_CACHE.
+"""
+import asyncio
+from collections import OrderedDict
+import pytest
+from bench.fakes import FakeGemini, Latency, start_fake
+from src import llm as llm_module
+from src.llm import LLM
+
+PROFILE = [{'key': 'name', 'value': 'Ada'}]
+
+@pytest.fixture(autouse=True)
+def fresh_llm_state(monkeypatch):
+    """Prefix and cached-content registries are class-wide; each test starts empty."""
+    monkeypatch.setattr(LLM, "_prefixes", OrderedDict())
+    monkeypatch.setattr(LLM, "_cached_contents", OrderedDict())
+    monkeypatch.setattr(LLM, "_cache_tasks", {})
+    monkeypatch.setattr(LLM, "_session", None)
+
+def _run(fake: FakeGemini, monkeypatch, context_cache: bool, turns: int = 3):
+    """Streams `turns` replies for one profile through `fake`; returns the replies."""
+    async def main():
+        runner, port = await start_fake(fake.app())
+        monkeypatch.setattr(llm_module, "GEMINI_API_BASE", f"http://127.0.0.1:{port}/v1beta")
+        monkeypatch.setattr(llm_module, "GEMINI_CONTEXT_CACHE", context_cache)
+        try:
+            client = LLM(api_key="test")
+            replies = []
+            for i in range(turns):
+                deltas = [delta async for delta in client.stream_response(f"question {i}", [], PROFILE)]
+                replies.append("".join(deltas))
+            return replies
+        finally:
+            await LLM.close_session()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+def _fake(**kwargs) -> FakeGemini:
+    return FakeGemini(Latency(0), Latency(0), **kwargs)
+
+def test_without_context_cache_every_request_carries_the_system_instruction(monkeypatch):
+    fake = _fake()
+    replies = _run(fake, monkeypatch, context_cache=False)
+    assert all(reply.startswith("Sure thing") for reply in replies)
+    assert fake.stats["cache_creates"] == 0
+    assert fake.stats["cached_requests"] == 0
+    for body in fake.bodies:
+        assert "cachedContent" not in body
+        assert "- name: Ada" in body["system_instruction"]["parts"][0]["text"]
+
+def test_context_cache_registers_the_prefix_once_and_references_it(monkeypatch):
+    fake = _fake()
+    replies = _run(fake, monkeypatch, context_cache=True)
+    assert all(reply.startswith("Sure thing") for reply in replies)
+    assert fake.stats["cache_creates"] == 1
+    assert fake.stats["cached_requests"] == 3
+    (name, entry), = fake.cached.items()
+    assert "- name: Ada" in entry["body"]["systemInstruction"]["parts"][0]["text"]
+    for i, body in enumerate(fake.bodies):
+        assert body["cachedContent"] == name
+        assert "system_instruction" not in body
+        assert body["contents"][-1] == {"role": "user", "parts": [{"text": f"question {i}"}]}
+
+def test_refused_cache_falls_back_to_the_inline_prefix(monkeypatch):
+    fake = _fake(min_cache_chars=10 ** 6)
+    replies = _run(fake, monkeypatch, context_cache=True)
+    assert all(reply.startswith("Sure thing") for reply in replies)
+    # Refused once, then remembered until the TTL is up rather than retried every turn.
+    assert fake.stats["cache_refusals"] == 1
+    assert fake.stats["cache_creates"] == 0
+    assert fake.stats["cached_requests"] == 0
+    for body in fake.bodies:
+        assert "cachedContent" not in body
+        assert "- name: Ada" in body["system_instruction"]["parts"][0]["text"]
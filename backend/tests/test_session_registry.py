@@ -0,0 +1,142 @@
+"""
+RedisSessionRegistry against fakeredis: two registries on one fake server
+stand in for two workers sharing a Redis.
+"""
+import asyncio
+import json
+import fakeredis
+import pytest
+from fakeredis import aioredis
+from src import connections as connections_module
+from src.connections import Connection, ConnectionManager
+from src.session_registry import RedisSessionRegistry, WORKER_ID
+
+def _client(server: fakeredis.FakeServer):
+    return aioredis.FakeRedis(server=server, decode_responses=True)
+
+def _registries(count: int = 2, server: fakeredis.FakeServer = None, **kwargs):
+    server = server or fakeredis.FakeServer()
+    return [RedisSessionRegistry(_client(server), **kwargs) for _ in range(count)]
+
+def test_state_round_trips_between_workers():
+    async def main():
+        first, second = _registries()
+        state = {'user_id': 'u1', 'conversation': {'recent': [{'role': 'user', 'text': 'hi'}], 'profile': None}}
+        await first.save_state('s1', state)
+        assert await second.load_state('s1') == state
+        assert await second.load_state('missing') is None
+        assert await second.owner('s1') == 'u1'
+    asyncio.run(main())
+
+def test_state_expires_after_ttl():
+    async def main():
+        registry, = _registries(1, state_ttl_s=1)
+        await registry.save_state('s1', {'user_id': 'u1'})
+        assert 0 < await registry.client.ttl('tara:state:s1') <= 1
+        await asyncio.sleep(1.2)
+        assert await registry.load_state('s1') is None
+        assert await registry.owner('s1') is None
+    asyncio.run(main())
+
+def test_open_session_names_its_owner():
+    async def main():
+        first, second = _registries()
+        await first.register('s1', 'u1')
+        assert await second.owner('s1') == 'u1'
+        await first.unregister('s1')
+        assert await second.owner('s1') is None
+    asyncio.run(main())
+
+class _RecordingSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+def test_broadcast_is_delivered_on_every_worker():
+    async def main():
+        first, second = _registries()
+        published = []
+
+        async def on_first(message):
+            published.append(message)
+
+        # The second worker delivers broadcasts to its connections, as the app does.
+        manager = ConnectionManager()
+        socket = _RecordingSocket()
+        connection = Connection('s2', 'u2', socket)
+        connection.start()
+        manager.connections[connection.id] = connection
+
+        await first.start(on_first)
+        await second.start(manager.deliver)
+        # Subscriptions are set up by the listener tasks; give them a moment.
+        await asyncio.sleep(0.05)
+        await first.publish("📣 hello")
+        for _ in range(100):
+            if published and socket.sent:
+                break
+            await asyncio.sleep(0.01)
+        assert published == ["📣 hello"]
+        assert socket.sent == ["📣 hello"]
+        await connection.close()
+        await first.stop()
+        await second.stop()
+    asyncio.run(main())
+
+def test_stop_removes_only_this_workers_sessions():
+    async def main():
+        server = fakeredis.FakeServer()
+        registry, = _registries(1, server)
+
+        async def ignore(message):
+            pass
+
+        await registry.start(ignore)
+        await registry.register('mine', 'u1')
+        other = json.dumps({'worker': f"{WORKER_ID}-elsewhere", 'user_id': 'u2'})
+        await registry.client.hset('tara:sessions', 'theirs', other)
+        await registry.stop()
+        assert await _client(server).hgetall('tara:sessions') == {'theirs': other}
+    asyncio.run(main())
+
+class _FailingRegistry:
+    async def register(self, session_id, user_id):
+        raise ConnectionError("registry down")
+
+    async def unregister(self, session_id):
+        raise ConnectionError("registry down")
+
+def test_failed_registration_leaves_no_connection_behind(monkeypatch):
+    monkeypatch.setattr(connections_module, "get_session_registry", _FailingRegistry)
+
+    async def main():
+        manager = ConnectionManager()
+        socket = _RecordingSocket()
+        with pytest.raises(ConnectionError):
+            await manager.connect(socket, 's1', 'u1')
+        assert manager.connections == {}
+        assert manager.for_user('u1') == []
+        assert socket.close_code == 1011
+    asyncio.run(main())
+
+def test_disconnect_survives_a_failing_registry(monkeypatch):
+    async def main():
+        manager = ConnectionManager()
+        connection = Connection('s1', 'u1', _RecordingSocket())
+        connection.start()
+        manager.connections[connection.id] = connection
+        manager._by_user['u1'] = {connection.id}
+        monkeypatch.setattr(connections_module, "get_session_registry", _FailingRegistry)
+        await manager.disconnect(connection)
+        assert manager.connections == {}
+        assert connection.writer.done()
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+WriteBehindBuffer against a stand-in Supabase client that can be told to
+reject inserts.
+"""
+import asyncio
+from src.write_behind import WriteBehindBuffer
+
+class _Query:
+    def __init__(self, client, rows):
+        self.client = client
+        self.rows = rows
+
+    async def execute(self):
+        self.client.calls.append(len(self.rows))
+        if self.client.failing or any(row.get('bad') for row in self.rows):
+            raise RuntimeError("rejected")
+        self.client.written.extend(self.rows)
+
+class _Table:
+    def __init__(self, client):
+        self.client = client
+
+    def insert(self, rows):
+        return _Query(self.client, rows)
+
+class _FakeSupabase:
+    def __init__(self):
+        self.failing = False
+        self.calls = []
+        self.written = []
+        self.facts = []
+
+    def table(self, name):
+        return _Table(self)
+
+    def rpc(self, name, params):
+        self.facts.extend(params['p_facts'])
+        return _Query(self, [])
+
+def _rows(count, start=0, **extra):
+    return [{'content': f"m{start + i}", **extra} for i in range(count)]
+
+def test_messages_are_written_in_chunks_of_batch_size():
+    async def main():
+        client = _FakeSupabase()
+        buffer = WriteBehindBuffer(client, batch_size=3)
+        buffer.add_messages(_rows(7))
+        assert await buffer.flush()
+        assert client.calls == [3, 3, 1]
+        assert [row['content'] for row in client.written] == [f"m{i}" for i in range(7)]
+        assert buffer.depth == 0
+    asyncio.run(main())
+
+def test_a_rejected_chunk_is_dropped_after_max_attempts_without_blocking_the_rest():
+    async def main():
+        client = _FakeSupabase()
+        buffer = WriteBehindBuffer(client, batch_size=2, max_attempts=2)
+        buffer.add_messages(_rows(2, bad=True))
+        assert not await buffer.flush()
+        buffer.add_messages(_rows(2, start=2))
+        # The bad chunk fails a second time and is dropped; the chunk after it is retried next.
+        assert not await buffer.flush()
+        assert buffer.depth == 2
+        assert await buffer.flush()
+        assert [row['content'] for row in client.written] == ["m2", "m3"]
+        assert buffer.depth == 0
+    asyncio.run(main())
+
+def test_an_outage_stops_at_the_first_failed_chunk_and_bounds_the_retry_backlog():
+    async def main():
+        client = _FakeSupabase()
+        client.failing = True
+        buffer = WriteBehindBuffer(client, batch_size=2, max_attempts=100, max_pending=4)
+        buffer.add_messages(_rows(6))
+        assert not await buffer.flush()
+        assert client.calls == [2]
+        # The oldest chunk goes first once more than max_pending rows are waiting.
+        assert buffer.depth == 4
+        client.failing = False
+        assert await buffer.flush()
+        assert [row['content'] for row in client.written] == ["m2", "m3", "m4", "m5"]
+    asyncio.run(main())
@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { authService, createWebSocketConnection } from '../lib/api';
-import { startRecording, stopRecording, playAudio, stopAudioPlayback } from '../lib/audio';
+import { startRecording, startStreaming, stopRecording, playAudio, stopAudioPlayback, decodeAudioFrame, END_OF_SENTENCE, END_OF_UTTERANCE, PLAYBACK_MIME_TYPE } from '../lib/audio';
 import { Button } from "@/components/ui/button";
 import { Card } from "@/components/ui/card";
 import { Input } from "@/components/ui/input";
@@ -36,20 +36,34 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
   const [textInput, setTextInput] = useState('');
   const [isMuted, setIsMuted] = useState(false);
   const [isConnected, setIsConnected] = useState(false);
-  const [audioQueue, setAudioQueue] = useState<Blob[]>([]);
+  // Hands-free: the microphone is streamed and the server detects when the user stops talking.
+  const [handsFree, setHandsFree] = useState(false);
+  // Live text: what the server hears so far, and the reply as it is generated.
+  const [interim, setInterim] = useState<string | null>(null);
+  const [partialReply, setPartialReply] = useState('');
   
   const wsRef = useRef<WebSocket | null>(null);
   const mediaRecorderRef = useRef<MediaRecorder | null>(null);
   const streamRef = useRef<MediaStream | null>(null);
   const audioRef = useRef<HTMLAudioElement | null>(null);
   const messagesEndRef = useRef<HTMLDivElement | null>(null);
+  // Audio chunks of the sentence currently being streamed, keyed by utterance id
+  const pendingAudioRef = useRef<Map<number, Uint8Array[]>>(new Map());
+  // Sentences received but not played yet, and whether one is playing. Refs, not
+  // state: they are read from the WebSocket handlers and audio callbacks.
+  const audioQueueRef = useRef<Blob[]>([]);
+  const playingRef = useRef(false);
+  const isMutedRef = useRef(false);
+  // Id the server gave this conversation; sent again on reconnect to resume it.
+  const sessionIdRef = useRef<string | null>(null);
+  const handsFreeRef = useRef(false);
   
   const navigate = useNavigate();
 
   // Auto-scroll to bottom of messages
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [messages]);
+  }, [messages, interim, partialReply]);
 
   // Check authentication on load
   useEffect(() => {
@@ -69,13 +83,6 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
     };
   }, []);
 
-  // Process audio queue
-  useEffect(() => {
-    if (audioQueue.length > 0 && !isMuted && agentStatus !== 'speaking') {
-      playNextAudio();
-    }
-  }, [audioQueue, isMuted, agentStatus]);
-
   const connectWebSocket = () => {
     setAgentStatus('connecting');
     
@@ -86,7 +93,8 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
         return;
       }
       
-      const ws = createWebSocketConnection(token);
+      const ws = createWebSocketConnection(token, sessionIdRef.current, handsFreeRef.current ? 'stream' : 'clip');
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -97,8 +105,8 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
 
       ws.onmessage = (event) => {
         // Check if the message is binary (audio)
-        if (event.data instanceof Blob) {
-          handleAudioMessage(event.data);
+        if (event.data instanceof ArrayBuffer) {
+          handleAudioFrame(event.data);
           return;
         }
 
@@ -107,11 +115,26 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
           const data = event.data;
           console.log('Received text:', data);
           
-          if (data.startsWith('🎤 You said:')) {
-            // This is a transcription confirmation, we already added the user message
-            // We could update the placeholder message here if needed
+          if (data.startsWith('🔗 Session:')) {
+            sessionIdRef.current = data.substring('🔗 Session:'.length).trim();
             return;
+          } else if (data.startsWith('📝 Hearing:')) {
+            // Interim transcript of the utterance still being spoken (stream ingest)
+            setInterim(data.substring('📝 Hearing:'.length).trim());
+          } else if (data.startsWith('🎤 You said:')) {
+            // The final transcript replaces the placeholder added when a clip was
+            // sent; in hands-free mode there is none, so it becomes a new message.
+            const content = data.substring('🎤 You said:'.length).trim();
+            setInterim(null);
+            setMessages(prev => {
+              const last = prev[prev.length - 1];
+              if (last && last.type === 'user' && last.content === '...') {
+                return [...prev.slice(0, -1), { ...last, content }];
+              }
+              return [...prev, { id: Date.now().toString(), type: 'user', content, timestamp: new Date() }];
+            });
           } else if (data.startsWith('🤔 Sorry, I didn\'t catch that.')) {
+            setInterim(null);
             setAgentStatus('idle');
             setMessages(prev => [...prev, {
               id: Date.now().toString(),
@@ -119,10 +142,18 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
               content: "Sorry, I didn't catch that. Could you try again?",
               timestamp: new Date()
             }]);
+          } else if (data.startsWith('🛑 Interrupted')) {
+            // The server cancelled its answer because we started speaking
+            clearAudio();
+            setPartialReply('');
           } else if (data.startsWith('🤖 Thinking...')) {
             setAgentStatus('thinking');
+          } else if (data.startsWith('💭 AI partial:')) {
+            // Deltas carry their own spacing, so only the prefix's space is removed
+            setPartialReply(prev => prev + data.substring('💭 AI partial: '.length));
           } else if (data.startsWith('💬 AI:')) {
             const content = data.substring(5).trim();
+            setPartialReply('');
             const newMessage = {
               id: Date.now().toString(),
               type: 'agent' as const,
@@ -142,6 +173,8 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
 
       ws.onclose = () => {
         console.log('WebSocket disconnected');
+        // Replaced by a new connection, e.g. after switching hands-free mode
+        if (wsRef.current !== ws) return;
         setIsConnected(false);
         setAgentStatus('idle');
       };
@@ -156,39 +189,76 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
     }
   };
 
+  const handleAudioFrame = (data: ArrayBuffer) => {
+    const frame = decodeAudioFrame(data);
+    const pending = pendingAudioRef.current;
+
+    if (frame.kind === END_OF_SENTENCE || frame.kind === END_OF_UTTERANCE) {
+      // Each sentence is played as soon as its audio is complete, while the
+      // server is still synthesizing the rest of the answer.
+      const chunks = pending.get(frame.utteranceId) ?? [];
+      pending.delete(frame.utteranceId);
+      if (chunks.length > 0) {
+        handleAudioMessage(new Blob(chunks, { type: PLAYBACK_MIME_TYPE }));
+      }
+      return;
+    }
+
+    const chunks = pending.get(frame.utteranceId) ?? [];
+    chunks.push(frame.payload);
+    pending.set(frame.utteranceId, chunks);
+  };
+
   const handleAudioMessage = (audioBlob: Blob) => {
-    // Add to audio queue
-    setAudioQueue(prev => [...prev, audioBlob]);
+    audioQueueRef.current.push(audioBlob);
     setAgentStatus('speaking');
+    if (!playingRef.current && !isMutedRef.current) {
+      playNextAudio();
+    }
   };
 
   const playNextAudio = () => {
-    if (audioQueue.length === 0) return;
-    
-    const nextAudio = audioQueue[0];
+    const nextAudio = audioQueueRef.current.shift();
+    if (!nextAudio) {
+      playingRef.current = false;
+      setAgentStatus(prev => prev === 'speaking' ? 'idle' : prev);
+      return;
+    }
+
+    playingRef.current = true;
     const audio = playAudio(nextAudio);
     audioRef.current = audio;
-    
-    audio.onended = () => {
-      // Remove the played audio from the queue
-      setAudioQueue(prev => prev.slice(1));
-      setAgentStatus(prev => prev === 'speaking' && audioQueue.length <= 1 ? 'idle' : prev);
-    };
+    audio.addEventListener('ended', () => {
+      if (audioRef.current === audio) {
+        playNextAudio();
+      }
+    });
   };
 
-  const handleBargein = () => {
-    // Stop current audio playback
+  // Stops playback and drops every sentence not played yet.
+  const clearAudio = () => {
     stopAudioPlayback(audioRef.current);
+    audioRef.current = null;
+    audioQueueRef.current = [];
+    playingRef.current = false;
+    pendingAudioRef.current.clear();
+  };
 
-    // Clear audio queue and set status to listening
-    setAudioQueue([]);
+  const handleBargein = () => {
+    // Stop current audio playback, clear the queue and set status to listening
+    clearAudio();
     setAgentStatus('listening');
   };
 
   const handleRecordingStart = async () => {
     // Implement barge-in by stopping any current audio playback
     handleBargein();
-    
+
+    if (handsFreeRef.current) {
+      await startHandsFree();
+      return;
+    }
+
     try {
       const { mediaRecorder, stream } = await startRecording();
       mediaRecorderRef.current = mediaRecorder;
@@ -203,7 +273,16 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
 
   const handleRecordingStop = async () => {
     if (!mediaRecorderRef.current || !streamRef.current) return;
-    
+
+    if (handsFreeRef.current) {
+      // Paused, not stopped: the server decodes this recording as one continuous stream
+      mediaRecorderRef.current.pause();
+      setIsRecording(false);
+      setInterim(null);
+      setAgentStatus('idle');
+      return;
+    }
+
     try {
       const audioBlob = await stopRecording(mediaRecorderRef.current, streamRef.current);
       setIsRecording(false);
@@ -229,6 +308,48 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
     }
   };
 
+  const startHandsFree = async () => {
+    const recorder = mediaRecorderRef.current;
+    try {
+      if (recorder && recorder.state === 'paused') {
+        recorder.resume();
+      } else {
+        const { mediaRecorder, stream } = await startStreaming(chunk => {
+          if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            wsRef.current.send(chunk);
+          }
+        });
+        mediaRecorderRef.current = mediaRecorder;
+        streamRef.current = stream;
+      }
+      setIsRecording(true);
+      setAgentStatus('listening');
+    } catch (error) {
+      console.error('Failed to start streaming:', error);
+      setAgentStatus('error');
+    }
+  };
+
+  // Switches between clip and stream ingest. The ingest mode is fixed per
+  // connection, so this reconnects, resuming the same session.
+  const toggleHandsFree = () => {
+    if (mediaRecorderRef.current && mediaRecorderRef.current.state !== 'inactive') {
+      mediaRecorderRef.current.ondataavailable = null;
+      mediaRecorderRef.current.stop();
+    }
+    streamRef.current?.getTracks().forEach(track => track.stop());
+    mediaRecorderRef.current = null;
+    streamRef.current = null;
+    setIsRecording(false);
+    setInterim(null);
+
+    handsFreeRef.current = !handsFreeRef.current;
+    setHandsFree(handsFreeRef.current);
+    const previous = wsRef.current;
+    connectWebSocket();
+    previous?.close();
+  };
+
   const handleTextSubmit = (e: React.FormEvent) => {
     e.preventDefault();
     
@@ -252,11 +373,15 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
   };
 
   const toggleMute = () => {
-    setIsMuted(prev => !prev);
-    
-    if (!isMuted && audioRef.current) {
-      audioRef.current.pause();
-    } else if (isMuted && audioQueue.length > 0) {
+    const muted = !isMutedRef.current;
+    isMutedRef.current = muted;
+    setIsMuted(muted);
+
+    if (muted) {
+      audioRef.current?.pause();
+    } else if (playingRef.current && audioRef.current) {
+      audioRef.current.play().catch(error => console.error('Error resuming audio:', error));
+    } else {
       playNextAudio();
     }
   };
@@ -339,20 +464,31 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
             <span>{statusDetails.label}</span>
           </div>
           
-          <Button
-            variant={isMuted ? "destructive" : "outline"}
-            size="sm"
-            onClick={toggleMute}
-            className="flex items-center"
-          >
-            {isMuted ? 'Unmute' : 'Mute'}
-          </Button>
+          <div className="flex space-x-2">
+            <Button
+              variant={handsFree ? "default" : "outline"}
+              size="sm"
+              onClick={toggleHandsFree}
+              className="flex items-center"
+            >
+              {handsFree ? 'Hands-free: On' : 'Hands-free: Off'}
+            </Button>
+
+            <Button
+              variant={isMuted ? "destructive" : "outline"}
+              size="sm"
+              onClick={toggleMute}
+              className="flex items-center"
+            >
+              {isMuted ? 'Unmute' : 'Mute'}
+            </Button>
+          </div>
         </div>
       </div>
 
       {/* Messages */}
       <div className="flex-1 p-4 overflow-y-auto">
-        {messages.length === 0 ? (
+        {messages.length === 0 && !interim && !partialReply ? (
           <div className="flex items-center justify-center h-full">
             <div className="text-center text-gray-500">
               <h2 className="text-xl font-semibold mb-2">👋 Hello!</h2>
@@ -390,6 +526,20 @@ export function VoiceAgent({ onSignOut }: VoiceAgentProps) {
                 </div>
               </div>
             ))}
+            {interim && (
+              <div className="flex justify-end">
+                <div className="max-w-[80%] bg-purple-600 text-white rounded-lg p-3 opacity-60 italic">
+                  {interim}
+                </div>
+              </div>
+            )}
+            {partialReply && (
+              <div className="flex justify-start">
+                <div className="max-w-[80%] bg-slate-200 dark:bg-slate-700 dark:text-slate-200 rounded-lg p-3 opacity-80">
+                  {partialReply}
+                </div>
+              </div>
+            )}
             <div ref={messagesEndRef} />
           </div>
         )}
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { recordingFormat, PLAYBACK_FORMAT } from './audio';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -101,8 +102,19 @@ export const profileService = {
 };
 
 // WebSocket connection for voice communication
-export const createWebSocketConnection = (token: string) => {
-  return new WebSocket(`ws://localhost:8000/ws?token=${token}`);
+// `ingest` "clip" sends each recording as one utterance; "stream" sends the
+// microphone continuously and lets the server find where utterances end.
+export const createWebSocketConnection = (
+  token: string,
+  sessionId?: string | null,
+  ingest: 'clip' | 'stream' = 'clip'
+) => {
+  // Passing the previous session id lets any backend worker resume the conversation.
+  const session = sessionId ? `&session=${encodeURIComponent(sessionId)}` : '';
+  // Audio goes both ways as Opus where the browser supports it, a fraction of
+  // the size of PCM in and MP3 out.
+  const audio = `&input=${recordingFormat().format}&output=${PLAYBACK_FORMAT}`;
+  return new WebSocket(`ws://localhost:8000/ws?token=${token}&ingest=${ingest}${session}${audio}`);
 };
 
 export default api; 
\ No newline at end of file
@@ -2,6 +2,33 @@
  * Audio utilities for recording and playback
  */
 
+// Formats the server can decode, best first (see backend/src/audio.py).
+const RECORDING_FORMATS: Array<[mimeType: string, format: string]> = [
+  ['audio/webm;codecs=opus', 'webm-opus'],
+  ['audio/ogg;codecs=opus', 'ogg-opus'],
+  ['audio/mp4', 'mp4-aac'],
+];
+
+// The MediaRecorder MIME type and matching server `input` format this browser supports.
+// Without any of ours, the browser records in its default format (no mimeType)
+// and the server detects the container itself.
+export const recordingFormat = (): { mimeType?: string; format: string } => {
+  const supported = RECORDING_FORMATS.find(
+    ([mimeType]) => typeof MediaRecorder !== 'undefined' && MediaRecorder.isTypeSupported?.(mimeType)
+  );
+  if (!supported) {
+    return { mimeType: undefined, format: 'auto' };
+  }
+  const [mimeType, format] = supported;
+  return { mimeType, format };
+};
+
+// Speech from the server, as requested with the `output` query parameter:
+// Opus where the browser can play it, MP3 (straight from the server's TTS) elsewhere.
+const canPlayOpus = typeof Audio !== 'undefined' && new Audio().canPlayType('audio/ogg; codecs=opus') !== '';
+export const PLAYBACK_FORMAT = canPlayOpus ? 'opus' : 'mp3';
+export const PLAYBACK_MIME_TYPE = canPlayOpus ? 'audio/ogg; codecs=opus' : 'audio/mpeg';
+
 // Start audio recording with the Web Audio API
 export const startRecording = async (): Promise<{
   mediaRecorder: MediaRecorder;
@@ -9,17 +36,43 @@ export const startRecording = async (): Promise<{
 }> => {
   try {
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-    const mediaRecorder = new MediaRecorder(stream);
-    const audioChunks: Blob[] = [];
+    const { mimeType } = recordingFormat();
+    const mediaRecorder = new MediaRecorder(stream, mimeType ? { mimeType } : undefined);
+
+    // No timeslice: the whole recording, container header included, arrives
+    // in one piece when it stops, and is sent as one utterance.
+    mediaRecorder.start();
+    
+    return { mediaRecorder, stream };
+  } catch (error) {
+    console.error('Error accessing microphone:', error);
+    throw new Error('Could not access microphone. Please check permissions.');
+  }
+};
+
+// How often a streamed recording hands its encoded audio to the caller.
+const STREAM_TIMESLICE_MS = 100;
+
+// Start a continuous recording for the server's `ingest=stream` mode, passing
+// encoded audio to `onChunk` as it is produced. The chunks of one recording
+// form a single stream (only the first carries the container header), so
+// pause and resume the recorder rather than starting a new one.
+export const startStreaming = async (onChunk: (chunk: Blob) => void): Promise<{
+  mediaRecorder: MediaRecorder;
+  stream: MediaStream;
+}> => {
+  try {
+    const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    const { mimeType } = recordingFormat();
+    const mediaRecorder = new MediaRecorder(stream, mimeType ? { mimeType } : undefined);
 
     mediaRecorder.ondataavailable = (event) => {
       if (event.data.size > 0) {
-        audioChunks.push(event.data);
+        onChunk(event.data);
       }
     };
+    mediaRecorder.start(STREAM_TIMESLICE_MS);
 
-    mediaRecorder.start(1000); // Collect data every second
-    
     return { mediaRecorder, stream };
   } catch (error) {
     console.error('Error accessing microphone:', error);
@@ -42,7 +95,7 @@ export const stopRecording = (
     };
 
     mediaRecorder.onstop = () => {
-      const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
+      const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType });
       
       // Stop all tracks to release microphone
       stream.getTracks().forEach((track) => track.stop());
@@ -59,9 +112,9 @@ export const playAudio = (audioBlob: Blob): HTMLAudioElement => {
   const audioUrl = URL.createObjectURL(audioBlob);
   const audio = new Audio(audioUrl);
   
-  audio.onended = () => {
+  audio.addEventListener('ended', () => {
     URL.revokeObjectURL(audioUrl);
-  };
+  });
   
   audio.play().catch(error => {
     console.error('Error playing audio:', error);
@@ -78,4 +131,28 @@ export const stopAudioPlayback = (audioElement: HTMLAudioElement | null): void =
       URL.revokeObjectURL(audioElement.src);
     }
   }
-}; 
\ No newline at end of file
+}; 
+// Binary audio frames sent by the server (see backend/src/protocol.py):
+// kind (1 byte) | utterance id (4 bytes) | sequence number (4 bytes) | payload
+// The audio frames before each END_OF_SENTENCE form a file that plays on its own.
+export const AUDIO_FRAME = 1;
+export const END_OF_UTTERANCE = 2;
+export const END_OF_SENTENCE = 3;
+const FRAME_HEADER_SIZE = 9;
+
+export interface AudioFrame {
+  kind: number;
+  utteranceId: number;
+  seq: number;
+  payload: Uint8Array;
+}
+
+export const decodeAudioFrame = (data: ArrayBuffer): AudioFrame => {
+  const view = new DataView(data);
+  return {
+    kind: view.getUint8(0),
+    utteranceId: view.getUint32(1),
+    seq: view.getUint32(5),
+    payload: new Uint8Array(data, FRAME_HEADER_SIZE),
+  };
+};